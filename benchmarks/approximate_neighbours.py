@@ -0,0 +1,95 @@
+"""
+Benchmark of the approximate neighbour mode of group (--approximate): MinHash LSH candidate pairs compared by exact
+cosine similarity against the exact top-k similarity search. Recall is the fraction of the exact neighbours (other than
+each contig itself) with a similarity of at least --min-similarity that the approximate table also holds, and the
+groups are the fraction of exact groups that are reproduced exactly.
+
+Profiles are simulated as in the barcode_profiles benchmark, or loaded from a dataset written by benchmarks.generate:
+
+    python3 -m benchmarks.approximate_neighbours --contigs 2000 --contigs 10000 --bands 32 --bands 64 --rows 2
+    python3 -m benchmarks.approximate_neighbours --data benchmark_data --contigs 0
+"""
+import itertools
+import logging
+import time
+
+import click
+import numpy as np
+from sklearn.feature_extraction.text import TfidfTransformer
+
+from benchmarks.barcode_profiles import simulate_contig_colours
+from benchmarks.generate import dataset_paths
+from commands.group import ReadBarcodes, build_barcode_profiles, count_barcodes, extract_mapping_data
+from utils.grouping import connected_groups
+from utils.similarity import approximate_top_k_neighbours, top_k_neighbours
+
+
+def neighbour_recall(exact_table, approximate_table, min_similarity):
+    """
+    :return: fraction of the exact neighbours with at least min_similarity found by the approximate table, and the
+    number of these neighbours
+    """
+    rows = np.arange(len(exact_table.indices))[:, None]
+    wanted = (exact_table.similarities >= min_similarity) & (exact_table.indices != rows)
+    found = (exact_table.indices[:, :, None] == approximate_table.indices[:, None, :]).any(axis=2)
+    return (found & wanted).sum() / max(wanted.sum(), 1), int(wanted.sum())
+
+
+def group_agreement(exact_table, approximate_table):
+    """:return: fraction of the exact groups that are also approximate groups"""
+    exact_groups = {tuple(contig_group) for contig_group in connected_groups(exact_table)}
+    approximate_groups = {tuple(contig_group) for contig_group in connected_groups(approximate_table)}
+    return len(exact_groups & approximate_groups) / max(len(exact_groups), 1)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def dataset_profiles(directory):
+    """TF-IDF profiles of the NLR contigs of a generated dataset, barcodes are corrected from the fastq file"""
+    paths = dataset_paths(directory)
+    contig_reads = extract_mapping_data(paths['sam'], paths['bait_blast'])
+    contigs, profile_counts = build_barcode_profiles(contig_reads,
+                                                     ReadBarcodes(paths['fastq'], paths['whitelist'], 1000000))
+    return contigs, TfidfTransformer().fit_transform(profile_counts)
+
+
+@click.command()
+@click.option('--contigs', type=int, multiple=True, default=[2000, 10000],
+              help="Number of simulated contigs, 0 to only use --data")
+@click.option('--reads', type=int, default=50, help="Mean number of reads mapped to each simulated contig")
+@click.option('--data', type=str, default=None, help="Directory of a dataset written by benchmarks.generate")
+@click.option('--neighbours', type=int, default=6, help="Number of neighbours of each contig")
+@click.option('--bands', type=int, multiple=True, default=[32, 64], help="Number of LSH bands")
+@click.option('--rows', type=int, multiple=True, default=[2], help="Number of MinHash values in each band")
+@click.option('--min-similarity', type=float, default=0.5,
+              help="Minimum similarity of the exact neighbours counted for recall")
+def main(contigs, reads, data, neighbours, bands, rows, min_similarity):
+    logging.disable(logging.ERROR)
+    rng = np.random.default_rng(22)
+    datasets = []
+    for n_contigs in (n_contigs for n_contigs in contigs if n_contigs > 0):
+        contig_colours = simulate_contig_colours(n_contigs, reads, rng)
+        datasets.append((f'simulated {n_contigs}', list(contig_colours),
+                         TfidfTransformer().fit_transform(count_barcodes(contig_colours))))
+    if data is not None:
+        datasets.append((data, *dataset_profiles(data)))
+
+    print(f'{"profiles":>20} {"contigs":>8} {"lsh":>6} {"exact (s)":>10} {"approx (s)":>11} {"speed-up":>9} '
+          f'{"neighbours":>11} {"recall":>7} {"groups":>7}')
+    for name, contig_names, profiles in datasets:
+        exact_time, exact_table = timed(top_k_neighbours, contig_names, profiles, neighbours)
+        for n_bands, n_rows in itertools.product(bands, rows):
+            approximate_time, approximate_table = timed(approximate_top_k_neighbours, contig_names, profiles,
+                                                        neighbours, n_bands, n_rows)
+            recall, n_neighbours = neighbour_recall(exact_table, approximate_table, min_similarity)
+            print(f'{name:>20} {len(contig_names):>8} {f"{n_bands}x{n_rows}":>6} {exact_time:>10.2f} '
+                  f'{approximate_time:>11.2f} {exact_time / approximate_time:>8.1f}x {n_neighbours:>11} '
+                  f'{recall:>7.3f} {group_agreement(exact_table, approximate_table):>7.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Throughput benchmark of barcode correction: the BarcodeCorrector batch binary searches of the sorted whitelist codes
+against the original regex search of the whole whitelist used by index_subfile.
+
+    python3 -m benchmarks.barcode_correction --barcodes 100000 --reads 20000
+"""
+import random
+import re
+import time
+
+import click
+
+from utils.barcodes import BarcodeCorrector
+
+BASES = 'ACGT'
+
+
+def regex_correct(raw_adapter, search_set):
+    """The original adapter_correcter from index_subfile, kept as the baseline"""
+    if 'N' in raw_adapter:
+        search_string = raw_adapter.replace('N', '[ATCG]')
+        true_adapter = re.search(fr'{search_string}', str(search_set))
+        if true_adapter:
+            return true_adapter.group()
+
+    else:
+        return raw_adapter
+
+
+def simulate_barcodes(whitelist, n_reads, error_rate):
+    """Draw barcodes from the whitelist, adding an N or a substitution to a fraction of them"""
+    raw_barcodes = []
+    for _ in range(n_reads):
+        barcode = list(random.choice(whitelist))
+        if random.random() < error_rate:
+            position = random.randrange(16)
+            if random.random() < 0.5:
+                barcode[position] = 'N'
+            else:
+                barcode[position] = random.choice([base for base in BASES if base != barcode[position]])
+        raw_barcodes.append(''.join(barcode))
+
+    return raw_barcodes
+
+
+def reads_per_second(correct, raw_barcodes):
+    start = time.perf_counter()
+    corrected = [correct(barcode) for barcode in raw_barcodes]
+    return len(raw_barcodes) / (time.perf_counter() - start), corrected
+
+
+@click.command()
+@click.option('--barcodes', type=int, default=100000, help="Number of barcodes in the simulated whitelist")
+@click.option('--reads', type=int, default=20000, help="Number of simulated reads")
+@click.option('--error-rate', type=float, default=0.1, help="Fraction of barcodes with an N or a substitution")
+def main(barcodes, reads, error_rate):
+    random.seed(22)
+    whitelist = list({''.join(random.choice(BASES) for _ in range(16)) for _ in range(barcodes)})
+    raw_barcodes = simulate_barcodes(whitelist, reads, error_rate)
+
+    start = time.perf_counter()
+    corrector = BarcodeCorrector.from_whitelist(whitelist)
+    build_time = time.perf_counter() - start
+
+    regex_rate, regex_corrected = reads_per_second(lambda barcode: regex_correct(barcode, whitelist), raw_barcodes)
+    start = time.perf_counter()
+    hash_corrected = [None if barcode_id < 0 else whitelist[barcode_id] for barcode_id in
+                      corrector.correct_ids(raw_barcodes)]
+    hash_rate = len(raw_barcodes) / (time.perf_counter() - start)
+
+    ambiguous = [i for i, barcode in enumerate(raw_barcodes) if 'N' in barcode]
+    agreement = sum(regex_corrected[i] == hash_corrected[i] for i in ambiguous) / max(len(ambiguous), 1)
+
+    print(f'whitelist: {barcodes} barcodes, reads: {reads}, error rate: {error_rate}')
+    print(f'BarcodeCorrector build time: {build_time:.2f} s')
+    print(f'regex search:     {regex_rate:12.0f} reads/sec')
+    print(f'BarcodeCorrector: {hash_rate:12.0f} reads/sec ({hash_rate / regex_rate:.0f}x)')
+    print(f'agreement on barcodes with N: {agreement * 100:.2f}%')
+    whitelisted = set(whitelist)
+    print(f'reads assigned a whitelist barcode: regex {sum(c in whitelisted for c in regex_corrected)}, '
+          f'BarcodeCorrector {sum(c in whitelisted for c in hash_corrected)}')
+
+
+if __name__ == '__main__':
+    main()
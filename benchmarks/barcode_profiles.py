@@ -0,0 +1,66 @@
+"""
+Benchmark of barcode profile construction: the integer CSR builder (count_barcodes + TfidfTransformer) against the
+original string pipeline (hexidecimal colour strings joined per contig and tokenised by TfidfVectorizer). The TF-IDF
+matrices produced by both are checked to be identical.
+
+    python3 -m benchmarks.barcode_profiles --contigs 10000 --contigs 50000 --contigs 200000
+"""
+import time
+
+import click
+import numpy as np
+from sklearn.feature_extraction.text import TfidfTransformer, TfidfVectorizer
+
+from commands.group import count_barcodes
+
+
+def simulate_contig_colours(n_contigs, reads_per_contig, rng):
+    """Colours of the reads mapped to each contig, contigs from the same molecule share a set of barcodes"""
+    molecule_barcodes = rng.integers(1, 1 << 24, size=(n_contigs // 2 + 1, 20), dtype=np.uint32)
+    molecules = rng.integers(0, len(molecule_barcodes), size=n_contigs)
+    contig_colours = {}
+    for contig, molecule in enumerate(molecules):
+        n_reads = rng.poisson(reads_per_contig) + 1
+        colours = rng.choice(molecule_barcodes[molecule], size=n_reads)
+        colours[rng.random(n_reads) < 0.05] = 0  # reads without a barcode are black
+        contig_colours[str(contig)] = colours
+
+    return contig_colours
+
+
+def string_pipeline(contig_colours):
+    contig_hex_dictionary = {contig: ['#%06x' % colour for colour in colours] for contig, colours in
+                             contig_colours.items()}
+    contig_adapter_profiles = [" ".join(contig_hex_dictionary[contig]) for contig in contig_hex_dictionary]
+    return TfidfVectorizer().fit_transform(contig_adapter_profiles)
+
+
+def integer_pipeline(contig_colours):
+    return TfidfTransformer().fit_transform(count_barcodes(contig_colours))
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+@click.command()
+@click.option('--contigs', type=int, multiple=True, default=[10000, 50000, 200000], help="Number of contigs")
+@click.option('--reads', type=int, default=50, help="Mean number of reads mapped to each contig")
+def main(contigs, reads):
+    rng = np.random.default_rng(22)
+    print(f'{"contigs":>10} {"string (s)":>12} {"integer (s)":>12} {"speed-up":>9} {"identical":>10}')
+    for n_contigs in contigs:
+        contig_colours = simulate_contig_colours(n_contigs, reads, rng)
+        string_time, string_tfidf = timed(string_pipeline, contig_colours)
+        integer_time, integer_tfidf = timed(integer_pipeline, contig_colours)
+        identical = (np.array_equal(string_tfidf.indptr, integer_tfidf.indptr) and
+                     np.array_equal(string_tfidf.indices, integer_tfidf.indices) and
+                     np.array_equal(string_tfidf.data, integer_tfidf.data))
+        print(f'{n_contigs:>10} {string_time:>12.2f} {integer_time:>12.2f} {string_time / integer_time:>8.1f}x '
+              f'{str(identical):>10}')
+
+
+if __name__ == '__main__':
+    main()
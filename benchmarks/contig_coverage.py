@@ -0,0 +1,121 @@
+"""
+Benchmark of contig coverage: the grouped engine (calculate_group_coverage) against the original contig class, which
+filtered the whole BLAST table and sorted the hits separately for every group. The summaries are checked to be
+identical for every group whose best chromosome is not tied (the original left ties to the order of value_counts).
+
+    python3 -m benchmarks.contig_coverage --groups 1000 --groups 5000 --groups 20000
+"""
+import logging
+import time
+
+import click
+import numpy as np
+import pandas as pd
+
+from commands.contig_coverage import calculate_group_coverage
+
+
+class LegacyContig:
+    """The original contig class"""
+
+    def __init__(self, name, data):
+        self.name = name
+        self.sub_contigs = list(map(int, name.split("_")))
+        self.blast = data[data[0].isin(self.sub_contigs)]
+        self.chromosome = None
+        self.genome_coverage = None
+        self.contig_count = 0
+        self.contig_total = len(self.sub_contigs)
+        self.genome_coordinates = 'XXX'
+        self.tied = False
+
+    def calculate_coverage(self):
+        cond = self.blast[8] > self.blast[9]
+        self.blast.loc[cond, [8, 9]] = self.blast.loc[cond, [9, 8]].values
+
+        votes = self.blast.sort_values(by=[11, 13], ascending=False).drop_duplicates(0)[1].value_counts()
+        self.tied = len(votes) > 1 and votes.iloc[0] == votes.iloc[1]
+        best_chromosome = votes.idxmax()
+        filtered = self.blast[self.blast[1] == best_chromosome]
+        final = filtered.sort_values(by=[11, 13], ascending=False).drop_duplicates(0)
+
+        start = int(min(final[8]))
+        end = int(max(final[9]))
+
+        self.chromosome = best_chromosome
+        self.genome_coverage = end - start
+        self.contig_count = len(final)
+        self.genome_coordinates = f"{best_chromosome}:{start}-{end}"
+
+    def get_data(self):
+        return self.name, self.contig_count, self.contig_total, self.chromosome, self.genome_coverage, \
+            self.genome_coordinates
+
+
+def legacy_group_coverage(blast, grouped_contigs):
+    pd.options.mode.chained_assignment = None
+    contig_dict = {contig_group: LegacyContig(contig_group, blast) for contig_group in grouped_contigs}
+    for k in contig_dict.keys():
+        try:
+            contig_dict[k].calculate_coverage()
+        except ValueError:
+            pass
+    return pd.DataFrame([contig_dict[k].get_data() for k in contig_dict.keys()]), \
+        np.array([contig_dict[k].tied for k in contig_dict.keys()])
+
+
+def simulate_blast(n_groups, rng):
+    """Groups of 2 to 6 contigs, each contig with 0 to 4 hits on 8 chromosomes"""
+    group_sizes = rng.integers(2, 7, size=n_groups)
+    contigs = np.arange(group_sizes.sum())
+    rng.shuffle(contigs)
+    grouped_contigs = ["_".join(map(str, group)) for group in np.split(contigs, np.cumsum(group_sizes)[:-1])]
+
+    hit_counts = rng.integers(0, 5, size=len(contigs))
+    queries = np.repeat(np.arange(len(contigs)), hit_counts)
+    n_hits = len(queries)
+    starts = rng.integers(1, 50000000, size=n_hits)
+    lengths = rng.integers(100, 5000, size=n_hits)
+    reverse = rng.random(n_hits) < 0.5
+    query_lengths = rng.integers(5000, 10000, size=n_hits)
+    blast = pd.DataFrame({0: queries, 1: rng.choice([f"Chr{i}" for i in range(1, 9)], size=n_hits),
+                          2: 99.0, 3: lengths, 4: 0, 5: 0, 6: 1, 7: lengths,
+                          8: np.where(reverse, starts + lengths, starts), 9: np.where(reverse, starts, starts + lengths),
+                          10: 1e-50, 11: rng.random(n_hits) * 1000, 12: query_lengths})
+    blast[13] = (blast[7] - blast[6]) * 100 / blast[12]
+    return blast, grouped_contigs
+
+
+def normalise(summary):
+    """Summary as strings, the size of the region covered is an integer even if some groups have no hits"""
+    summary = summary.copy()
+    summary[4] = pd.to_numeric(summary[4]).astype("Int64")
+    return summary.astype(str)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+@click.command()
+@click.option('--groups', type=int, multiple=True, default=[1000, 5000, 20000], help="Number of contig groups")
+def main(groups):
+    logging.disable(logging.ERROR)  # groups without hits are logged by both implementations
+    rng = np.random.default_rng(22)
+    print(f'{"groups":>10} {"original (s)":>13} {"engine (s)":>11} {"speed-up":>9} {"ties":>6} {"identical":>10}')
+    for n_groups in groups:
+        blast, grouped_contigs = simulate_blast(n_groups, rng)
+        legacy_time, (legacy_summary, tied) = timed(legacy_group_coverage, blast.copy(), grouped_contigs)
+        engine_time, summary = timed(calculate_group_coverage, blast, grouped_contigs)
+
+        compared = ~tied
+        identical = bool((normalise(legacy_summary[compared]) == normalise(summary[compared])).all(axis=None))
+        print(f'{n_groups:>10} {legacy_time:>13.2f} {engine_time:>11.2f} {legacy_time / engine_time:>8.0f}x '
+              f'{tied.sum():>6} {str(identical):>10}')
+        assert identical, 'summary differs from the original contig class'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+Deterministic generator of synthetic NLR-Assembler inputs at a configurable scale: a barcode whitelist, 10x-style R1
+reads (16 bp barcode followed by the insert), a draft assembly, a coordinate sorted SAM file of the reads mapped to the
+assembly, RenSeq bait alignments, NLR sequences with alignments of a draft and final assembly to them, a final (grouped)
+assembly and an alignment of the draft contigs to a reference genome.
+
+Contigs are generated in molecules of 1 to 4 contigs whose reads share a set of barcodes, so the group command has real
+structure to recover. As in the index command, the random module is seeded with 22 so the same files are generated
+each time.
+
+    python3 -m benchmarks.generate --directory benchmark_data --contigs 2000 --reads-per-contig 50
+"""
+import os
+import random
+
+import click
+
+BASES = 'ACGT'
+BARCODE_LENGTH = 16
+INSERT_LENGTH = 50
+SPACER = 'N' * 1000
+
+
+def random_sequence(length):
+    return ''.join(random.choices(BASES, k=length))
+
+
+def dataset_paths(directory):
+    """
+    :param directory: directory of a dataset
+    :return: dictionary of the name: path of each file of the dataset
+    """
+    return {name: os.path.join(directory, file) for name, file in (
+        ('whitelist', 'whitelist.txt'), ('fastq', 'R1.fastq'), ('assembly', 'assembly.fasta'),
+        ('sam', 'mapping.sam'), ('bait_blast', 'contig_bait.blastn'), ('nlr', 'nlr_sequences.fasta'),
+        ('draft_nlr_blast', 'draft_nlr_coverage.blastn'), ('final_nlr_blast', 'final_nlr_coverage.blastn'),
+        ('final_assembly', 'final_assembly.fasta'), ('genome_blast', 'contig_coverage.blastn'))}
+
+
+def generate_dataset(directory, contigs=2000, reads_per_contig=50, barcodes=20000, nlrs=500, seed=22):
+    """
+    Writes a synthetic dataset to a directory
+
+    :param directory: output directory, created if it does not exist
+    :param contigs: number of contigs in the draft assembly
+    :param reads_per_contig: mean number of reads mapped to each contig
+    :param barcodes: number of barcodes in the whitelist
+    :param nlrs: number of NLR sequences in the reference
+    :param seed: seed of the random module
+    :return: dictionary of the name: path of each file written
+    """
+    random.seed(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = dataset_paths(directory)
+
+    whitelist = list(dict.fromkeys(random_sequence(BARCODE_LENGTH) for _ in range(barcodes)))
+    with open(paths['whitelist'], 'w') as file:
+        file.write('\n'.join(whitelist) + '\n')
+
+    # molecules of 1 to 4 contigs share a set of barcodes and a region of the genome
+    contig_ids = list(range(1, contigs + 1))
+    molecules = []
+    while sum(map(len, molecules)) < contigs:
+        start = sum(map(len, molecules))
+        molecules.append(contig_ids[start:start + random.choice([1, 1, 2, 3, 4])])
+    molecule_barcodes = [random.sample(whitelist, 10) for _ in molecules]
+    sequences = {contig: random_sequence(random.randint(300, 3000)) for contig in contig_ids}
+
+    with open(paths['assembly'], 'w') as file:
+        for contig in contig_ids:
+            file.write(f'>{contig}\n{sequences[contig]}\n')
+
+    # reads: 80% carry a barcode of their molecule, 5% have an ambiguous base and 3% a substitution in the barcode
+    records = []
+    read_number = 0
+    with open(paths['fastq'], 'w') as fastq:
+        for molecule, molecule_contigs in enumerate(molecules):
+            for contig in molecule_contigs:
+                for _ in range(max(1, int(random.gauss(reads_per_contig, reads_per_contig / 5)))):
+                    barcode = list(random.choice(molecule_barcodes[molecule]) if random.random() < 0.8 else
+                                   random.choice(whitelist))
+                    error = random.random()
+                    if error < 0.05:
+                        barcode[random.randrange(BARCODE_LENGTH)] = 'N'
+                    elif error < 0.08:
+                        barcode[random.randrange(BARCODE_LENGTH)] = random.choice(BASES)
+
+                    position = random.randint(1, len(sequences[contig]) - INSERT_LENGTH)
+                    insert = sequences[contig][position - 1:position - 1 + INSERT_LENGTH]
+                    quality = ''.join(random.choices('@ABCDEFGHIJ#:F', k=BARCODE_LENGTH + INSERT_LENGTH))
+                    name = f'A00123:8:H5KJ2DSXY:{read_number % 4 + 1}:{1101 + read_number // 1000}:{read_number}'
+                    fastq.write(f'@{name} 1:N:0:ACGTACGT\n{"".join(barcode)}{insert}\n+\n{quality}\n')
+                    records.append((contig, position, f'{name}\t0\t{contig}\t{position}\t60\t{INSERT_LENGTH}M\t*\t0\t0'
+                                                      f'\t{insert}\t{quality[BARCODE_LENGTH:]}\n'))
+                    read_number += 1
+
+    records.sort(key=lambda record: record[:2])
+    with open(paths['sam'], 'w') as sam:
+        sam.write('@HD\tVN:1.6\tSO:coordinate\n')
+        for contig in contig_ids:
+            sam.write(f'@SQ\tSN:{contig}\tLN:{len(sequences[contig])}\n')
+        sam.write('@PG\tID:bwa\tPN:bwa\tVN:0.7.17\n')
+        sam.writelines(record[2] for record in records)
+
+    # bait alignments: 60% of contigs are NLR contigs with a hit passing the 80% identity and length filters
+    with open(paths['bait_blast'], 'w') as file:
+        for contig in contig_ids:
+            for _ in range(random.randint(1, 3) if random.random() < 0.6 else 0):
+                identity = round(random.uniform(75, 100), 3)
+                length = random.randint(60, 120)
+                start = random.randint(1, len(sequences[contig]) - length)
+                file.write(f'bait{random.randint(1, 500)}\t{contig}\t{identity}\t{length}\t{random.randint(0, 5)}\t0'
+                           f'\t1\t{length}\t{start}\t{start + length - 1}\t1e-30\t{length * 1.8:.1f}\n')
+
+    # NLR reference sequences (wrapped at 80 bases) and alignments of the draft and final assemblies to them
+    nlr_lengths = {f'NLR{i}': random.randint(2000, 8000) for i in range(1, nlrs + 1)}
+    with open(paths['nlr'], 'w') as file:
+        for name, length in nlr_lengths.items():
+            sequence = random_sequence(length)
+            file.write(f'>{name} chr{random.randint(1, 7)}\n')
+            file.writelines(sequence[i:i + 80] + '\n' for i in range(0, length, 80))
+
+    for name, n_contigs, hit_fraction in (('draft_nlr_blast', contigs, 0.5), ('final_nlr_blast', len(molecules), 0.7)):
+        with open(paths[name], 'w') as file:
+            for contig in range(1, n_contigs + 1):
+                for _ in range(random.randint(1, 4) if random.random() < hit_fraction else 0):
+                    nlr = random.choice(list(nlr_lengths))
+                    length = random.randint(100, 2000)
+                    start = random.randint(1, nlr_lengths[nlr] - length)
+                    end = start + length - 1
+                    if random.random() < 0.5:
+                        start, end = end, start
+                    file.write(f'{contig}\t{nlr}\t{round(random.uniform(90, 100), 3)}\t{length}\t0\t0\t1\t{length}'
+                               f'\t{start}\t{end}\t1e-50\t{length * 1.8:.1f}\n')
+
+    # final assembly of the grouped molecules and alignments of the draft contigs to a reference genome (with qlen)
+    with open(paths['final_assembly'], 'w') as file:
+        for molecule_contigs in molecules:
+            file.write(f'>{"_".join(map(str, molecule_contigs))}\n'
+                       f'{SPACER.join(sequences[contig] for contig in molecule_contigs)}\n')
+
+    with open(paths['genome_blast'], 'w') as file:
+        for molecule_contigs in molecules:
+            chromosome = f'Chr{random.randint(1, 7)}'
+            region = random.randint(1, 500000000)
+            for contig in molecule_contigs:
+                for hit in range(random.randint(0, 3)):
+                    hit_chromosome = chromosome if hit == 0 else random.choice([chromosome, 'ChrUnknown',
+                                                                                f'Chr{random.randint(1, 7)}'])
+                    length = random.randint(200, len(sequences[contig]))
+                    start = region + random.randint(0, 60000)
+                    file.write(f'{contig}\t{hit_chromosome}\t{round(random.uniform(90, 100), 3)}\t{length}\t0\t0\t1'
+                               f'\t{length}\t{start}\t{start + length - 1}\t1e-50\t{length * 1.8:.1f}'
+                               f'\t{len(sequences[contig])}\n')
+
+    return paths
+
+
+@click.command()
+@click.option('--directory', type=str, required=True, help="Output directory")
+@click.option('--contigs', type=int, default=2000, help="Number of contigs in the draft assembly")
+@click.option('--reads-per-contig', type=int, default=50, help="Mean number of reads mapped to each contig")
+@click.option('--barcodes', type=int, default=20000, help="Number of barcodes in the whitelist")
+@click.option('--nlrs', type=int, default=500, help="Number of NLR sequences")
+def main(directory, contigs, reads_per_contig, barcodes, nlrs):
+    for name, path in generate_dataset(directory, contigs, reads_per_contig, barcodes, nlrs).items():
+        print(f'{name}: {path}')
+
+
+if __name__ == '__main__':
+    main()
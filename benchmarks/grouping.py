@@ -0,0 +1,109 @@
+"""
+Benchmark of contig grouping: the disjoint-set grouping engine (group_contigs) against the original passes that
+deduplicated the neighbour group of each contig, greedily merged overlapping groups and then removed groups sharing
+contigs. Both are run on the same neighbour tables of simulated barcode profiles.
+
+The original merge is not transitive, when a group overlaps two groups that were kept apart the smaller group is later
+removed and its other contigs are lost. The disjoint-set engine keeps these contigs, so the groups are checked to be
+identical whenever the original passes did not drop any contigs, and otherwise every original group is checked to be
+contained in one new group.
+
+    python3 -m benchmarks.grouping --contigs 2000 --contigs 10000 --contigs 20000
+"""
+import time
+from collections import Counter
+
+import click
+import numpy as np
+from sklearn.feature_extraction.text import TfidfTransformer
+
+from benchmarks.barcode_profiles import simulate_contig_colours
+from commands.group import count_barcodes, group_contigs
+from utils.similarity import top_k_neighbours
+
+
+def legacy_grouping(neighbour_table):
+    """The original group_contigs, merge_contig_groups and remove_subset_contigs passes"""
+
+    def dynamic_grouping(row):
+        contigs = [neighbour_table.contigs[i] for i in neighbour_table.indices[row]]
+        similarities = neighbour_table.similarities[row]
+        threshold = similarities[1] if len(similarities) > 1 else 0
+        if threshold < 0.5:
+            return sorted([contigs[0]])
+        return sorted([contig for contig, similarity in zip(contigs, similarities) if similarity > (threshold - 0.1)])
+
+    contig_groups = []
+    for i in range(len(neighbour_table.contigs)):
+        target_contig_group = dynamic_grouping(i)
+        if target_contig_group not in contig_groups:
+            contig_groups.append(target_contig_group)
+
+    merged_lists = {}
+    for lst in contig_groups:
+        overlap_found = False
+        for key in merged_lists:
+            if any(elem in lst for elem in merged_lists[key]):
+                merged_lists[key].extend(lst)
+                overlap_found = True
+                break
+        if not overlap_found:
+            merged_lists[tuple(lst)] = lst
+
+    nr_list = [sorted(set(merged)) for merged in merged_lists.values()]
+    nr_list.sort(key=len, reverse=True)
+    count = Counter(contig for contig_group in nr_list for contig in contig_group)
+    for contig in [k for k in count if count[k] > 1]:
+        query_group = [cgroup for cgroup in nr_list if contig in cgroup]
+        if len(query_group) < 2:
+            continue
+        nr_list.remove(min(query_group, key=len))
+
+    return nr_list
+
+
+def check_groups(legacy_groups, groups):
+    """
+    :return: number of contigs dropped by the original passes, raises AssertionError if the groups are inconsistent
+    """
+    legacy_contigs = {contig for contig_group in legacy_groups for contig in contig_group}
+    contigs = {contig for contig_group in groups for contig in contig_group}
+    assert legacy_contigs <= contigs, 'contigs missing from the disjoint-set groups'
+
+    if legacy_contigs == contigs and sum(map(len, legacy_groups)) == len(legacy_contigs):
+        assert legacy_groups == groups, 'groups differ although no contigs were dropped'
+    else:
+        group_of = {contig: i for i, contig_group in enumerate(groups) for contig in contig_group}
+        for contig_group in legacy_groups:
+            assert len({group_of[contig] for contig in contig_group}) == 1, 'an original group was split'
+
+    return len(contigs - legacy_contigs)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+@click.command()
+@click.option('--contigs', type=int, multiple=True, default=[2000, 10000, 20000], help="Number of contigs")
+@click.option('--reads', type=int, default=50, help="Mean number of reads mapped to each contig")
+def main(contigs, reads):
+    rng = np.random.default_rng(22)
+    print(f'{"contigs":>10} {"original (s)":>13} {"union-find (s)":>15} {"speed-up":>9} {"groups":>7} '
+          f'{"dropped":>8}')
+    for n_contigs in contigs:
+        contig_colours = simulate_contig_colours(n_contigs, reads, rng)
+        profiles = TfidfTransformer().fit_transform(count_barcodes(contig_colours))
+        neighbour_table = top_k_neighbours(list(contig_colours), profiles, 6)
+
+        legacy_time, legacy_groups = timed(legacy_grouping, neighbour_table)
+        new_time, groups = timed(group_contigs, neighbour_table)
+        dropped = check_groups(legacy_groups, groups)
+        print(f'{n_contigs:>10} {legacy_time:>13.2f} {new_time:>15.2f} {legacy_time / new_time:>8.1f}x '
+              f'{len(groups):>7} {dropped:>8}')
+
+
+if __name__ == '__main__':
+    main()
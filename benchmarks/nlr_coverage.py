@@ -0,0 +1,91 @@
+"""
+Benchmark of NLR coverage: the interval union engine (calculate_NLR_coverage) against the original NLR class, which
+added one to a float64 array for every base of every BLAST hit. The coverage of every NLR and the per-base depth runs
+(expanded back to arrays) are checked to be identical to the original.
+
+    python3 -m benchmarks.nlr_coverage --hits 1000 --hits 10000 --hits 50000
+"""
+import time
+
+import click
+import numpy as np
+import pandas as pd
+
+from commands.nlr_coverage import NLR, calculate_NLR_coverage
+from utils.intervals import depth_runs
+
+
+class LegacyNLR:
+    """The original NLR class"""
+
+    def __init__(self, name, seq_length):
+        self.name = name
+        self.coverage_array = np.zeros(seq_length)
+        self.coverage = 0
+
+    def add_coverage(self, start, end):
+        for n in list(range(start - 1, end, 1)):
+            self.coverage_array[n] += 1
+
+    def get_coverage(self):
+        return (np.count_nonzero(self.coverage_array) * 100) / len(self.coverage_array)
+
+
+def simulate_hits(n_nlrs, n_hits, rng):
+    """NLR lengths and BLAST hits of 100 bp to 3 kb"""
+    lengths = {f'NLR{i}': int(length) for i, length in enumerate(rng.integers(500, 10000, size=n_nlrs))}
+    names = np.array(list(lengths))
+    subjects = rng.integers(0, n_nlrs, size=n_hits)
+    subject_lengths = np.array(list(lengths.values()))[subjects]
+    hit_lengths = rng.integers(100, 3000, size=n_hits)
+    starts = rng.integers(1, np.maximum(subject_lengths - hit_lengths, 1) + 1)
+    ends = np.minimum(starts + hit_lengths - 1, subject_lengths)
+    return lengths, pd.DataFrame({'subject': names[subjects], 'start': starts, 'end': ends})
+
+
+def legacy_coverage(lengths, blast_data):
+    nlr_class_dict = {name: LegacyNLR(name, length) for name, length in lengths.items()}
+    [nlr_class_dict[val[0]].add_coverage(val[1], val[2]) for val in blast_data.itertuples(index=False)]
+    return nlr_class_dict, np.asarray([nlr.get_coverage() for nlr in nlr_class_dict.values()])
+
+
+def engine_coverage(lengths, blast_data):
+    return calculate_NLR_coverage({name: NLR(name, length) for name, length in lengths.items()}, blast_data)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+@click.command()
+@click.option('--hits', type=int, multiple=True, default=[1000, 10000, 50000], help="Number of BLAST hits")
+@click.option('--nlrs', type=int, default=2000, help="Number of NLR sequences")
+def main(hits, nlrs):
+    rng = np.random.default_rng(22)
+    print(f'{"hits":>10} {"original (s)":>13} {"engine (s)":>11} {"speed-up":>9} {"identical":>10}')
+    for n_hits in hits:
+        lengths, blast_data = simulate_hits(nlrs, n_hits, rng)
+        legacy_time, (legacy_nlrs, legacy_coverage_array) = timed(legacy_coverage, lengths, blast_data)
+        engine_time, coverage_array = timed(engine_coverage, lengths, blast_data)
+
+        identical = np.array_equal(legacy_coverage_array, coverage_array) and \
+            legacy_coverage_array.mean() == coverage_array.mean()
+
+        # expand the depth runs to per-base arrays and compare them to the original arrays
+        names = list(lengths)
+        subjects = pd.Categorical(blast_data['subject'], categories=names).codes
+        depth = {name: np.zeros(length) for name, length in lengths.items()}
+        for sequence, start, end, run_depth in zip(*depth_runs(list(lengths.values()), subjects,
+                                                               blast_data['start'], blast_data['end'])):
+            depth[names[sequence]][start:end] = run_depth
+        identical &= all(np.array_equal(depth[name], legacy_nlrs[name].coverage_array) for name in names)
+
+        print(f'{n_hits:>10} {legacy_time:>13.2f} {engine_time:>11.3f} {legacy_time / engine_time:>8.0f}x '
+              f'{str(identical):>10}')
+        assert identical, 'coverage differs from the original NLR class'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Start-up budget of the command line and of spawned pool workers. Each entry point is started in a new interpreter
+(-X importtime) from the repository root: the help of each command, and the imports of a spawned worker (main.py run as
+__mp_main__ followed by the module of its worker function). An entry point fails if it imports a module it should not
+(e.g. scikit-learn for index) or its fastest start-up exceeds its budget, and the script then exits with status 1.
+
+    python3 -m benchmarks.startup
+    python3 -m benchmarks.startup --repeat 5 --scale 2
+"""
+import os
+import subprocess
+import sys
+import time
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('pandas', 'sklearn', 'scipy')
+
+# entry point: arguments of the interpreter, modules it must not import, budget (seconds)
+ENTRY_POINTS = {
+    'main.py': (['main.py'], HEAVY, 0.5),
+    'index --help': (['main.py', 'index', '--help'], HEAVY, 0.5),
+    'group --help': (['main.py', 'group', '--help'], ('sklearn',), 1.5),
+    'pipeline --help': (['main.py', 'pipeline', '--help'], ('sklearn',), 1.5),
+    'nlr-coverage --help': (['main.py', 'nlr-coverage', '--help'], ('sklearn', 'scipy'), 1.0),
+    'contig-coverage --help': (['main.py', 'contig-coverage', '--help'], ('sklearn', 'scipy'), 1.0),
+    'serve --help': (['main.py', 'serve', '--help'], ('sklearn',), 1.5),
+    'index worker': (['-c', "import runpy; runpy.run_path('main.py', run_name='__mp_main__'); import commands.index"],
+                     HEAVY, 0.5),
+    'similarity worker': (['-c', "import runpy; runpy.run_path('main.py', run_name='__mp_main__'); "
+                                 "import utils.similarity"], ('pandas', 'sklearn'), 0.75),
+}
+
+
+def start(arguments):
+    """
+    :param arguments: arguments of a new interpreter started in the repository root
+    :return: wall time of the run and set of the top-level packages it imported
+    """
+    wall = time.perf_counter()
+    run = subprocess.run([sys.executable, '-X', 'importtime', *arguments], cwd=ROOT, capture_output=True, text=True)
+    wall = time.perf_counter() - wall
+    if run.returncode not in (0, 2):  # click exits with 2 when main.py is run without a command
+        raise click.ClickException(f"{' '.join(arguments)} failed:\n{run.stderr}")
+    # lines of -X importtime: "import time: self [us] | cumulative | module"
+    packages = {line.rsplit('|', 1)[1].strip().split('.')[0] for line in run.stderr.splitlines()
+                if line.startswith('import time:') and line.count('|') == 2}
+    return wall, packages
+
+
+@click.command()
+@click.option('--repeat', type=click.IntRange(min=1), default=3, help="Number of runs of each entry point")
+@click.option('--scale', type=float, default=1.0, help="Factor applied to every budget, for slower machines")
+def main(repeat, scale):
+    print(f'{"entry point":>24} {"start-up (s)":>13} {"budget (s)":>11}  heavy imports')
+    failed = False
+    for name, (arguments, forbidden, budget) in ENTRY_POINTS.items():
+        runs = [start(arguments) for _ in range(repeat)]
+        wall = min(wall for wall, _ in runs)
+        imported = sorted(set.union(*(packages for _, packages in runs)) & set(HEAVY))
+        failure = (wall > budget * scale) or bool(set(imported) & set(forbidden))
+        failed |= failure
+        print(f'{name:>24} {wall:>13.3f} {budget * scale:>11.2f}  {", ".join(imported) or "-"}'
+              f'{"  FAILED" if failure else ""}')
+    sys.exit(int(failed))
+
+
+if __name__ == '__main__':
+    main()
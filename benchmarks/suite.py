@@ -0,0 +1,240 @@
+"""
+Benchmark suite covering every stage of the pipeline on a synthetic dataset (see benchmarks.generate). Each stage is run
+in-process on a single core and its wall time, CPU time and peak memory allocated (traced with tracemalloc in a separate
+run, so tracing does not slow down the timed run) are written to a JSON file. Given the JSON file of an earlier run,
+stages that have slowed down by more than the tolerance are reported and the suite exits with status 1.
+
+    python3 -m benchmarks.suite --output benchmark.json
+    python3 -m benchmarks.suite --output new.json --baseline benchmark.json
+"""
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import click
+
+from benchmarks.generate import dataset_paths, generate_dataset
+from commands.contig_coverage import calculate_group_coverage, load_blast_data, load_grouped_contigs
+from commands.group import build_barcode_profiles, extract_mapping_data, generate_cosine_matrix, group_contigs, \
+    write_grouped_contig_fasta
+from commands.index import adapter_palette, compile_binary_data, get_adapter_info, index_subfile, init_index_worker, \
+    share_whitelist
+from commands.nlr_coverage import NLR, calculate_NLR_coverage, load_BLAST_data, load_NLR_data, write_NLR_depth
+from utils.barcodes import BarcodeCorrector
+from utils.fastq import iter_fastq_chunks
+
+MINIMUM_REGRESSION = 0.05  # seconds, smaller differences are treated as noise
+
+
+def measure(function, *args, repeat=1, memory=True):
+    """
+    :param function: stage to measure, called repeat times (plus once more to trace memory)
+    :param repeat: number of timed runs, the fastest is reported
+    :param memory: trace the peak memory allocated in a separate run
+    :return: result of the last timed run, dictionary of the wall time, CPU time and peak memory of the stage
+    """
+    wall_times, cpu_times = [], []
+    for _ in range(repeat):
+        wall, cpu = time.perf_counter(), time.process_time()
+        with contextlib.redirect_stdout(io.StringIO()):  # the index command reports progress with print
+            result = function(*args)
+        wall_times.append(time.perf_counter() - wall)
+        cpu_times.append(time.process_time() - cpu)
+
+    record = {'wall_seconds': min(wall_times), 'cpu_seconds': min(cpu_times)}
+    if memory:
+        tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function(*args)
+        record['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return result, record
+
+
+def index_chunks(chunks, directory):
+    for chunk in chunks:
+        index_subfile(directory, 'binary', chunk)
+
+
+def add_hit_coverage(nlr_lengths, blast_data):
+    """Per-hit coverage arrays with NLR.add_coverage"""
+    nlr_class_dict = {name: NLR(name, length) for name, length in nlr_lengths.items()}
+    for subject, start, end in zip(blast_data['subject'], blast_data['start'], blast_data['end']):
+        nlr_class_dict[subject].add_coverage(start, end)
+    return nlr_class_dict
+
+
+def run_stages(paths, work_directory, split=20000, neighbours=6, repeat=1, memory=True):
+    """
+    Runs every stage of the pipeline on a dataset written by generate_dataset()
+
+    :param paths: dictionary of the files of the dataset
+    :param work_directory: directory the outputs of the stages are written to
+    :param split: approximate number of reads per fastq chunk
+    :param neighbours: number of most similar contigs kept for each contig
+    :param repeat: number of timed runs of each stage
+    :param memory: trace the peak memory allocated by each stage
+    :return: dictionary of stage: measurements
+    """
+    stages = {}
+
+    def stage(name, function, *args, items=None):
+        result, record = measure(function, *args, repeat=repeat, memory=memory)
+        record['items'] = len(result) if items is None and hasattr(result, '__len__') else items
+        stages[name] = record
+        return result
+
+    # index
+    with contextlib.redirect_stdout(io.StringIO()):
+        adapter_list, adapter_dict = get_adapter_info(paths['whitelist'])
+    chunks = stage('iter_fastq_chunks', lambda: list(iter_fastq_chunks(paths['fastq'], split)))
+    index_directory = os.path.join(work_directory, 'index')
+    os.makedirs(index_directory, exist_ok=True)
+    with share_whitelist(BarcodeCorrector.from_whitelist(adapter_list),
+                         adapter_palette(adapter_list, adapter_dict)) as shared_adapters:
+        init_index_worker(shared_adapters.descriptor)  # index the chunks in this process, as a pool worker would
+        stage('index_subfile', index_chunks, chunks, index_directory, items=len(chunks))
+    stage('compile_binary_data', compile_binary_data, index_directory, adapter_list, adapter_dict, items=len(chunks))
+
+    # group
+    contig_reads = stage('extract_mapping_data', extract_mapping_data, paths['sam'], paths['bait_blast'])
+    contigs, profile_counts = stage('build_barcode_profiles', build_barcode_profiles, contig_reads,
+                                    'barcode_index.bin', items=len(contig_reads))
+    neighbour_table = stage('generate_cosine_matrix', generate_cosine_matrix, contigs, profile_counts, neighbours,
+                            items=len(contigs))
+    grouped_contigs = stage('group_contigs', group_contigs, neighbour_table)
+    stage('write_grouped_contig_fasta', write_grouped_contig_fasta, paths['assembly'], grouped_contigs,
+          items=len(grouped_contigs))
+
+    # nlr-coverage
+    nlr_data = stage('load_NLR_data', load_NLR_data, paths['nlr'])
+    blast_data = stage('load_BLAST_data', load_BLAST_data, paths['draft_nlr_blast'])
+    stage('calculate_NLR_coverage', calculate_NLR_coverage, nlr_data, blast_data)
+    stage('NLR.add_coverage', add_hit_coverage, {name: nlr.seq_length for name, nlr in nlr_data.items()},
+          blast_data, items=len(blast_data))
+    stage('write_NLR_depth', write_NLR_depth, nlr_data, blast_data, 'NLR_depth.bedgraph', items=len(blast_data))
+
+    # contig-coverage
+    genome_blast = stage('load_blast_data', load_blast_data, paths['genome_blast'])
+    final_groups = stage('load_grouped_contigs', load_grouped_contigs, paths['final_assembly'])
+    stage('calculate_group_coverage', calculate_group_coverage, genome_blast, final_groups)
+
+    return stages
+
+
+def prepare_dataset(directory, contigs, reads_per_contig, barcodes, nlrs):
+    """Generates a dataset, unless the directory already holds one generated with the same parameters"""
+    scale = {'contigs': contigs, 'reads_per_contig': reads_per_contig, 'barcodes': barcodes, 'nlrs': nlrs}
+    scale_file = os.path.join(directory, 'scale.json')
+    try:
+        with open(scale_file) as file:
+            if json.load(file) == scale:
+                return dataset_paths(directory)
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    paths = generate_dataset(directory, contigs, reads_per_contig, barcodes, nlrs)
+    with open(scale_file, 'w') as file:
+        json.dump(scale, file)
+    return paths
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def find_regressions(stages, baseline, tolerance):
+    """
+    :param stages: dictionary of stage: measurements of this run
+    :param baseline: dictionary of stage: measurements of an earlier run
+    :param tolerance: fraction the wall time of a stage may increase by
+    :return: list of the stages that are slower than the baseline by more than the tolerance
+    """
+    regressions = []
+    for name, record in stages.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        slower = record['wall_seconds'] - previous['wall_seconds']
+        if slower > MINIMUM_REGRESSION and record['wall_seconds'] > previous['wall_seconds'] * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+@click.command()
+@click.option('--output', type=str, required=True, help="JSON file the results are written to")
+@click.option('--data', type=str, required=False, help="Directory of the dataset, generated if it does not exist "
+                                                        "(default: a temporary directory)")
+@click.option('--contigs', type=int, default=2000, help="Number of contigs in the draft assembly")
+@click.option('--reads-per-contig', type=int, default=50, help="Mean number of reads mapped to each contig")
+@click.option('--barcodes', type=int, default=20000, help="Number of barcodes in the whitelist")
+@click.option('--nlrs', type=int, default=500, help="Number of NLR sequences")
+@click.option('--split', type=int, default=20000, help="Approximate number of reads per fastq chunk")
+@click.option('--repeat', type=int, default=1, help="Number of timed runs of each stage, the fastest is reported")
+@click.option('--no-memory', is_flag=True, default=False, help="Do not trace the peak memory of each stage")
+@click.option('--baseline', type=str, required=False, help="JSON file of an earlier run to compare to")
+@click.option('--tolerance', type=float, default=0.25, help="Fraction a stage may slow down by before it is reported")
+def main(output, data, contigs, reads_per_contig, barcodes, nlrs, split, repeat, no_memory, baseline, tolerance):
+    logging.disable(logging.ERROR)  # groups without hits are logged by contig-coverage
+    parameters = {'contigs': contigs, 'reads_per_contig': reads_per_contig, 'barcodes': barcodes, 'nlrs': nlrs,
+                  'split': split}
+    output = os.path.abspath(output)
+    baseline = os.path.abspath(baseline) if baseline else None
+
+    with tempfile.TemporaryDirectory() as work_directory:
+        data_directory = os.path.abspath(data) if data else os.path.join(work_directory, 'data')
+        paths = prepare_dataset(data_directory, contigs, reads_per_contig, barcodes, nlrs)
+
+        current_directory = os.getcwd()
+        os.chdir(work_directory)  # the stages write their outputs to the working directory
+        try:
+            stages = run_stages(paths, work_directory, split, repeat=repeat, memory=not no_memory)
+        finally:
+            os.chdir(current_directory)
+
+    results = {'created': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': git_commit(),
+               'python': platform.python_version(), 'platform': platform.platform(), 'parameters': parameters,
+               'stages': stages}
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    previous = {}
+    if baseline:
+        with open(baseline) as file:
+            previous_results = json.load(file)
+        if previous_results['parameters'] != parameters:
+            print(f'warning: {baseline} was run with different parameters', file=sys.stderr)
+        previous = previous_results['stages']
+
+    print(f'{"stage":<28} {"items":>8} {"wall (s)":>9} {"cpu (s)":>8} {"peak (MB)":>10}'
+          + (f' {"baseline (s)":>13} {"change":>8}' if previous else ''))
+    for name, record in stages.items():
+        peak = f'{record["peak_memory_mb"]:.1f}' if 'peak_memory_mb' in record else '-'
+        line = f'{name:<28} {str(record["items"]):>8} {record["wall_seconds"]:>9.3f} {record["cpu_seconds"]:>8.3f} ' \
+               f'{peak:>10}'
+        if name in previous:
+            change = record['wall_seconds'] / max(previous[name]['wall_seconds'], 1e-9) - 1
+            line += f' {previous[name]["wall_seconds"]:>13.3f} {change:>+8.0%}'
+        print(line)
+
+    regressions = find_regressions(stages, previous, tolerance)
+    if regressions:
+        print(f'stages slower than {baseline} by more than {tolerance:.0%}: {", ".join(regressions)}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,35 @@
 import logging
+import sys
+import numpy as np
 import pandas as pd
 import click
 
+from utils.blast import load_blast
+from utils.profiling import profiled
+from utils.server import run_on_server
 
-def load_blast_data(blast_data):
+
+@profiled(lambda blast: {'hits': len(blast)})
+def load_blast_data(blast_data, blast_cache=False):
     """
     Load blast data into a dataframe, removes all alignments with unknown chromosomes and calculates the percentage 
     query coverage.
     
     :param blast_data: raw blastn data
+    :param blast_cache: read the BLAST data through a binary columnar cache next to the file
     :return blast: a DataFrame of the cleaned blast data 
     
     """
     
     logging.info("loading BLAST data...")
-    blast = pd.read_csv(blast_data, sep="\t", header=None) # load data
-    blast = blast[blast[1] != "ChrUnknown"] # Remove unknown chromosomes
-    blast[13] = (blast[7] - blast[6]) * 100 / blast[12] # calculate percentage coverage
+    unknown_filter = [(1, '!=', "ChrUnknown")] # Remove unknown chromosomes while loading
+    blast = load_blast(blast_data, filters=unknown_filter, cache=blast_cache) # load data
+    blast[13] = (blast[7] - blast[6]).astype(np.int64) * 100 / blast[12] # calculate percentage coverage
 
     return blast
 
 
+@profiled(lambda grouped_contigs: {'groups': len(grouped_contigs)})
 def load_grouped_contigs(contig_data):
     """
     Load the final assembly and filter for the contig groups
@@ -36,78 +45,100 @@ def load_grouped_contigs(contig_data):
     return grouped_contigs
 
 
-class contig:
-    '''
-    contig holds all the blast data for a set of contigs grouped together in the final assembly. The class is initialised 
-    using the name of the grouped contig and raw blast data. The raw blast data is then filtered down to contigs only in 
-    the contig group.
-    
-    Attributes
-    ----------
-    name: name of the contig group in the final assembly
-    sub_contigs: list of all constituent contigs in the contig group
-    blast: blast data filtered for all contigs in sub_contigs
-    chromosome: most likely cnadidate chromosome for the contigs
-    genome_coverage: genomic range covered by all contigs on the chromosome
-    contig_count: number of contigs in sub_contigs with a blast hit on chromosome
-    contig_total: total number of constituent contigs
-    genome_coordinates: genomic coordinates for the genome coverage for use by IGV
+def explode_groups(grouped_contigs):
+    """
+    Maps every contig to the contig groups it belongs to
     
-    Methods
-    -------
-    calculate_coverage()
-        calculates the region covered by the grouped contigs
-    '''
+    :param grouped_contigs: list of contig groups, each the IDs of the constituent contigs joined by "_"
+    :return membership: a DataFrame with the position of the group in grouped_contigs and the ID of each contig
+    """
+    membership = pd.DataFrame({"group": np.arange(len(grouped_contigs)),
+                               "contig": [contig_group.split("_") for contig_group in grouped_contigs]})
+    return membership.explode("contig", ignore_index=True).astype({"group": np.int64, "contig": str})
+
+
+def best_hits(hits, keys):
+    """
+    Keeps the best ranked hit for each key
     
-    def __init__(self, name, data):
-        logging.info(f"Initializing {self.name}")
-        self.name = name
-        self.sub_contigs = list(map(int, name.split("_")))
-        self.blast = data[data[0].isin(self.sub_contigs)]
-        self.chromosome = None
-        self.genome_coverage = None
-        self.contig_count = 0
-        self.contig_total = len(self.sub_contigs)
-        self.genome_coordinates = 'XXX'
-        
-
-    def calculate_coverage(self):
-        logging.info(f"Calculating coverage {self.name}")
-        
-        # Reorganise blast hit coordinates to ensure all hit are in the same direction
-        cond = self.blast[8] > self.blast[9]
-        self.blast.loc[cond, [8, 9]] = self.blast.loc[cond, [9, 8]].values
-        
-        # Identify the highest likelihood chromosome for the contig group and filter the blast data for the chromosome
-        best_chromosome = self.blast.sort_values(by=[11, 13], ascending=False).drop_duplicates(0)[
-            1].value_counts().idxmax()
-        filtered = self.blast[self.blast[1] == best_chromosome]
-        final = filtered.sort_values(by=[11, 13], ascending=False).drop_duplicates(0)
-
-        # Identify min/max of genomic range on target chromosome
-        start = int(min(final[8]))
-        end = int(max(final[9]))
-
-        #update class atrributes
-        self.chromosome = best_chromosome
-        self.genome_coverage = end - start
-        self.contig_count = len(final)
-        self.genome_coordinates = f"{best_chromosome}:{start}-{end}"
+    :param hits: DataFrame of BLAST hits with a "rank" column generated by calculate_group_coverage()
+    :param keys: columns identifying the hits to deduplicate
+    :return hits: the best hit for each key, sorted by key
+    """
+    return hits.sort_values(by=keys + ["rank"], kind="mergesort").drop_duplicates(keys)
 
+
+@profiled(lambda summary: {'groups': len(summary)})
+def calculate_group_coverage(blast, grouped_contigs):
+    """
+    Calculates the region of the genome covered by each contig group in a single pass over the BLAST data. The group
+    membership of every contig is joined to the BLAST hits once and all groups are evaluated with grouped operations.
     
-    def get_data(self):
-        """
-        return all necessary data from class after coverage has been calculated
-        
-        return: all class attributes
-        """
-        return self.name, self.contig_count, self.contig_total, self.chromosome, self.genome_coverage, self.genome_coordinates
+    For each group the best hit of each contig is found and the chromosome with the best hits of the most contigs is
+    chosen. Ties are broken by the chromosome of the highest ranked best hit (highest bit score, then highest query
+    coverage, then first in the BLAST file). The region covered is the span of the best hit of each contig on the chosen
+    chromosome.
+    
+    :param blast: a DataFrame of the cleaned blast data generated by load_blast_data()
+    :param grouped_contigs: list of contig groups, each the IDs of the constituent contigs joined by "_"
+    :return summary: a DataFrame of the name, number of contigs with a hit on the chosen chromosome, total number of
+    contigs, chosen chromosome, size of the region covered and genomic coordinates of the region for each group
+    """
+    logging.info("Calculating coverage of contig groups...")
+    membership = explode_groups(grouped_contigs)
+
+    # Reorganise blast hit coordinates to ensure all hit are in the same direction and rank the hits by bit score,
+    # then query coverage, then position in the BLAST file
+    ranks = np.empty(len(blast), dtype=np.int64)
+    ranks[np.lexsort((np.arange(len(blast)), -blast[13].to_numpy(), -blast[11].to_numpy()))] = np.arange(len(blast))
+    hits = pd.DataFrame({0: blast[0].astype(str).to_numpy(), 1: blast[1].to_numpy(),
+                         8: np.minimum(blast[8], blast[9]).to_numpy(), 9: np.maximum(blast[8], blast[9]).to_numpy(),
+                         "rank": ranks})
+    group_hits = membership.merge(hits, left_on="contig", right_on=0)
+
+    # Identify the highest likelihood chromosome for each contig group from the best hit of each contig
+    contig_best = best_hits(group_hits, ["group", "contig"])
+    chromosome_votes = contig_best.groupby(["group", 1], sort=False).agg(contigs=("contig", "size"),
+                                                                         rank=("rank", "min")).reset_index()
+    best_chromosome = chromosome_votes.sort_values(by=["group", "contigs", "rank"], ascending=[True, False, True],
+                                                   kind="mergesort").drop_duplicates("group")[["group", 1]]
+
+    # Filter the hits for the best chromosome of each group and keep the best hit of each contig on the chromosome
+    final = best_hits(group_hits.merge(best_chromosome, on=["group", 1]), ["group", "contig"])
+
+    # Identify min/max of genomic range on target chromosome
+    spans = final.groupby("group").agg(chromosome=(1, "first"), contig_count=("contig", "size"), start=(8, "min"),
+                                       end=(9, "max"))
+
+    summary = pd.DataFrame({"name": grouped_contigs,
+                            "contig_total": membership.groupby("group").size().reindex(
+                                np.arange(len(grouped_contigs)), fill_value=0).to_numpy()})
+    summary = summary.join(spans)
+    for name in summary.loc[summary["chromosome"].isna(), "name"]:
+        logging.error(f"Could not calculate coverage for {name}")
+
+    covered = summary["chromosome"].notna()
+    summary["contig_count"] = summary["contig_count"].fillna(0).astype(int)
+    summary["genome_coverage"] = (summary["end"] - summary["start"]).astype("Int64")
+    summary["genome_coordinates"] = "XXX"
+    summary.loc[covered, "genome_coordinates"] = (summary.loc[covered, "chromosome"].astype(str) + ":" +
+                                                  summary.loc[covered, "start"].astype(np.int64).astype(str) + "-" +
+                                                  summary.loc[covered, "end"].astype(np.int64).astype(str))
+    summary["chromosome"] = summary["chromosome"].where(covered, None)
+
+    data_matrix = summary[["name", "contig_count", "contig_total", "chromosome", "genome_coverage",
+                           "genome_coordinates"]]
+    return pd.DataFrame(data_matrix.to_numpy(), columns=range(6))
 
 
 @click.command()
 @click.option('-b', '--blast', type=str, required=True, help="BLAST file")
 @click.option('-a', '--assembly', type=str, required=True, help="Assembly")
-def contig_coverage(blast, assembly):
+@click.option('--blast-cache', is_flag=True, default=False,
+              help="Keep a binary columnar copy of the BLAST file next to it for faster reruns")
+@click.option('--server', type=str, required=False, default=None,
+              help="Socket of a server started with serve to run the command on")
+def contig_coverage(blast, assembly, blast_cache, server):
     '''
     Calculates the region of the genome covered by contigs grouped together in the final assembly
     
@@ -115,28 +146,22 @@ def contig_coverage(blast, assembly):
     :param blast: path to the raw blast data
     :return None: A csv file is saved with the output file
     '''
+    if server is not None:
+        sys.exit(run_on_server(server))
+
     logging.info("----- running NLR-Assembler query-coverage -----")
-    blast_data = load_blast_data(blast)
+    blast_data = load_blast_data(blast, blast_cache)
     group_data = load_grouped_contigs(assembly)
 
-    # generate a dictionary of all contig groups 
-    contig_dict = {contig_group: contig(contig_group, blast_data) for contig_group in group_data}
-
     # Generate the final output csv containing data for all contig groups
-    for k in contig_dict.keys():
-        try:
-            contig_dict[k].calculate_coverage()
-        except ValueError:
-            logging.error(f"Could not calculate coverage for {k}")
-
-    data_matrix = [contig_dict[k].get_data() for k in contig_dict.keys()]
-    summary = pd.DataFrame(data_matrix)
+    summary = calculate_group_coverage(blast_data, group_data)
     
-    # Generate and log summary statistics
+    # Generate and log summary statistics (the size of the region covered is column 4)
+    covered = pd.to_numeric(summary[4])
     logging.info(
-        f"Percentage contigs covering 60 Kb or less: {len(summary[summary[5] < 60000][5]) / len(summary) * 100:.4}% ({len(summary[summary[5] < 60000][5])} of {len(summary)})")
+        f"Percentage contigs covering 60 Kb or less: {len(summary[covered < 60000]) / len(summary) * 100:.4}% ({len(summary[covered < 60000])} of {len(summary)})")
     logging.info(
-        f"Percentage contigs covering 1 Mb or less: {len(summary[summary[5] < 100000][5]) / len(summary) * 100:.4}% ({len(summary[summary[5] < 100000][5])} of {len(summary)})")
+        f"Percentage contigs covering 1 Mb or less: {len(summary[covered < 1000000]) / len(summary) * 100:.4}% ({len(summary[covered < 1000000])} of {len(summary)})")
 
     logging.info("Saving query coverage data to query_coverage.txt ...")
-    summary.to_csv("query_coverage.txt", sep="\t")
\ No newline at end of file
+    summary.to_csv("query_coverage.txt", sep="\t")
@@ -1,238 +1,759 @@
-import csv
+import itertools
 import logging
+import os
+import sys
+from collections import namedtuple
 import numpy as np
-from collections import Counter
+from multiprocessing import get_context
 import click
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-
-def extract_mapping_data(sam_file, Blast_data):
+from scipy import sparse
+
+from commands.index import index_read_barcodes
+from utils.bam import BamReader, is_bam
+from utils.barcode_index import BarcodeIndex
+from utils.blast import load_blast, numeric_names
+from utils.cache import StageCache, _write_atomic, decode_strings, encode_strings
+from utils.fasta import FastaIndex
+from utils.grouping import component_labels, connected_groups, labelled_groups, update_component_labels
+from utils.profiling import profiled
+from utils.server import resident, run_on_server
+from utils.shared import SharedArrays, attach_arrays
+from utils.similarity import NeighbourTable, approximate_top_k_neighbours, tfidf_transformer, top_k_neighbours, \
+    update_top_k_neighbours
+
+# raw linked-reads the barcodes of the mapped reads are looked up in, used in place of an index file
+ReadBarcodes = namedtuple('ReadBarcodes', ['fastq', 'adapters', 'split'])
+
+
+@profiled(lambda reads: {'contigs': len(reads), 'reads': sum(map(len, reads.values()))})
+def extract_mapping_data(sam_file, Blast_data, blast_cache=False):
     """
-    Loads a SAM file and generates a dictionary of all the reads that have been mapped to a refernce sequence in the
-    SAM file as a list of reads. The dictionary is then reduced to contain only contigs that have been annotated as
-    NLRs using NLR annotator
+    Loads the BLAST data to identify the contigs that have been annotated as NLRs using NLR annotator and then generates
+    a dictionary of all the reads that have been mapped to each of these contigs in a SAM or BAM file as a list of
+    reads. Alignments to any other contig are skipped, for a sorted and indexed BAM file only the alignments to NLR
+    contigs are read from the file.
 
     :param Blast_data: raw blastn file
-    :param sam_file: reads mapped to contigs generated by assembly of reads
+    :param blast_cache: read the BLAST data through a binary columnar cache next to the file
+    :param sam_file: reads mapped to contigs generated by assembly of reads (SAM or BAM)
     :return: dictionary: {contig:[all mapped reads]}
     """
-    contig_read_dictionary = {}
-    logging.info("extracting reads from SAM file...")
-    with open(sam_file) as file:
-        for line in file:
-            # extract all reference sequence names from SAM file and add to dictionary with an empty list
-            if line.startswith("@SQ"):
-                seq_name = line.split("\t")[1][3:]
-                contig_read_dictionary[seq_name] = []
-
-            # skip the header added by samtools
-            elif line.startswith("@PG") or line.startswith("@HD"):
-                continue
-
-            # read line of SAM file and extract reference sequence and query sequence names then append query sequence
-            # to a list in the dictionary using the reference sequence as a key
-            else:
-                read_info = line.split("\t")
-                query_name = read_info[0]
-                reference_name = read_info[2]
-                # if a sequence is unmapped to a reference move onto the next read
-                if reference_name == "*":
-                    continue
-                else:
-                    contig_read_dictionary[reference_name].append(query_name)
-
     logging.info("Loading BLAST data...")
 
-    blast = pd.read_csv(Blast_data, header=None, sep="\t")
-
-    blast_80 = blast[(blast[2] >= 80) & (blast[3] >= 80)]
-
-    target_contigs = blast_80[1].unique()
+    blast_80 = load_blast(Blast_data, columns=[1], filters=[(2, '>=', 80), (3, '>=', 80)], cache=blast_cache)
+
+    target_contigs = numeric_names(blast_80[1].unique())
+    target_names = [str(nlr) for nlr in target_contigs]
+
+    if is_bam(sam_file):
+        bam = BamReader(sam_file)
+        if bam.index is None:
+            logging.warning(f"No index found for {sam_file}, the whole BAM file will be scanned")
+        logging.info("extracting reads from BAM file...")
+        contig_read_dictionary = bam.read_names(target_names)
+
+    else:
+        contig_read_dictionary = {}
+        target_name_set = set(target_names)
+        logging.info("extracting reads from SAM file...")
+        with open(sam_file) as file:
+            for line in file:
+                # extract all NLR reference sequence names from SAM file and add to dictionary with an empty list
+                if line.startswith("@SQ"):
+                    seq_name = line.split("\t")[1][3:]
+                    if seq_name in target_name_set:
+                        contig_read_dictionary[seq_name] = []
+
+                # skip the header added by samtools
+                elif line.startswith("@"):
+                    continue
 
-    logging.info("Removing poor quality contigs...")
+                # read line of SAM file and extract reference sequence and query sequence names then append query
+                # sequence to a list in the dictionary if the reference sequence is an NLR contig
+                else:
+                    read_info = line.split("\t", 3)
+                    reference_reads = contig_read_dictionary.get(read_info[2])
+                    if reference_reads is not None:
+                        reference_reads.append(read_info[0])
 
     nlr_read_dictionary = {nlr: contig_read_dictionary[str(nlr)] for nlr in target_contigs}
 
     return nlr_read_dictionary
 
 
-def convert_reads_to_hexidecimal(contig_read_dictionary, index):
+def count_barcodes(contig_colours, return_barcodes=False):
+    """
+    Counts the barcodes (colours) of the reads mapped to each contig in a sparse matrix. Each distinct colour is
+    assigned a column in ascending order, the same order the hexidecimal profiles were tokenised in. Within each row the
+    entries are stored in the order each colour was first seen, as they are by scikit-learn's CountVectorizer, so that
+    TF-IDF weights and cosine similarities are summed in the same order and are numerically identical.
+
+    :param contig_colours: dictionary of contig: array of the packed colour of each mapped read
+    :param return_barcodes: also return the colour of each column
+    :return: a contig x barcode CSR matrix of read counts
+    """
+    colour_arrays = [np.asarray(colours, dtype=np.uint32) for colours in contig_colours.values()]
+    all_colours = np.concatenate(colour_arrays) if colour_arrays else np.zeros(0, dtype=np.uint32)
+    barcodes, first_read, columns = np.unique(all_colours, return_index=True, return_inverse=True)
+    rows = np.repeat(np.arange(len(colour_arrays)), [len(colours) for colours in colour_arrays])
+
+    # count using columns numbered in the order each colour was first seen, then renumber in ascending colour order
+    seen_order = np.argsort(first_read, kind='stable')
+    seen_columns = np.empty(len(barcodes), dtype=np.int64)
+    seen_columns[seen_order] = np.arange(len(barcodes))
+
+    profile_counts = sparse.csr_matrix((np.ones(len(columns), dtype=np.float64), (rows, seen_columns[columns])),
+                                       shape=(len(colour_arrays), len(barcodes)))
+    profile_counts.sum_duplicates()
+    profile_counts.indices = seen_order[profile_counts.indices].astype(profile_counts.indices.dtype)
+    profile_counts.has_sorted_indices = False
+    if return_barcodes:
+        return profile_counts, barcodes
+    return profile_counts
+
+
+@profiled(lambda profiles: {'contigs': len(profiles[0]), 'reads': int(profiles[1].sum())})
+def build_barcode_profiles(contig_read_dictionary, index, cores=1):
     """
     The function takes a dictionary of contigs each with a list of reads mapped to that contig and converts the read
-    names to a list of rgb values based on an index file. The list RGB values is then converted to a list of
-    hexidecimal values that can later be analysed to compare the similarity of contigs.
+    names to the colour assigned to their barcode using an index file. The colours are then counted for each contig to
+    generate a barcode profile that can later be analysed to compare the similarity of contigs.
 
     :param contig_read_dictionary: dictionary of reads mapped to each contig generated by extracting_mapping_data()
-    :param index: csv file where each read has been assigned a colour based its adapter sequence
-    :return: contig_hex_dicitonary: {contig: [hexidecimal values assinged for each read]}
+    :param index: csv or binary index file where each read has been assigned a colour based its adapter sequence, a
+    BarcodeIndex already in memory or ReadBarcodes, in which case only the barcodes of the mapped reads are corrected
+    :param cores: number of cores used to correct barcodes from ReadBarcodes
+    :return: contigs: list of contigs, profile_counts: contig x barcode CSR matrix of read counts
     """
+    contig_colours = contig_barcode_colours(contig_read_dictionary, index, cores)
+    return list(contig_colours.keys()), count_barcodes(contig_colours)
+
+
+def load_barcode_index(index):
+    """
+    :param index: csv or binary index file
+    :return: the BarcodeIndex of the file, the copy kept resident by a server (see serve) if there is one
+    """
+    barcode_index = resident('index', index)
+    if barcode_index is not None:
+        logging.info(f"using the index of {index} kept by the server")
+        return barcode_index
+
     logging.info("extracting information from index file...")
-    with open(index, mode='r') as inp:
-        index_reader = csv.reader(inp)
-        ID_colour_dict = {rows[0]: rows[1] for rows in index_reader}
+    return BarcodeIndex.load(index)
 
-    logging.info("converting Seq IDs to RGB values...")
-    contig_rgb = {contig: tuple(map(lambda x: ID_colour_dict[x], contig_read_dictionary[contig])) for contig in
-                  contig_read_dictionary}
 
-    logging.info("converting rgb values to hexidecimal...")
-    contig_hex_dictionary = {
-        contig: list(map(lambda x: '#%02x%02x%02x' % tuple(map(int, x.split(","))), contig_rgb[contig])) for
-        contig in contig_rgb}
+def contig_barcode_colours(contig_read_dictionary, index, cores=1):
+    """
+    :param contig_read_dictionary: dictionary of reads mapped to each contig generated by extracting_mapping_data()
+    :param index: csv or binary index file, BarcodeIndex or ReadBarcodes (see build_barcode_profiles)
+    :param cores: number of cores used to correct barcodes from ReadBarcodes
+    :return: dictionary of contig: array of the packed colour of each mapped read
+    """
+    if isinstance(index, BarcodeIndex):
+        barcode_index = index
+    elif isinstance(index, ReadBarcodes):
+        logging.info(f"correcting the barcodes of the mapped reads in {index.fastq}...")
+        mapped_reads = itertools.chain.from_iterable(contig_read_dictionary.values())
+        barcode_index = index_read_barcodes(index.fastq, index.adapters, mapped_reads, cores, index.split)
+    else:
+        barcode_index = load_barcode_index(index)
 
-    return contig_hex_dictionary
+    logging.info("converting Seq IDs to barcode profiles...")
+    return {contig: barcode_index.colours(contig_read_dictionary[contig]) for contig in contig_read_dictionary}
 
 
-def generate_cosine_matrix(contig_hex_dictionary):
+@profiled(lambda neighbour_table: {'contigs': len(neighbour_table.contigs)})
+def generate_cosine_matrix(contigs, profile_counts, neighbours=6, cores=1, lsh=None):
     """
-    Generates a text string for each contig using the hexidecimal profiles for each contig and then calculates the
-    cosine similarity of all contigs in the dictionary. This is peformed in a pairwise manner and creates a matrix of all
-    values.
+    Weights the barcode profile of each contig using Term-Frequency Inverse Document Frequency and then calculates the
+    cosine similarity of all contigs. Similarities are calculated in blocks of sparse matrix products spread over a
+    process pool and only the most similar contigs to each contig are kept. In the approximate mode only the pairs of
+    contigs found by MinHash LSH of their barcode sets are compared.
+
+    :param contigs: list of contigs
+    :param profile_counts: contig x barcode CSR matrix of read counts generated by build_barcode_profiles()
+    :param neighbours: number of most similar contigs (including itself) kept for each contig
+    :param cores: number of cores used to calculate cosine similarity
+    :param lsh: None to compare all contigs, or the (bands, rows) of the LSH used to approximate the neighbours
+    :return: a NeighbourTable of the most similar contigs to each contig
+    """
+    logging.info("calculating cosine similarity...")
+    profile_count_array = tfidf_transformer().fit_transform(profile_counts)
+    if lsh is not None:
+        return approximate_top_k_neighbours(contigs, profile_count_array, neighbours, *lsh)
+    return top_k_neighbours(contigs, profile_count_array, neighbours, cores)
+
+
+def _contig_arrays(contigs):
+    """Contigs as arrays for the stage cache, numeric contig names keep their type"""
+    contig_array = np.asarray(contigs)
+    if contig_array.dtype.kind in 'iuf':
+        return {'contigs': contig_array}
+    return {'contig_names': encode_strings([str(contig) for contig in contigs]),
+            'n_contigs': np.array(len(contigs))}
+
 
-    :param contig_hex_dictionary:
-    :return: a 2D nlr_dict of all cosine similarity values
+def _load_contigs(arrays):
+    """Contigs stored by _contig_arrays()"""
+    if 'contigs' in arrays:
+        return list(arrays['contigs'])
+    return decode_strings(arrays['contig_names'], int(arrays['n_contigs']))
+
+
+def calculate_contig_neighbours(samfile, blast, index, neighbours=6, cores=1, cache=None, blast_cache=False,
+                                lsh=None):
+    """
+    Runs each stage from the mapped reads to the most similar contigs to each contig. If a StageCache is given, the
+    result of each stage is stored under a hash of the input files and parameters it depends on, and the latest cached
+    stage is loaded instead of being recalculated.
+
+    :param samfile: SAM or BAM file of reads mapped to the assembly
+    :param blast: raw blastn file
+    :param index: csv or binary index file or ReadBarcodes
+    :param neighbours: number of most similar contigs (including itself) kept for each contig
+    :param cores: number of cores used to correct barcodes and calculate cosine similarity
+    :param cache: StageCache or None
+    :param blast_cache: read the BLAST data through a binary columnar cache next to the file
+    :param lsh: None to compare all contigs, or the (bands, rows) of the LSH used to approximate the neighbours
+    :return: a NeighbourTable of the most similar contigs to each contig
     """
-    logging.info("converting hexidecimal to strings...")
-    contig_adapter_profiles = [" ".join(contig_hex_dictionary[contig]) for contig in
-                               contig_hex_dictionary]
+    if cache is None:
+        nlr_contig_reads = extract_mapping_data(samfile, blast, blast_cache)
+        contigs, profile_counts = build_barcode_profiles(nlr_contig_reads, index, cores)
+        return generate_cosine_matrix(contigs, profile_counts, neighbours, cores, lsh)
+
+    logging.info("hashing input files...")
+    mapping_key = cache.key('mapping', cache.file_digest(samfile), cache.file_digest(blast))
+    if isinstance(index, ReadBarcodes):
+        index_digests = [cache.file_digest(index.fastq), cache.file_digest(index.adapters)]
+    else:
+        index_digests = [cache.file_digest(index)]
+    profile_key = cache.key('profiles', mapping_key, *index_digests)
+    neighbour_key = cache.key('neighbours', profile_key, neighbours, *([] if lsh is None else ['lsh', *lsh]))
+
+    cached_neighbours = cache.load(neighbour_key)
+    if cached_neighbours is not None:
+        logging.info("loaded cosine similarity from cache")
+        return NeighbourTable(_load_contigs(cached_neighbours), cached_neighbours['indices'],
+                              cached_neighbours['similarities'])
+
+    cached_profiles = cache.load(profile_key)
+    if cached_profiles is not None:
+        logging.info("loaded barcode profiles from cache")
+        contigs = _load_contigs(cached_profiles)
+        profile_counts = sparse.csr_matrix((cached_profiles['data'], cached_profiles['indices'],
+                                            cached_profiles['indptr']), shape=tuple(cached_profiles['shape']))
+        profile_counts.has_sorted_indices = False  # keep the first-seen order of each row (see count_barcodes)
+
+    else:
+        cached_mapping = cache.load(mapping_key)
+        if cached_mapping is not None:
+            logging.info("loaded mapped reads from cache")
+            read_counts = cached_mapping['read_counts']
+            read_names = decode_strings(cached_mapping['read_names'], int(read_counts.sum()))
+            read_ends = np.cumsum(read_counts).tolist()
+            nlr_contig_reads = {contig: read_names[end - count:end] for contig, count, end in
+                                zip(_load_contigs(cached_mapping), read_counts.tolist(), read_ends)}
+        else:
+            nlr_contig_reads = extract_mapping_data(samfile, blast, blast_cache)
+            cache.store(mapping_key, {
+                **_contig_arrays(list(nlr_contig_reads)),
+                'read_counts': np.array([len(reads) for reads in nlr_contig_reads.values()], dtype=np.int64),
+                'read_names': encode_strings([read for reads in nlr_contig_reads.values() for read in reads])})
 
-    logging.info("calculating cosine similarity...")
-    tfidf_array = TfidfVectorizer()
-    profile_count_array = tfidf_array.fit_transform(contig_adapter_profiles)
-    cosine_array = cosine_similarity(profile_count_array)
-    tf = pd.DataFrame(cosine_array, index=contig_hex_dictionary.keys(), columns=contig_hex_dictionary.keys())
-    return tf
+        contigs, profile_counts = build_barcode_profiles(nlr_contig_reads, index, cores)
+        cache.store(profile_key, {**_contig_arrays(contigs), 'data': profile_counts.data,
+                                  'indices': profile_counts.indices, 'indptr': profile_counts.indptr,
+                                  'shape': np.array(profile_counts.shape)})
 
+    neighbour_table = generate_cosine_matrix(contigs, profile_counts, neighbours, cores, lsh)
+    cache.store(neighbour_key, {**_contig_arrays(contigs), 'indices': neighbour_table.indices,
+                                'similarities': neighbour_table.similarities})
+    return neighbour_table
 
-def group_contigs(cosine_dataframe):
-    logging.info("Grouping contigs...")
 
-    def dynamic_grouping(df_row, dataframe):
-        test = dataframe[df_row].nlargest(n=6)
-        threshold = test.iloc[1]
+def merge_barcode_counts(contigs, profile_counts, barcodes, new_contigs, new_counts, new_barcodes):
+    """
+    Adds the barcode counts of newly mapped reads to the counts of earlier reads. Contigs that were not counted before
+    are appended after the earlier contigs and the barcodes of each contig keep the order they were first seen in.
+
+    :param contigs: list of the contigs of profile_counts
+    :param profile_counts: contig x barcode CSR matrix of read counts
+    :param barcodes: array of the colour of each column of profile_counts
+    :param new_contigs: list of the contigs of new_counts
+    :param new_counts: contig x barcode CSR matrix of the read counts of the new reads
+    :param new_barcodes: array of the colour of each column of new_counts
+    :return: list of contigs, their CSR matrix of read counts, the colour of each column and an array of the rows of
+    contigs with new reads
+    """
+    known_contigs = set(contigs)
+    contigs = list(contigs) + [contig for contig in new_contigs if contig not in known_contigs]
+    contig_rows = {contig: row for row, contig in enumerate(contigs)}
+    new_rows = np.array([contig_rows[contig] for contig in new_contigs], dtype=np.int64)
+    all_barcodes = np.union1d(barcodes, new_barcodes)
+
+    rows = np.concatenate([np.repeat(np.arange(profile_counts.shape[0]), np.diff(profile_counts.indptr)),
+                           np.repeat(new_rows, np.diff(new_counts.indptr))])
+    columns = np.searchsorted(all_barcodes, np.concatenate([barcodes[profile_counts.indices],
+                                                             new_barcodes[new_counts.indices]]))
+    counts = np.concatenate([profile_counts.data, new_counts.data])
+
+    # sum the counts of each contig and barcode, keeping the position of the earliest entry
+    order = np.lexsort((np.arange(len(rows)), columns, rows))
+    starts = np.flatnonzero(np.r_[True, (np.diff(rows[order]) != 0) | (np.diff(columns[order]) != 0)])
+    entries = order[starts]
+    counts = np.add.reduceat(counts[order], starts) if len(order) else counts
+    entry_order = np.lexsort((entries, rows[entries]))
+
+    merged = sparse.csr_matrix((counts[entry_order], columns[entries][entry_order],
+                                np.r_[0, np.cumsum(np.bincount(rows[entries], minlength=len(contigs)))]),
+                               shape=(len(contigs), len(all_barcodes)))
+    merged.has_sorted_indices = False
+    return contigs, merged, all_barcodes, np.unique(new_rows[np.diff(new_counts.indptr) > 0])
+
+
+def load_group_state(path):
+    """
+    :param path: state file written by save_group_state()
+    :return: dictionary of the contigs, read counts, barcodes, IDF, NeighbourTable, component labels and grouping
+    parameters of the last run
+    """
+    with np.load(path) as arrays:
+        contigs = _load_contigs(arrays)
+        return {'contigs': contigs, 'barcodes': arrays['barcodes'], 'idf': arrays['idf'],
+                'profile_counts': sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                                    shape=tuple(arrays['shape'])),
+                'neighbour_table': NeighbourTable(contigs, arrays['neighbour_indices'],
+                                                  arrays['neighbour_similarities']),
+                'labels': arrays['labels'], 'cutoff': float(arrays['cutoff']), 'window': float(arrays['window'])}
+
 
-        if threshold < 0.5:
-            contig_group = [test.index[0]]
-            return sorted(contig_group)
+def save_group_state(path, contigs, profile_counts, barcodes, idf, neighbour_table, labels, cutoff, window):
+    """
+    Writes everything needed to update the grouping with newly mapped reads to a single .npz file
+
+    :param path: path of the state file
+    :param contigs: list of contigs
+    :param profile_counts: contig x barcode CSR matrix of read counts
+    :param barcodes: array of the colour of each column of profile_counts
+    :param idf: array of the inverse document frequency of each barcode
+    :param neighbour_table: NeighbourTable of the most similar contigs to each contig
+    :param labels: component of each contig generated by component_labels()
+    :param cutoff: minimum cosine similarity used to group contigs
+    :param window: similarity window used to group contigs
+    """
+    _write_atomic(os.path.abspath(path), lambda file: np.savez(
+        file, **_contig_arrays(contigs), barcodes=barcodes, idf=idf, data=profile_counts.data,
+        indices=profile_counts.indices, indptr=profile_counts.indptr, shape=np.array(profile_counts.shape),
+        neighbour_indices=neighbour_table.indices, neighbour_similarities=neighbour_table.similarities,
+        labels=labels, cutoff=np.array(cutoff), window=np.array(window)))
+
+
+@profiled(lambda groups: {'groups': len(groups), 'contigs': sum(map(len, groups))})
+def update_contig_groups(samfile, blast, index, state, neighbours=6, cutoff=0.5, window=0.1, cores=1,
+                         blast_cache=False):
+    """
+    Groups contigs incrementally. The read counts, IDF, neighbours and groups of each run are saved to a state file, and
+    a run with an existing state file only reads the newly mapped reads, given in samfile. The profiles of the contigs
+    with new reads are updated, neighbours are only recalculated for contigs whose weighted profile changed or could be
+    a neighbour of a changed contig, and only the groups linked to these contigs are regrouped. New contigs change the
+    IDF of every barcode, so all neighbours are recalculated when contigs are added.
+
+    :param samfile: SAM or BAM file of the reads mapped since the state file was saved (or all reads)
+    :param blast: raw blastn file
+    :param index: csv or binary index file or ReadBarcodes
+    :param state: path of the state file, created if it does not exist
+    :param neighbours: number of most similar contigs (including itself) kept for each contig
+    :param cutoff: minimum cosine similarity of the most similar other contig to group a contig
+    :param window: similarity below the most similar other contig for further contigs to join the group
+    :param cores: number of cores used to correct barcodes and calculate cosine similarity
+    :param blast_cache: read the BLAST data through a binary columnar cache next to the file
+    :return: list of groups, each a sorted list of contigs, largest group first
+    """
+    nlr_contig_reads = extract_mapping_data(samfile, blast, blast_cache)
+    contig_colours = contig_barcode_colours(nlr_contig_reads, index, cores)
+    new_counts, new_barcodes = count_barcodes(contig_colours, return_barcodes=True)
+
+    previous = load_group_state(state) if os.path.exists(state) else None
+    if previous is None:
+        contigs, profile_counts, barcodes = list(contig_colours), new_counts, new_barcodes
+    else:
+        logging.info(f"updating the barcode profiles saved in {state}...")
+        contigs, profile_counts, barcodes, changed_rows = merge_barcode_counts(
+            previous['contigs'], previous['profile_counts'], previous['barcodes'], list(contig_colours), new_counts,
+            new_barcodes)
 
+    logging.info("calculating cosine similarity...")
+    transformer = tfidf_transformer()
+    profile_count_array = transformer.fit_transform(profile_counts)
+
+    if previous is None:
+        neighbour_table = top_k_neighbours(contigs, profile_count_array, neighbours, cores)
+        labels = component_labels(neighbour_table, cutoff, window)
+    else:
+        # the weighted profile of a contig also changes with the IDF of any of its barcodes
+        previous_idf = np.full(len(barcodes), np.nan)
+        previous_idf[np.searchsorted(barcodes, previous['barcodes'])] = previous['idf']
+        changed_barcodes = transformer.idf_ != previous_idf
+        entry_rows = np.repeat(np.arange(len(contigs)), np.diff(profile_counts.indptr))
+        changed_rows = np.union1d(changed_rows, entry_rows[changed_barcodes[profile_counts.indices]])
+
+        neighbour_table, updated_rows = update_top_k_neighbours(previous['neighbour_table'], contigs,
+                                                                profile_count_array, changed_rows, neighbours, cores)
+        logging.info(f"recalculated the neighbours of {len(updated_rows)} of {len(contigs)} contigs")
+        if (previous['cutoff'], previous['window']) == (cutoff, window):
+            labels = update_component_labels(previous['labels'], previous['neighbour_table'], neighbour_table,
+                                             updated_rows, cutoff, window)
         else:
-            contig_group = list(test[test > (test.iloc[1] - 0.1)].index)
-            return sorted(contig_group)
+            labels = component_labels(neighbour_table, cutoff, window)
 
-    contig_groups = []
-    i = 0
-    points = np.percentile(np.arange(len(cosine_dataframe)), [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]).astype(int)
-    for row in cosine_dataframe.columns.unique():
+    save_group_state(state, contigs, profile_counts, barcodes, transformer.idf_, neighbour_table, labels, cutoff,
+                     window)
 
-        if i in points:
-            logging.info(f"{round((i * 100) / len(cosine_dataframe))}% complete")
+    logging.info("Grouping contigs...")
+    contig_groups = labelled_groups(neighbour_table, labels)
+    logging.info(f"{len(contigs)} contigs grouped into {len(contig_groups)} groups")
+    return contig_groups
 
-        target_contig_group = dynamic_grouping(row, cosine_dataframe)
-        target_contig_group.sort()
-        i += 1
-        if target_contig_group not in contig_groups:
-            contig_groups.append(target_contig_group)
 
+@profiled(lambda groups: {'groups': len(groups), 'contigs': sum(map(len, groups))})
+def group_contigs(neighbour_table, cutoff=0.5, window=0.1):
+    """
+    Groups contigs with similar barcode profiles. Each contig is linked to the neighbours within a window of the
+    similarity of its most similar other contig, provided that similarity passes the cutoff. Linked contigs are then
+    merged into groups with a disjoint-set structure, so contigs shared by overlapping groups join a single group.
+
+    :param neighbour_table: NeighbourTable of the most similar contigs to each contig generated by
+    generate_cosine_matrix()
+    :param cutoff: minimum cosine similarity of the most similar other contig to group a contig
+    :param window: similarity below the most similar other contig for further contigs to join the group
+    :return: list of groups, each a sorted list of contigs, largest group first
+    """
+    logging.info("Grouping contigs...")
+    contig_groups = connected_groups(neighbour_table, cutoff, window)
+    logging.info(f"{len(neighbour_table.contigs)} contigs grouped into {len(contig_groups)} groups")
     return contig_groups
 
 
-def merge_contig_groups(contig_groups):
-    def merge_overlapping_lists(lists):
-        merged_lists = {}
-        i = 0
-        points = np.percentile(np.arange(len(lists)), [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]).astype(int)
-        for lst in lists:
-            if i in points:
-                logging.info(f"{round((i * 100) / len(lists))}% complete")
-            overlap_found = False
-            for key in merged_lists:
-                if any(elem in lst for elem in merged_lists[key]):
-                    merged_lists[key].extend(lst)
-                    overlap_found = True
-                    break
-            if not overlap_found:
-                merged_lists[tuple(lst)] = lst
-            i += 1
-        return list(map(set, list(merged_lists.values())))
-
-    logging.info("Merging overlapping contigs...")
-    merged_contig_groups = merge_overlapping_lists(contig_groups)
-    merged_list = list(map(sorted, map(list, merged_contig_groups)))
-    merged_list.sort(key=len, reverse=True)
-
-    return merged_list
-
-
-def remove_subset_contigs(merged_contig_groups):
-    def flatten(array):
-        return [item for sublist in array for item in sublist]
-
-    logging.info("removing subset contigs...")
-    nr_list = list(map(sorted, map(list, merged_contig_groups)))
-    nr_list.sort(key=len, reverse=True)
-    count = Counter(flatten(nr_list))
-    dupes = [k for k in count if count[k] > 1]
-
-    i = 0
-    points = np.percentile(np.arange(len(dupes)), [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]).astype(int)
-    for contig in dupes:
-        if i in points:
-            logging.info(f"{round((i * 100) / len(dupes))}% complete")
-
-        i += 1
-        query_group = [cgroup for cgroup in nr_list if contig in cgroup]
-
-        if len(query_group) < 2:
-            continue
-        remove_group = min(query_group, key=len)
-        nr_list.remove(remove_group)
-
-    return nr_list
+@profiled(lambda lengths: {'sequences': len(lengths)})
+def write_contig_groups(fasta_index, grouped_contigs, output='grouped_assemblies.fa'):
+    """
+    Writes the concatenated sequence of the contigs in each group, spaced by 1000 N's. Sequences are streamed from the
+    assembly to the output file one contig at a time.
+
+    :param fasta_index: FastaIndex of the original assembly
+    :param grouped_contigs: list of grouped contigs generated by group_contigs()
+    :param output: path of the fasta file written
+    :return: list of the length of each grouped sequence
+    """
+    spacer = b'N' * 1000
+
+    lengths = []
+    with open(output, 'wb') as file:
+        for contig_group in grouped_contigs:
+            contig_group = list(map(str, contig_group))
+            file.write(f'>{"_".join(contig_group)}\n'.encode())
+            for i, contig in enumerate(contig_group):
+                if i:
+                    file.write(spacer)
+                fasta_index.write_sequence(file, contig)
+            file.write(b'\n')
+            lengths.append(sum(map(fasta_index.length, contig_group)) + len(spacer) * (len(contig_group) - 1))
+
+    return lengths
 
 
 def write_grouped_contig_fasta(assembly, grouped_contigs):
     """
-    converts lists of grouped contigs into a dictionary where each key is the contig ID and the value is concatenated
-    sequence of all contigs in the group. For groups with more than 1 element, contigs spaced by 1000 N's. All sequence
-    information comes from the orignal assembly.
+    Writes the grouped contigs to a fasta file, where the ID of each sequence is the IDs of the contigs in the group
+    and the sequence is the concatenated sequence of all contigs in the group. For groups with more than 1 element,
+    contigs spaced by 1000 N's. All sequence information comes from the orignal assembly, which is read by random access
+    through a .fai index so only the grouped contigs are loaded.
 
     :param assembly: fasta file containing the sequences for all contigs in the original assembly
-    :param grouped_contigs: list of grouped contigs generated by filter_by_strand
+    :param grouped_contigs: list of grouped contigs generated by group_contigs()
     :return: a fasta file containing the sequence all NLR contigs (new and old) generated by the pipeline.
     """
 
     print('writing contigs to fasta file...')
-    contig_sequence = {}
-    with open(assembly) as file:
-        for line in file:
-            if line.startswith('>'):
-                contig_sequence[line[1:-1]] = next(file)[:-1]
+    with FastaIndex(assembly) as fasta_index:
+        write_contig_groups(fasta_index, grouped_contigs)
 
-    spacer = 'N' * 1000
 
-    grouped_contigs = [list(map(str, contig)) for contig in grouped_contigs]
+_sweep_state = {}
 
-    seqs = {">" + "_".join(contig): f"{spacer}".join(list(map(contig_sequence.get, contig))) for contig in
-            grouped_contigs}
 
-    with open('grouped_assemblies.fa', 'w') as file:
-        for k, v in seqs.items():
-            file.write(k + "\n")
-            file.write(v + "\n")
+def _init_sweep_worker(neighbour_table, assembly, directory):
+    _sweep_state['neighbour_table'] = neighbour_table
+    _sweep_state['fasta_index'] = FastaIndex(assembly)
+    _sweep_state['directory'] = directory
+
+
+@profiled(lambda summary: {'groups': summary['groups']})
+def _sweep_combination(parameters):
+    """Groups contigs with one combination of parameters and writes the grouped assembly, returns summary statistics"""
+    neighbours, cutoff, window = parameters
+    neighbour_table = _sweep_state['neighbour_table']
+    neighbour_table = NeighbourTable(neighbour_table.contigs, neighbour_table.indices[:, :neighbours],
+                                     neighbour_table.similarities[:, :neighbours])
+    contig_groups = connected_groups(neighbour_table, cutoff, window)
+
+    output = os.path.join(_sweep_state['directory'],
+                          f'grouped_assemblies_k{neighbours}_cutoff{cutoff:g}_window{window:g}.fa')
+    lengths = write_contig_groups(_sweep_state['fasta_index'], contig_groups, output)
+    group_sizes = [len(contig_group) for contig_group in contig_groups]
+
+    return {'neighbours': neighbours, 'cutoff': cutoff, 'window': window, 'groups': len(contig_groups),
+            'grouped_contigs': sum(group_sizes), 'multi_contig_groups': sum(size > 1 for size in group_sizes),
+            'largest_group': max(group_sizes, default=0),
+            'mean_group_size': np.mean(group_sizes) if group_sizes else 0,
+            'total_length': sum(lengths), 'longest_sequence': max(lengths, default=0), 'fasta': output}
+
+
+def sweep_contig_groups(neighbour_table, assembly, parameter_grid, directory, cores=1):
+    """
+    Groups contigs and writes a grouped assembly for every combination of grouping parameters. The neighbour table is
+    calculated once with the largest number of neighbours and truncated for each combination, the combinations are
+    spread over a process pool.
+
+    :param neighbour_table: NeighbourTable with at least as many neighbours as the largest value in the grid
+    :param assembly: fasta file containing the sequences for all contigs in the original assembly
+    :param parameter_grid: list of (neighbours, cutoff, window) combinations
+    :param directory: directory the grouped assemblies and summary are written to
+    :param cores: number of combinations evaluated in parallel
+    :return: DataFrame of summary statistics for each combination
+    """
+    logging.info(f"evaluating {len(parameter_grid)} combinations of grouping parameters...")
+    os.makedirs(directory, exist_ok=True)
+
+    FastaIndex(assembly).close()  # index the assembly once before the workers open it
+
+    if cores > 1 and len(parameter_grid) > 1:
+        with get_context("spawn").Pool(processes=min(cores, len(parameter_grid)), initializer=_init_sweep_worker,
+                                       initargs=(neighbour_table, assembly, directory)) as pool:
+            results = pool.map(_sweep_combination, parameter_grid)
+    else:
+        _init_sweep_worker(neighbour_table, assembly, directory)
+        results = [_sweep_combination(parameters) for parameters in parameter_grid]
+        _sweep_state['fasta_index'].close()
+        _sweep_state.clear()
+
+    summary = pd.DataFrame(results)
+    summary.to_csv(os.path.join(directory, 'sweep_summary.tsv'), sep='\t', index=False)
+    for result in results:
+        logging.info(f"k={result['neighbours']} cutoff={result['cutoff']:g} window={result['window']:g}: "
+                     f"{result['grouped_contigs']} contigs grouped into {result['groups']} groups")
+
+    return summary
+
+
+MANIFEST_COLUMNS = ['sample', 'samfile', 'blast']  # an assembly column is optional, --assembly is used otherwise
+
+
+def load_manifest(manifest, assembly=None):
+    """
+    Loads a tab separated manifest of samples with a header line and the columns sample, samfile, blast and optionally
+    assembly
+
+    :param manifest: path of the manifest
+    :param assembly: assembly of every sample without an assembly in the manifest
+    :return: list of dictionaries of sample, samfile, blast and assembly
+    """
+    samples = pd.read_csv(manifest, sep='\t', dtype=str, comment='#')
+    missing = [column for column in MANIFEST_COLUMNS if column not in samples.columns]
+    if missing:
+        raise ValueError(f"{manifest} is missing the column(s) {', '.join(missing)}")
+    if 'assembly' not in samples.columns:
+        samples['assembly'] = assembly
+    elif assembly is not None:
+        samples['assembly'] = samples['assembly'].fillna(assembly)
+    if samples['assembly'].isna().any():
+        raise ValueError(f"no assembly given for sample(s) {', '.join(samples['sample'][samples['assembly'].isna()])}")
+    if samples['sample'].duplicated().any():
+        raise ValueError(f"duplicate sample(s) in {manifest}: "
+                         f"{', '.join(samples['sample'][samples['sample'].duplicated()].unique())}")
+
+    return samples[MANIFEST_COLUMNS + ['assembly']].to_dict('records')
+
+
+_batch_state = {}
+
+
+def _init_batch_worker(descriptor, directory, neighbours, cutoff, window, blast_cache, lsh):
+    memory, arrays = attach_arrays(descriptor)
+    _batch_state['memory'] = memory  # kept open while the index is used
+    _batch_state['barcode_index'] = BarcodeIndex(arrays['read_hashes'], arrays['barcode_ids'], arrays['palette'])
+    _batch_state['parameters'] = (directory, neighbours, cutoff, window, blast_cache, lsh)
+
+
+@profiled(lambda summary: {'groups': summary['groups']})
+def _group_sample(sample):
+    """Groups the contigs of one sample with the shared index and writes its grouped assembly, returns statistics"""
+    directory, neighbours, cutoff, window, blast_cache, lsh = _batch_state['parameters']
+    logging.info(f"grouping sample {sample['sample']}...")
+
+    nlr_contig_reads = extract_mapping_data(sample['samfile'], sample['blast'], blast_cache)
+    contigs, profile_counts = build_barcode_profiles(nlr_contig_reads, _batch_state['barcode_index'])
+    neighbour_table = generate_cosine_matrix(contigs, profile_counts, neighbours, lsh=lsh)
+    contig_groups = connected_groups(neighbour_table, cutoff, window)
+
+    output = os.path.join(directory, f"grouped_assemblies_{sample['sample']}.fa")
+    with FastaIndex(sample['assembly']) as fasta_index:
+        lengths = write_contig_groups(fasta_index, contig_groups, output)
+    group_sizes = [len(contig_group) for contig_group in contig_groups]
+
+    return {'sample': sample['sample'], 'contigs': len(contigs), 'groups': len(contig_groups),
+            'multi_contig_groups': sum(size > 1 for size in group_sizes),
+            'largest_group': max(group_sizes, default=0), 'total_length': sum(lengths), 'fasta': output}
+
+
+def group_samples(samples, index, directory='.', neighbours=6, cutoff=0.5, window=0.1, cores=1, blast_cache=False,
+                  lsh=None):
+    """
+    Groups the contigs of many samples mapped against the same linked-reads. The index is loaded once and published
+    read-only in shared memory, and the samples are spread over a process pool with each worker running every stage from
+    the mapped reads to the grouped assembly of a sample.
+
+    :param samples: list of samples generated by load_manifest()
+    :param index: csv or binary index file
+    :param directory: directory the grouped assembly of each sample and the summary are written to
+    :param neighbours: number of most similar contigs (including itself) considered for each group
+    :param cutoff: minimum cosine similarity of the most similar other contig to group a contig
+    :param window: similarity below the most similar other contig for further contigs to join the group
+    :param cores: number of samples grouped in parallel
+    :param blast_cache: read the BLAST data through a binary columnar cache next to each file
+    :param lsh: None to compare all contigs, or the (bands, rows) of the LSH used to approximate the neighbours
+    :return: DataFrame of summary statistics for each sample
+    """
+    barcode_index = load_barcode_index(index)
+    os.makedirs(directory, exist_ok=True)
+    for assembly in {sample['assembly'] for sample in samples}:
+        FastaIndex(assembly).close()  # index each assembly once before the workers open it
+
+    logging.info(f"grouping {len(samples)} samples...")
+    with SharedArrays({'read_hashes': barcode_index.read_hashes, 'barcode_ids': barcode_index.barcode_ids,
+                       'palette': barcode_index.palette}) as shared_index:
+        del barcode_index
+        initargs = (shared_index.descriptor, directory, neighbours, cutoff, window, blast_cache, lsh)
+        if cores > 1 and len(samples) > 1:
+            with get_context("spawn").Pool(processes=min(cores, len(samples)), initializer=_init_batch_worker,
+                                           initargs=initargs) as pool:
+                results = pool.map(_group_sample, samples, chunksize=1)
+        else:
+            _init_batch_worker(*initargs)
+            try:
+                results = [_group_sample(sample) for sample in samples]
+            finally:
+                del _batch_state['barcode_index']  # release the views of the shared memory before closing it
+                _batch_state.pop('memory').close()
+                _batch_state.clear()
+
+    summary = pd.DataFrame(results)
+    summary.to_csv(os.path.join(directory, 'manifest_summary.tsv'), sep='\t', index=False)
+    for result in results:
+        logging.info(f"{result['sample']}: {result['contigs']} contigs grouped into {result['groups']} groups")
+
+    return summary
 
 
 @click.command()
-@click.option('-i', '--samfile', type=str, required=True, help="SAM file")
-@click.option('-b', '--blast', type=str, required=True, help="blast file")
-@click.option('-x', '--index', type=str, required=True, help="Index file generated with colour mapper")
-@click.option('-a', '--assembly', type=str, required=True, help="assembly fasta")
-def group(samfile, blast, index, assembly):
+@click.option('-i', '--samfile', type=str, required=False, default=None,
+              help="SAM file or sorted and indexed BAM file")
+@click.option('-b', '--blast', type=str, required=False, default=None, help="blast file")
+@click.option('-x', '--index', type=str, required=False, default=None,
+              help="Index file (csv or binary) generated with index")
+@click.option('-f', '--fastq', type=str, required=False, default=None,
+              help="Fastq file (plain, gzip or bgzip compressed) to correct the barcodes of mapped reads from, in "
+                   "place of --index")
+@click.option('-w', '--adapters', type=str, required=False, default=None,
+              help="Adapter sequence list, required with --fastq")
+@click.option('-s', '--split', type=int, required=False, default=1000000,
+              help="Approximate number of sequences per chunk of --fastq processed by each core")
+@click.option('-a', '--assembly', type=str, required=False, default=None, help="assembly fasta")
+@click.option('-m', '--manifest', type=str, required=False, default=None,
+              help="Tab separated list of samples (sample, samfile, blast and optionally assembly) to group in "
+                   "parallel with one index, in place of --samfile and --blast")
+@click.option('-o', '--output', type=str, required=False, default='.',
+              help="Directory the grouped assembly of each sample in --manifest is written to")
+@click.option('-c', '--cores', type=int, required=False, default=1, help="Number of cores")
+@click.option('-k', '--neighbours', type=click.IntRange(min=1), multiple=True, default=[6],
+              help="Number of most similar contigs (including itself) considered for each group")
+@click.option('--cutoff', type=float, multiple=True, default=[0.5],
+              help="Minimum cosine similarity to the most similar other contig to group a contig")
+@click.option('--window', type=float, multiple=True, default=[0.1],
+              help="Similarity below the most similar other contig for further contigs to join a group")
+@click.option('--sweep', type=str, required=False, default=None,
+              help="Directory to write a grouped assembly to for every combination of --neighbours, --cutoff and "
+                   "--window")
+@click.option('--cache', type=str, required=False, default=None,
+              help="Directory to cache intermediate results in for faster reruns")
+@click.option('--cache-size', type=float, required=False, default=10,
+              help="Maximum size of the cache in GB, least recently used results are removed first")
+@click.option('--blast-cache', is_flag=True, default=False,
+              help="Keep a binary columnar copy of the BLAST file next to it for faster reruns")
+@click.option('--approximate', is_flag=True, default=False,
+              help="Only compare contigs found to share barcodes by MinHash LSH, for very large sets of contigs")
+@click.option('--lsh-bands', type=click.IntRange(min=1), required=False, default=64,
+              help="Number of LSH bands in the approximate mode, more bands find more neighbours")
+@click.option('--lsh-rows', type=click.IntRange(min=1), required=False, default=2,
+              help="Number of MinHash values in each LSH band in the approximate mode, fewer rows find more neighbours")
+@click.option('--state', type=str, required=False, default=None,
+              help="State file to update incrementally, if it exists --samfile only holds the reads mapped since it "
+                   "was saved")
+@click.option('--server', type=str, required=False, default=None,
+              help="Socket of a server started with serve to run the command on")
+def group(samfile, blast, index, fastq, adapters, split, assembly, manifest, output, cores, neighbours, cutoff, window,
+          sweep, cache, cache_size, blast_cache, approximate, lsh_bands, lsh_rows, state, server):
+    if server is not None:
+        sys.exit(run_on_server(server))
+
     logging.info("----- running NLR-Assembler group -----")
-    nlr_contig_reads = extract_mapping_data(samfile, blast)
-    contig_hex = convert_reads_to_hexidecimal(nlr_contig_reads, index)
-    cosine_matrix = generate_cosine_matrix(contig_hex)
-    raw_contig_grouping = group_contigs(cosine_matrix)
-    merged_contig_grouping = merge_contig_groups(raw_contig_grouping)
-    final_contig_grouping = remove_subset_contigs(merged_contig_grouping)
-    write_grouped_contig_fasta(assembly, final_contig_grouping)
+    lsh = (lsh_bands, lsh_rows) if approximate else None
+    if manifest is not None:
+        if samfile is not None or blast is not None:
+            raise click.UsageError("--manifest is used in place of --samfile and --blast")
+        if index is None or fastq is not None:
+            raise click.UsageError("--manifest requires --index")
+        if sweep is not None or cache is not None or state is not None or \
+                max(len(neighbours), len(cutoff), len(window)) > 1:
+            raise click.UsageError("--manifest can not be combined with --sweep, --cache or --state")
+        try:
+            samples = load_manifest(manifest, assembly)
+        except ValueError as error:
+            raise click.UsageError(str(error))
+        group_samples(samples, index, output, neighbours[0], cutoff[0], window[0], cores, blast_cache, lsh)
+        return
+
+    for option, value in (('--samfile', samfile), ('--blast', blast), ('--assembly', assembly)):
+        if value is None:
+            raise click.UsageError(f"{option} is required")
+    if (index is None) == (fastq is None):
+        raise click.UsageError("one of --index or --fastq is required")
+    if fastq is not None and adapters is None:
+        raise click.UsageError("--fastq requires --adapters")
+    if fastq is not None:
+        index = ReadBarcodes(fastq, adapters, split)
+
+    if state is not None:
+        if sweep is not None or cache is not None or approximate or max(len(neighbours), len(cutoff), len(window)) > 1:
+            raise click.UsageError("--state can not be combined with --sweep, --cache or --approximate")
+        contig_grouping = update_contig_groups(samfile, blast, index, state, neighbours[0], cutoff[0], window[0],
+                                               cores, blast_cache)
+        write_grouped_contig_fasta(assembly, contig_grouping)
+        return
+
+    if sweep is None and max(len(neighbours), len(cutoff), len(window)) > 1:
+        raise click.UsageError("multiple values of --neighbours, --cutoff or --window require --sweep")
+
+    stage_cache = StageCache(cache, int(cache_size * 1e9)) if cache else None
+    contig_neighbours = calculate_contig_neighbours(samfile, blast, index, neighbours=max(neighbours), cores=cores,
+                                                    cache=stage_cache, blast_cache=blast_cache, lsh=lsh)
+
+    if sweep is not None:
+        parameter_grid = list(itertools.product(sorted(set(neighbours)), sorted(set(cutoff)), sorted(set(window))))
+        sweep_contig_groups(contig_neighbours, assembly, parameter_grid, sweep, cores)
+    else:
+        contig_grouping = group_contigs(contig_neighbours, cutoff[0], window[0])
+        write_grouped_contig_fasta(assembly, contig_grouping)
@@ -5,47 +5,26 @@ import re
 import random
 import csv
 import multiprocessing
+import sys
 
+from collections import deque
 from functools import partial
-from itertools import zip_longest
 from multiprocessing import get_context
 
 import click
+import numpy as np
 
-random.seed(22)  # Ensures adapter sequence : colour dictionary generated is the same each time
+from utils.barcode_index import BarcodeIndex, NO_BARCODE, hash_read_id, pack_colour, unpack_colour
+from utils.barcodes import BarcodeCorrector
+from utils.fastq import iter_fastq_chunks
+from utils.profiling import count_items, profiled
+from utils.server import resident, run_on_server
+from utils.shared import SharedArrays, attach_arrays
 
-
-# splits a fastq file into a given batch size
-def split_fastq(fastq, batch_size, temporary_directory):
-    """
-    :param fastq: fastq file
-    :param batch_size: number of sequences per subfile
-    :param temporary_directory: location of the subdirectory
-    :return: a list of all subfiles created, use to generate pool for multiprocessing
-    """
-
-    def grouper(n, iterable, fillvalue=None):
-        """Collect data into fixed-length chunks or blocks"""
-        args = [iter(iterable)] * n
-        return zip_longest(fillvalue=fillvalue, *args)
-
-    file_list = []
-
-    with open(fastq) as file:
-        for i, g in enumerate(grouper(batch_size * 4, file, fillvalue=None)):
-            with tempfile.NamedTemporaryFile('w', delete=False) as fout:
-                for j, line in enumerate(g, 1):  # count number of lines in group
-                    if line is None:
-                        j -= 1  # don't count this line
-                        break
-                    fout.write(line)
-            file_name = f'{temporary_directory}/fastq_{i}.fastq'
-            os.rename(fout.name, file_name)
-            file_list.append(file_name)
-
-    return file_list
+ADAPTER_COLOUR_SEED = 22  # Ensures adapter sequence : colour dictionary generated is the same each time
 
 
+@profiled(lambda adapter_info: {'barcodes': len(adapter_info[0])})
 def get_adapter_info(adapter_file):
     """
     :param adapter_file: text file with list of adapters (1 per line)
@@ -54,80 +33,223 @@ def get_adapter_info(adapter_file):
     """
 
     print(f'Loading adapter sequence data from {adapter_file}')
+    colour_generator = random.Random(ADAPTER_COLOUR_SEED)  # same colours however many whitelists a process loads
     with open(adapter_file) as file:
         raw_adapters = file.readlines()
         adapter_sequences = [seq[:-1] for seq in raw_adapters]  # remove newline character from each sequence
-        seq_to_color_dict = {adapter: f'{random.randint(0, 255)},{random.randint(0, 255)},{random.randint(0, 255)}' for
-                             adapter in adapter_sequences}
+        seq_to_color_dict = {adapter: f'{colour_generator.randint(0, 255)},{colour_generator.randint(0, 255)},'
+                                      f'{colour_generator.randint(0, 255)}' for adapter in adapter_sequences}
 
         return adapter_sequences, seq_to_color_dict
 
 
-def index_subfile(adapter_array, adapter_dict, fastq):
+_worker_state = {}
+
+
+def load_whitelist(adapter_file):
     """
-    Assign each sequence ID in a fastq file a colour based on a dictionary provided
-    :param adapter_array: a list of all possible adapters available
-    :param adapter_dict: a dictionary with each adapter assigned a random colour
-    :param fastq: a fastq file containing linked-reads with the same adapters used for other inputs
-    :return: writes a CSV file with each sequence ID assigned a colour based on adapter sequence
-    """
-
-    def adapter_correcter(raw_adapter, search_set):
-        """
-        Corrects a given adapter if it contains a sequencing error
-        :param raw_adapter: 16 character string (adapter) extracted from a raw fastq read
-        :param search_set: a list of all availavle adapters
-        :return: If adapter cannot be corrected None  otherwise the corrected adapter is returned
-        """
-        # If there's an ambigous base (N) in the adapter sequence search for the true sequence
-        if 'N' in raw_adapter:
-            search_string = raw_adapter.replace('N', '[ATCG]')  # convert string to regex
-            true_adapter = re.search(fr'{search_string}', str(search_set))  # search for real adapter
-
-            # If no adapter is found return true
-            if true_adapter:
-                return true_adapter.group()
-
-        else:
-            return raw_adapter
-
-    # Opens a fastq file and creates a dictionary of sequence id: adapter (First 16 bases of each read)
-    print(f'extracting sequences from {fastq}...')
-    seq_dict = {}
-    with open(fastq) as file:
-        for line in file:
-            if re.match('@', line) is not None:
-                seq_id = line.split()[0][1:]
-                seq_dict[seq_id] = next(file)[:16]
-
-    # Correct sequencing errors in the previously generated sequence id: adapter dictionary
-    print(f'Correcting sequencing data from {fastq}...')
-    seq_true_dict = {seq_id: adapter_correcter(seq, adapter_array) for seq_id, seq in seq_dict.items()}
+    Loads a whitelist and encodes it for barcode correction, or takes the copy kept resident by a server (see serve)
+    :param adapter_file: text file with list of adapters (1 per line)
+    :return: list of adapters, dictionary of adapter: colour, BarcodeCorrector and array of the colour of each adapter
+    """
+    whitelist = resident('whitelist', adapter_file)
+    if whitelist is not None:
+        print(f'Using the adapter sequence data of {adapter_file} kept by the server')
+        return whitelist
 
-    # Assigns colour to each sequence ID based on the adapter if no adapter is found sequences are coloured black
-    print(f'Assigning colours to sequence ids from {fastq}...')
-    seq_id_colour_dict = {}
-    for seq_id, seq in seq_true_dict.items():
-        if seq is None:
-            seq_id_colour_dict[seq_id] = '0,0,0'
-        else:
+    adapter_list, adapter_colour_dict = get_adapter_info(adapter_file)
+    return adapter_list, adapter_colour_dict, BarcodeCorrector.from_whitelist(adapter_list), \
+        adapter_palette(adapter_list, adapter_colour_dict)
 
-            try:
-                seq_id_colour_dict[seq_id] = adapter_dict[seq]
 
-            except KeyError:
-                seq_id_colour_dict[seq_id] = '0,0,0'
+def init_index_worker(descriptor):
+    """Attaches a pool worker to the whitelist published by share_whitelist()"""
+    memory, arrays = attach_arrays(descriptor)
+    _worker_state['memory'] = memory
+    _worker_state['corrector'] = BarcodeCorrector(arrays['codes'], arrays['barcode_ids'])
+    _worker_state['palette'] = arrays['palette']
+    _worker_state['read_hashes'] = arrays.get('read_hashes')
 
-    # Name output file based on the input fastq file
-    outfile = f'{fastq[:-6]}_index.csv'
 
-    # Write the sequence ID : colour dictionary to a csv file
-    with open(outfile, 'w') as csvfile:
+def share_whitelist(corrector, palette, read_hashes=None):
+    """
+    Publishes the encoded whitelist and the colour of each adapter in shared memory for the pool workers
+    :param corrector: a BarcodeCorrector built from all possible adapters available
+    :param palette: array of the colour of each adapter generated by adapter_palette()
+    :param read_hashes: optional sorted array of the hashed sequence IDs of the only reads to index
+    :return: SharedArrays, the descriptor is passed to init_index_worker() in each worker
+    """
+    arrays = {'codes': corrector.codes, 'barcode_ids': corrector.barcode_ids, 'palette': palette}
+    if read_hashes is not None:
+        arrays['read_hashes'] = read_hashes
+    return SharedArrays(arrays)
+
+
+def shared_whitelist():
+    """
+    :return: the BarcodeCorrector and palette a pool worker attached to with init_index_worker()
+    """
+    return _worker_state['corrector'], _worker_state['palette']
+
+
+def correct_chunk(corrector, chunk):
+    """
+    Extracts the adapter (first 16 bases) of each read in a chunk of a fastq file and corrects sequencing errors
+    :param corrector: a BarcodeCorrector built from all possible adapters available
+    :param chunk: a FastqChunk of a fastq file containing linked-reads
+    :return: list of sequence IDs and array of the adapter ID of each read (position of the adapter in the adapter
+    list, -1 if no adapter is found)
+    """
+    chunk_name = chunk.name
+
+    # Reads the chunk of the fastq file and creates a dictionary of sequence id: adapter (First 16 bases of each read)
+    print(f'extracting sequences from {chunk_name}...')
+    seq_dict = {seq_id: seq[:16] for seq_id, seq in chunk}
+    count_items(reads=len(seq_dict))
+
+    # Correct sequencing errors and replace each adapter with its position in the adapter list
+    print(f'Correcting sequencing data from {chunk_name}...')
+    return list(seq_dict.keys()), corrector.correct_ids(list(seq_dict.values()))
+
+
+def write_chunk_csv(palette, directory, chunk, seq_ids, adapter_ids):
+    """
+    Writes the colour of each read in a chunk to an intermediate CSV file named after the chunk number
+    :param palette: array of the colour of each adapter generated by adapter_palette()
+    :param directory: directory the intermediate index files are written to
+    :param chunk: the FastqChunk the reads were extracted from
+    :param seq_ids: list of sequence IDs generated by correct_chunk()
+    :param adapter_ids: array of the adapter ID of each read generated by correct_chunk()
+    """
+    # Assigns colour to each sequence ID based on the adapter if no adapter is found sequences are coloured black
+    print(f'Assigning colours to sequence ids from {chunk.name}...')
+    adapters, read_adapters = np.unique(adapter_ids, return_inverse=True)
+    colours = [unpack_colour(palette[adapter]) if adapter != NO_BARCODE else '0,0,0' for adapter in adapters]
+
+    # Write the sequence ID : colour dictionary to a csv file named after the chunk number
+    with open(f'{directory}/fastq_{chunk.number}_index.csv', 'w') as csvfile:
         writer = csv.writer(csvfile)
-        for key, value in seq_id_colour_dict.items():
-            writer.writerow([key, value])
+        writer.writerows(zip(seq_ids, map(colours.__getitem__, read_adapters.tolist())))
 
 
+def chunk_index_arrays(seq_ids, adapter_ids):
+    """
+    :param seq_ids: list of sequence IDs generated by correct_chunk()
+    :param adapter_ids: array of the adapter ID of each read generated by correct_chunk()
+    :return: array of the hashed sequence IDs and array of the adapter IDs (-1 if no adapter is found)
+    """
+    read_hashes = np.fromiter(map(hash_read_id, seq_ids), dtype=np.uint64, count=len(seq_ids))
+    return read_hashes, adapter_ids.astype(np.int32)
+
+
+@profiled()
+def index_subfile(directory, output_format, chunk):
+    """
+    Assign each sequence ID in a chunk of a fastq file a colour based on the whitelist shared with the worker
+    :param directory: directory the intermediate index files are written to
+    :param output_format: csv, binary or both, the format of the intermediate index files
+    :param chunk: a FastqChunk of a fastq file containing linked-reads with the same adapters used for other inputs
+    :return: writes a CSV file with each sequence ID assigned a colour based on adapter sequence and/or a npz file of
+    sequence ID hashes and adapter IDs
+    """
+    corrector, palette = shared_whitelist()
+    seq_ids, adapter_ids = correct_chunk(corrector, chunk)
+
+    if output_format in ('csv', 'both'):
+        write_chunk_csv(palette, directory, chunk, seq_ids, adapter_ids)
+
+    if output_format in ('binary', 'both'):
+        # Write the hashed sequence IDs and adapter IDs (-1 if no adapter is found) to a npz file
+        read_hashes, barcode_ids = chunk_index_arrays(seq_ids, adapter_ids)
+        np.savez(f'{directory}/fastq_{chunk.number}_index.npz', read_hashes=read_hashes, barcode_ids=barcode_ids)
+
+
+@profiled()
+def index_chunk(directory, chunk):
+    """
+    Corrects the barcode of each read in a chunk of a fastq file with the whitelist shared with the worker and returns
+    the index entries of the chunk, used by pipeline to index in memory
+    :param directory: directory an intermediate CSV file is written to, None to skip the CSV
+    :param chunk: a FastqChunk of a fastq file containing linked-reads
+    :return: array of the hashed sequence IDs and array of the adapter IDs (-1 if no adapter is found)
+    """
+    corrector, palette = shared_whitelist()
+    seq_ids, adapter_ids = correct_chunk(corrector, chunk)
+    if directory is not None:
+        write_chunk_csv(palette, directory, chunk, seq_ids, adapter_ids)
+    return chunk_index_arrays(seq_ids, adapter_ids)
+
+
+@profiled()
+def index_selected_chunk(chunk):
+    """
+    Corrects the barcodes of only the reads in a chunk of a fastq file whose hashed sequence IDs were shared with the
+    worker by share_whitelist()
+    :param chunk: a FastqChunk of a fastq file containing linked-reads
+    :return: array of the hashed sequence IDs and array of the adapter IDs (-1 if no adapter is found) of the selected
+    reads
+    """
+    corrector, _ = shared_whitelist()
+    selected_hashes = _worker_state['read_hashes']
+
+    seq_dict = {seq_id: seq[:16] for seq_id, seq in chunk}
+    read_hashes = np.fromiter(map(hash_read_id, seq_dict), dtype=np.uint64, count=len(seq_dict))
+    selected = np.isin(read_hashes, selected_hashes)
+
+    raw_barcodes = [barcode for barcode, keep in zip(seq_dict.values(), selected.tolist()) if keep]
+    count_items(reads=len(seq_dict), selected_reads=len(raw_barcodes))
+    return read_hashes[selected], corrector.correct_ids(raw_barcodes)
+
+
+@profiled(lambda barcode_index: {'reads': len(barcode_index.read_hashes)})
+def index_read_barcodes(fastq, adapters, read_ids, cores=1, split=1000000):
+    """
+    Streams a fastq file once and indexes the barcodes of only the given reads, in place of indexing every read
+    :param fastq: linked-read fastq file, optionally gzip or bgzip compressed
+    :param adapters: text file with list of adapters (1 per line)
+    :param read_ids: iterable of the sequence IDs of the reads to index
+    :param cores: number of cores to use for multiprocessing
+    :param split: approximate number of sequences in each chunk of the fastq file processed by a core
+    :return: a BarcodeIndex of the reads found in the fastq file
+    """
+    adapter_list, adapter_colour_dict, corrector, palette = load_whitelist(adapters)
+    selected_hashes = np.unique(np.fromiter(map(hash_read_id, read_ids), dtype=np.uint64))
+
+    with share_whitelist(corrector, palette, selected_hashes) as shared_adapters:
+        chunk_arrays = map_fastq_chunks(index_selected_chunk, fastq, cores, split, init_index_worker,
+                                        (shared_adapters.descriptor,))
+
+    read_hashes = [read_hashes for read_hashes, _ in chunk_arrays] or [np.zeros(0, np.uint64)]
+    barcode_ids = [barcode_ids for _, barcode_ids in chunk_arrays] or [np.zeros(0, np.int32)]
+    return BarcodeIndex.from_unsorted(np.concatenate(read_hashes), np.concatenate(barcode_ids), palette)
+
+
+def map_fastq_chunks(worker, fastq, cores, split, initializer=None, initargs=()):
+    """
+    Runs a worker on every chunk of a fastq file in a process pool
+    :param worker: function called with each FastqChunk
+    :param fastq: fastq file (plain, gzip or bgzip compressed)
+    :param cores: number of processes in the pool
+    :param split: approximate number of sequences per chunk
+    :param initializer: function called with initargs when each process in the pool starts
+    :param initargs: arguments of the initializer
+    :return: list of the result of each chunk, in the order of the chunks in the fastq file
+    """
+    results = []
+    # generate a pool with specified number of cores
+    with get_context("spawn").Pool(processes=cores, initializer=initializer, initargs=initargs) as pool:
+        # split fastq file into chunks for multiprocessing, plain and bgzip compressed files are split into byte
+        # ranges read by each worker, gzip compressed files are decompressed here as the workers process each chunk
+        pending = deque()
+        for chunk in iter_fastq_chunks(fastq, split):
+            pending.append(pool.apply_async(worker, (chunk,)))
+            if len(pending) > 2 * cores:  # limit the number of gzip chunks held in memory
+                results.append(pending.popleft().get())
+        results.extend(result.get() for result in pending)
+    return results
+
+
+@profiled()
 def compile_csv_data(directory):
     """
     Merges all intermediate CSV files in a directory
@@ -137,33 +259,80 @@ def compile_csv_data(directory):
 
     file_list = os.listdir(directory)  # List all files in a directory
     results = re.findall(r'fastq_[0-9]+_index.csv', str(file_list))  # filter list for all intermediate csv files
-    results.sort()  # Order files numerically, ensures output file is consistent
+    results.sort(key=lambda name: int(re.search(r'[0-9]+', name).group()))  # Order files numerically, ensures output file is consistent
 
     # Merge all intermediate csv files by loading each as a dictionary and writing it to the final output
-    print(f'Compiling indexed sequences and writing to: {os.getcwd()}/multiprocess_index.csv')
+    print(f'Compiling indexed sequences and writing to: {os.getcwd()}/barcode_index.csv')
     with open('barcode_index.csv', 'w') as output:
         writer = csv.writer(output)
         for file in results:
             with open(f'{directory}/{file}', 'r') as infile:
                 subfile_dict = {rows[0]: rows[1] for rows in csv.reader(infile)}
+                count_items(reads=len(subfile_dict))
                 for key, value in subfile_dict.items():
                     writer.writerow([key, value])
 
 
+def adapter_palette(adapter_list, adapter_dict):
+    """
+    :param adapter_list: a list of all adapters, the position of each adapter is its adapter ID
+    :param adapter_dict: a dictionary with each adapter assigned a random colour
+    :return: array of the colour of each adapter packed as 0xRRGGBB
+    """
+    return np.fromiter((pack_colour(adapter_dict[adapter]) for adapter in adapter_list), dtype=np.uint32,
+                       count=len(adapter_list))
+
+
+@profiled()
+def compile_binary_data(directory, adapter_list, adapter_dict):
+    """
+    Merges all intermediate npz files in a directory into a binary index sorted by sequence ID hash
+    :param directory: a directory containing intermediate npz files
+    :param adapter_list: a list of all adapters, the position of each adapter is its adapter ID
+    :param adapter_dict: a dictionary with each adapter assigned a random colour
+    :return: binary index file
+    """
+
+    results = [file for file in os.listdir(directory) if re.fullmatch(r'fastq_[0-9]+_index.npz', file)]
+    read_hashes = []
+    barcode_ids = []
+    for file in results:
+        with np.load(f'{directory}/{file}') as subfile:
+            read_hashes.append(subfile['read_hashes'])
+            barcode_ids.append(subfile['barcode_ids'])
+    count_items(reads=sum(map(len, read_hashes)))
+
+    palette = adapter_palette(adapter_list, adapter_dict)
+    print(f'Compiling indexed sequences and writing to: {os.getcwd()}/barcode_index.bin')
+    BarcodeIndex.from_unsorted(np.concatenate(read_hashes or [np.zeros(0, np.uint64)]),
+                               np.concatenate(barcode_ids or [np.zeros(0, np.int32)]),
+                               palette).write('barcode_index.bin')
+
+
 @click.command()
-@click.option('-f', '--fastq', type=str, required=True, help="Fastq file")
+@click.option('-f', '--fastq', type=str, required=True, help="Fastq file (plain, gzip or bgzip compressed)")
 @click.option('-a', '--adapters', type=str, required=True, help="Adapter sequence list")
 @click.option('-c', '--cores', type=int, required=False, help="Number of cores", default=1)
-@click.option('-s', '--split', type=int, required=False, help="Maximum number of sequences per subfile")
-def index(fastq, adapters, cores, split=1000000):
+@click.option('-s', '--split', type=int, required=False, default=1000000,
+              help="Approximate number of sequences per chunk processed by each core")
+@click.option('-o', '--output-format', type=click.Choice(['csv', 'binary', 'both']), required=False, default='csv',
+              help="Write the index as barcode_index.csv, barcode_index.bin or both")
+@click.option('--server', type=str, required=False, default=None,
+              help="Socket of a server started with serve to run the command on")
+def index(fastq, adapters, cores, split, output_format, server):
     """
     Click command to genrate a colour index of all reads in a fastq file based on adapter sequence of the reads
-    :param fastq: linked-read fastq file to be processed
+    :param fastq: linked-read fastq file to be processed, optionally gzip or bgzip compressed
     :param adapters: list of all adapters that could be in linked-read fastq file
     :param cores: number of cores to use for multiprocessing
-    :param split: number of sequences per subfile generated
-    :return: csv file with each sequence ID assigned a colour based on adapter sequence
+    :param split: approximate number of sequences in each byte range of the fastq file processed by a core
+    :param output_format: csv, binary or both, the format of the index written
+    :param server: socket of a server to run the command on
+    :return: csv file with each sequence ID assigned a colour based on adapter sequence and/or a binary index
     """
+    if server is not None:
+        sys.exit(run_on_server(server))
+
     print("----- running NLR-Assembler index -----")
     # Ensure only available cores are used
     if cores > multiprocessing.cpu_count():
@@ -172,13 +341,17 @@ def index(fastq, adapters, cores, split=1000000):
 
     temp_dir = tempfile.mkdtemp()  # create a temporary directory
     print(f'temporary directory cretaed at: {temp_dir}')
-    sub_fastq = split_fastq(fastq, split, temp_dir)  # split fastq file into intermediates for multiprocessing
-    adapter_list, adapter_colour_dict = get_adapter_info(adapters)  # extract adapter sequence information
-    pool = get_context("spawn").Pool(
-        processes=cores)  # generate a pool for multiprocessing with specified number of cores
-    pool.map(partial(index_subfile, adapter_list, adapter_colour_dict),
-             sub_fastq)  # multiprocess fastq intermediate files
-    compile_csv_data(temp_dir)  # merge all intermediate csv files into a single output
+    # extract adapter sequence information and encode adapters once to correct sequencing errors in every chunk, the
+    # workers attach to the encoded adapters and their colours in shared memory instead of each receiving a copy of the
+    # adapter list
+    adapter_list, adapter_colour_dict, corrector, palette = load_whitelist(adapters)
+    worker = partial(index_subfile, temp_dir, output_format)
+    with share_whitelist(corrector, palette) as shared_adapters:
+        map_fastq_chunks(worker, fastq, cores, split, init_index_worker, (shared_adapters.descriptor,))
+    if output_format in ('csv', 'both'):
+        compile_csv_data(temp_dir)  # merge all intermediate csv files into a single output
+    if output_format in ('binary', 'both'):
+        compile_binary_data(temp_dir, adapter_list, adapter_colour_dict)  # merge intermediate npz files
     shutil.rmtree(temp_dir)  # delete the temporary directory
 
 # example command
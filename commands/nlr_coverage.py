@@ -1,8 +1,17 @@
 import click
 import logging
+import os
+import sys
+from multiprocessing import get_context
 import numpy as np
 import pandas as pd
 
+from utils.blast import load_blast
+from utils.fasta import FastaIndex
+from utils.intervals import covered_bases, depth_runs
+from utils.profiling import profiled
+from utils.server import run_on_server
+
 
 class NLR:
     """
@@ -11,7 +20,8 @@ class NLR:
     Attributes
     ----------
     name: the name of the nlr sequence in the fasta file
-    coverage_array: an array of zeroes equal to the length of the NLR sequence
+    seq_length: the length of the NLR sequence
+    coverage_array: an array of zeroes equal to the length of the NLR sequence, only allocated once a hit is added
     coverage: the percentage of array positions containing a non-zero value
     
     Methods
@@ -25,9 +35,16 @@ class NLR:
     
     def __init__(self, name, seq_length):
         self.name = name
-        self.coverage_array = np.zeros(seq_length)
+        self.seq_length = seq_length
+        self._coverage_array = None
         self.coverage = 0
 
+    @property
+    def coverage_array(self):
+        if self._coverage_array is None:
+            self._coverage_array = np.zeros(self.seq_length, dtype=np.uint32)
+        return self._coverage_array
+
     def add_coverage(self, start, end):
         """
         add coverage of a blast hit to the coverage_array
@@ -37,8 +54,7 @@ class NLR:
         :return None: updates the coverage_array
         """
         
-        for n in list(range(start - 1, end, 1)):
-            self.coverage_array[n] += 1
+        self.coverage_array[start - 1:end] += 1
 
     def get_coverage(self):
         '''
@@ -49,91 +65,218 @@ class NLR:
         return (np.count_nonzero(self.coverage_array) * 100) / len(self.coverage_array)
 
 
+@profiled(lambda nlrs: {'nlrs': len(nlrs)})
 def load_NLR_data(fasta_file):
     '''
-    Load NLR sequence data into NLR classes
+    Load NLR sequence data into NLR classes. Sequence lengths are read from a .fai index of the FASTA file (built if
+    missing), so wrapped FASTA files are supported and the sequences themselves are never loaded.
     
     :param fasta_file: FASTA file of NLR sequences
     :return dictionary: a dictionary of all NLR sequences as NLR classes
     '''
-    NLR_dict = {}
     logging.info("loading NLR sequences...")
-    with open(fasta_file) as file:
-        for line in file:
-            if line.startswith(">"):
-                header = line.split()
-                NLR_dict[header[0][1:]] = len(next(file))
+    with FastaIndex(fasta_file) as fasta_index:
+        NLR_dict = {name: fasta_index.length(name) for name in fasta_index}
 
     return {k: NLR(k, v) for k, v in NLR_dict.items()}
 
 
-def load_BLAST_data(blast_table):
+@profiled(lambda blast_data: {'hits': len(blast_data)})
+def load_BLAST_data(blast_table, blast_cache=False):
     '''
-    load BLAST data and extract the subject, start and end positions for each hit
+    load BLAST data and extract the query, subject, start and end positions for each hit in a single pass
     
     :param blast_table: raw BLAST data
-    :return BLAST_list: A list of lists where each list represents NLR target and start/end positions of a unique BLAST hit
+    :param blast_cache: read the BLAST data through a binary columnar cache next to the file
+    :return BLAST_data: A DataFrame with the contig (query), subject and start and end positions (start <= end) of
+    each BLAST hit
     '''
-    BLAST_list = []
     logging.info("loading BLAST data...")
-    with open(blast_table) as file:
-        for n, line in enumerate(file):
-            row = line.split()
-            positions = [int(row[8]), int(row[9])]
-            BLAST_list.append([row[1], min(positions), max(positions)])
+    blast = load_blast(blast_table, columns=[0, 1, 8, 9], cache=blast_cache)
+    positions = blast[[8, 9]].to_numpy()
+    return pd.DataFrame({'contig': blast[0], 'subject': blast[1], 'start': positions.min(axis=1),
+                         'end': positions.max(axis=1)})
 
-    return BLAST_list
 
+@profiled(lambda coverage_array: {'nlrs': len(coverage_array)})
+def calculate_NLR_coverage(nlr_class_dict, blast_data):
+    '''
+    Calculates the percentage of each NLR covered by the BLAST hits from the union of the hits on each NLR, without
+    building a per-base array. The coverage attribute of each NLR class is updated.
+    
+    :param nlr_class_dict: a dictionary containing the NLR class for each NLR sequence
+    :param blast_data: DataFrame of BLAST hits generated by load_BLAST_data()
+    :return array: the percentage of each NLR covered by the BLAST results
+    '''
+    names = list(nlr_class_dict)
+    lengths = np.array([nlr.seq_length for nlr in nlr_class_dict.values()], dtype=np.int64)
+    subjects = pd.Categorical(blast_data['subject'], categories=names).codes
+    unknown = subjects < 0
+    if unknown.any():
+        logging.warning(f"{unknown.sum()} BLAST hits to sequences not in the NLR file were skipped")
 
-def calculate_mean_NLR_coverage(nlr_class_dict, blast_array):
+    covered = covered_bases(lengths, subjects[~unknown], blast_data['start'].to_numpy()[~unknown],
+                            blast_data['end'].to_numpy()[~unknown])
+    coverage_array = covered * 100 / lengths
+    for nlr, coverage in zip(nlr_class_dict.values(), coverage_array):
+        nlr.coverage = coverage
+
+    return coverage_array
+
+
+def calculate_mean_NLR_coverage(nlr_class_dict, blast_data):
     '''
     Calculates the average % of all NLRs covered by the BLAST results
     
     :param nlr_class_dict: a dictionary containing the NLR class for each NLR sequence
-    :param blast_array: The array of blast start/end positions for all NLR BLAST hits
+    :param blast_data: DataFrame of BLAST hits generated by load_BLAST_data()
     :return int: The average of percentage of each NLR covered by the BLAST results
     '''
     
     logging.info('calculating NLR coverage...')
-    [nlr_class_dict[val[0]].add_coverage(val[1], val[2]) for val in blast_array]
-    coverage_array = np.asarray([nlr.get_coverage() for nlr in nlr_class_dict.values()])
-    return coverage_array.mean()
+    return calculate_NLR_coverage(nlr_class_dict, blast_data).mean()
 
 
-def determine_assembly_coverage(nlr, blast):
+@profiled()
+def write_NLR_depth(nlr_class_dict, blast_data, output):
+    '''
+    Writes the per-base depth of the BLAST hits on each NLR in bedGraph format, covered regions only
+    
+    :param nlr_class_dict: a dictionary containing the NLR class for each NLR sequence
+    :param blast_data: DataFrame of BLAST hits generated by load_BLAST_data()
+    :param output: path of the bedGraph file
+    :return None: output is a bedGraph file
+    '''
+    names = list(nlr_class_dict)
+    lengths = np.array([nlr.seq_length for nlr in nlr_class_dict.values()], dtype=np.int64)
+    subjects = pd.Categorical(blast_data['subject'], categories=names).codes
+    known = subjects >= 0
+    sequences, starts, ends, depths = depth_runs(lengths, subjects[known], blast_data['start'].to_numpy()[known],
+                                                 blast_data['end'].to_numpy()[known])
+
+    logging.info(f"Saving NLR depth to {output} ...")
+    pd.DataFrame({'name': np.asarray(names, dtype=object)[sequences], 'start': starts, 'end': ends,
+                  'depth': depths}).to_csv(output, sep="\t", header=False, index=False)
+
+
+@profiled(lambda assembly_stats: {'contigs': assembly_stats[1]})
+def determine_assembly_coverage(nlr_data, blast, depth=None, blast_cache=False):
     '''
     calculates average NLR coverage for a given assembly
     
-    :param nlr: NLR sequence fasta file from a reference genome
+    :param nlr_data: dictionary of NLR classes for the NLR sequences from a reference genome generated by load_NLR_data()
     :param blast: BLAST data of an assembly aligned to NLR sequences from the same reference genome as above
+    :param depth: optional path to write the per-base depth of the BLAST hits on each NLR to (bedGraph)
+    :param blast_cache: read the BLAST data through a binary columnar cache next to the file
     :return list: mean coverage of the assembly and total number of contigs in the assembly 
     
     '''
-    nlr_data = load_NLR_data(nlr)
-    blast_data = load_BLAST_data(blast)
+    blast_data = load_BLAST_data(blast, blast_cache)
     coverage_mean = calculate_mean_NLR_coverage(nlr_data, blast_data)
-    total_contigs = len(pd.read_csv(blast, header=None, sep="\t")[0].unique())
+    if depth is not None:
+        write_NLR_depth(nlr_data, blast_data, depth)
+    total_contigs = blast_data['contig'].nunique()
     logging.info(f"Average NLR Covereage: {coverage_mean}")
     logging.info(f"Total Contigs: {total_contigs}")
     return [coverage_mean, total_contigs]
 
 
+_worker_state = {}
+
+
+def _init_worker(nlr_data, blast_cache):
+    _worker_state['nlr_data'] = nlr_data
+    _worker_state['blast_cache'] = blast_cache
+
+
+def _assembly_coverage(assembly):
+    label, blast, depth = assembly
+    return determine_assembly_coverage(_worker_state['nlr_data'], blast, depth, _worker_state['blast_cache'])
+
+
+def compare_assemblies(nlr, assemblies, depth=False, cores=1, blast_cache=False):
+    '''
+    Calculates the NLR coverage of any number of assemblies. The NLR sequences are loaded once and the assemblies are
+    evaluated in parallel.
+    
+    :param nlr: NLR sequence fasta file from a reference genome
+    :param assemblies: list of (label, BLAST data) for each assembly
+    :param depth: write the per-base depth of each assembly to NLR_depth_{label}.bedgraph
+    :param cores: number of assemblies evaluated in parallel
+    :param blast_cache: read the BLAST data through a binary columnar cache next to each file
+    :return DataFrame: the coverage of NLRs and number of contigs (rows) for each assembly (columns) and the difference
+    of each assembly from the first assembly (PD)
+    '''
+    nlr_data = load_NLR_data(nlr)
+    jobs = [(label, blast, f"NLR_depth_{label}.bedgraph" if depth else None) for label, blast in assemblies]
+
+    if cores > 1 and len(jobs) > 1:
+        with get_context("spawn").Pool(processes=min(cores, len(jobs)), initializer=_init_worker,
+                                       initargs=(nlr_data, blast_cache)) as pool:
+            assembly_stats = pool.map(_assembly_coverage, jobs)
+    else:
+        _init_worker(nlr_data, blast_cache)
+        assembly_stats = [_assembly_coverage(job) for job in jobs]
+        _worker_state.clear()
+
+    labels = [label for label, _ in assemblies]
+    for label, (coverage_mean, total_contigs) in zip(labels, assembly_stats):
+        logging.info(f"{label}: Average NLR Covereage: {coverage_mean}, Total Contigs: {total_contigs}")
+
+    cc = pd.DataFrame(assembly_stats, index=labels, columns=["coverage of NLRs (%)", "contigs"]).transpose()
+    first = labels[0]
+    for label in labels[1:]:
+        pd_column = "PD" if len(labels) == 2 else f"PD {label}"
+        cc[pd_column] = [cc[label].iloc[0] - cc[first].iloc[0],
+                         (cc[label].iloc[1] / cc[first].iloc[1] - 1) * 100]  # as DataFrame.pct_change
+
+    return cc
+
+
+def parse_assembly(blast):
+    '''
+    :param blast: BLAST data of an assembly, optionally labelled as LABEL=PATH
+    :return tuple: label (the file name without its extension if no label is given) and path of the BLAST data
+    '''
+    label, separator, path = blast.partition("=")
+    if not separator or os.path.exists(blast):
+        return os.path.splitext(os.path.basename(blast))[0], blast
+    return label, path
+
+
 @click.command()
-@click.option('-d', '--draft', type=str, required=True, help="draft assembly BLAST alignment")
-@click.option('-f', '--final', type=str, required=True, help="final assembly BLAST alignment")
+@click.option('-d', '--draft', type=str, required=False, default=None, help="draft assembly BLAST alignment")
+@click.option('-f', '--final', type=str, required=False, default=None, help="final assembly BLAST alignment")
+@click.option('-b', '--blast', type=str, multiple=True,
+              help="BLAST alignment of any other assembly, optionally labelled as LABEL=PATH (can be repeated)")
 @click.option('-n', '--nlr', type=str, required=True, help="NLR Annotator file")
-def nlr_coverage(draft, final, nlr):
+@click.option('-c', '--cores', type=int, required=False, default=1, help="Number of cores")
+@click.option('--depth', is_flag=True, default=False, help="Write the per-base depth of each assembly on the NLRs")
+@click.option('--blast-cache', is_flag=True, default=False,
+              help="Keep a binary columnar copy of each BLAST file next to it for faster reruns")
+@click.option('--server', type=str, required=False, default=None,
+              help="Socket of a server started with serve to run the command on")
+def nlr_coverage(draft, final, blast, nlr, cores, depth, blast_cache, server):
     """
     
     :param nlr: NLR sequences from a reference genome
     :param draft: a draft assembly
     :param final: a final assembly generated by NLR-Assembler
+    :param blast: any other assemblies to compare
     :return None: output is a CSV file containing all results
     """
+    if server is not None:
+        sys.exit(run_on_server(server))
+
     logging.info("----- running NLR-Assembler nlr-coverage -----")
-    draft_assembly_stats = determine_assembly_coverage(nlr, draft)
-    final_assembly_stats = determine_assembly_coverage(nlr, final)
+    assemblies = [(label, path) for label, path in (("draft", draft), ("final", final)) if path is not None]
+    assemblies += [parse_assembly(assembly) for assembly in blast]
+
+    labels = [label for label, _ in assemblies]
+    if len(labels) < 2:
+        raise click.UsageError("at least two assemblies (--draft, --final or --blast) are required for a comparison")
+    if len(set(labels)) != len(labels):
+        raise click.UsageError(f"assembly labels must be unique: {', '.join(labels)}")
 
-    cc = pd.DataFrame([draft_assembly_stats, final_assembly_stats], index=["draft", "final"], columns=["coverage of NLRs (%)", "contigs"]).transpose()
-    cc["PD"] = [cc.final.iloc[0]-cc.draft.iloc[0], (cc[['draft', 'final']].pct_change(axis=1)['final'][1] * 100)]
+    cc = compare_assemblies(nlr, assemblies, depth, cores, blast_cache)
     cc.to_csv("NLR_coverage.txt", sep="\t")
@@ -0,0 +1,101 @@
+import logging
+import multiprocessing
+import shutil
+import sys
+import tempfile
+from functools import partial
+
+import click
+import numpy as np
+
+from commands.group import build_barcode_profiles, extract_mapping_data, generate_cosine_matrix, group_contigs, \
+    write_grouped_contig_fasta
+from commands.index import compile_csv_data, index_chunk, init_index_worker, load_whitelist, map_fastq_chunks, \
+    share_whitelist
+from utils.barcode_index import BarcodeIndex
+from utils.profiling import profiled
+from utils.server import run_on_server
+
+
+@profiled(lambda barcode_index: {'reads': len(barcode_index.read_hashes)})
+def build_barcode_index(fastq, corrector, palette, cores=1, split=1000000, index_output=None):
+    """
+    Indexes the barcode of every read in a fastq file in memory, the index is only written to disk if requested
+    :param fastq: linked-read fastq file, optionally gzip or bgzip compressed
+    :param corrector: BarcodeCorrector of the whitelist, the position of each adapter is its adapter ID
+    :param palette: array of the packed colour of each adapter
+    :param cores: number of cores used to index the reads
+    :param split: approximate number of sequences in each chunk of the fastq file processed by a core
+    :param index_output: None, csv, binary or both, the format of the index written to the working directory
+    :return: a BarcodeIndex of every read
+    """
+    temp_dir = tempfile.mkdtemp() if index_output in ('csv', 'both') else None
+    try:
+        with share_whitelist(corrector, palette) as shared_adapters:
+            chunk_arrays = map_fastq_chunks(partial(index_chunk, temp_dir), fastq, cores, split, init_index_worker,
+                                            (shared_adapters.descriptor,))
+        if temp_dir is not None:
+            compile_csv_data(temp_dir)  # merge all intermediate csv files into a single output
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+
+    read_hashes = [read_hashes for read_hashes, _ in chunk_arrays] or [np.zeros(0, np.uint64)]
+    barcode_ids = [barcode_ids for _, barcode_ids in chunk_arrays] or [np.zeros(0, np.int32)]
+    barcode_index = BarcodeIndex.from_unsorted(np.concatenate(read_hashes), np.concatenate(barcode_ids), palette)
+    if index_output in ('binary', 'both'):
+        logging.info("Saving the barcode index to barcode_index.bin ...")
+        barcode_index.write('barcode_index.bin')
+    return barcode_index
+
+
+@click.command()
+@click.option('-f', '--fastq', type=str, required=True, help="Fastq file (plain, gzip or bgzip compressed)")
+@click.option('-w', '--adapters', type=str, required=True, help="Adapter sequence list")
+@click.option('-i', '--samfile', type=str, required=True, help="SAM file or sorted and indexed BAM file")
+@click.option('-b', '--blast', type=str, required=True, help="blast file")
+@click.option('-a', '--assembly', type=str, required=True, help="assembly fasta")
+@click.option('-c', '--cores', type=int, required=False, default=1, help="Number of cores")
+@click.option('-s', '--split', type=int, required=False, default=1000000,
+              help="Approximate number of sequences per chunk processed by each core")
+@click.option('-k', '--neighbours', type=click.IntRange(min=1), required=False, default=6,
+              help="Number of most similar contigs (including itself) considered for each group")
+@click.option('--cutoff', type=float, required=False, default=0.5,
+              help="Minimum cosine similarity to the most similar other contig to group a contig")
+@click.option('--window', type=float, required=False, default=0.1,
+              help="Similarity below the most similar other contig for further contigs to join a group")
+@click.option('--index-output', type=click.Choice(['csv', 'binary', 'both']), required=False, default=None,
+              help="Also write the barcode index as barcode_index.csv, barcode_index.bin or both")
+@click.option('--blast-cache', is_flag=True, default=False,
+              help="Keep a binary columnar copy of the BLAST file next to it for faster reruns")
+@click.option('--approximate', is_flag=True, default=False,
+              help="Only compare contigs found to share barcodes by MinHash LSH, for very large sets of contigs")
+@click.option('--lsh-bands', type=click.IntRange(min=1), required=False, default=64,
+              help="Number of LSH bands in the approximate mode, more bands find more neighbours")
+@click.option('--lsh-rows', type=click.IntRange(min=1), required=False, default=2,
+              help="Number of MinHash values in each LSH band in the approximate mode, fewer rows find more neighbours")
+@click.option('--server', type=str, required=False, default=None,
+              help="Socket of a server started with serve to run the command on")
+def pipeline(fastq, adapters, samfile, blast, assembly, cores, split, neighbours, cutoff, window, index_output,
+             blast_cache, approximate, lsh_bands, lsh_rows, server):
+    """
+    Runs index and group in one process tree, the barcode of each read is passed from index to group in memory
+    """
+    if server is not None:
+        sys.exit(run_on_server(server))
+
+    logging.info("----- running NLR-Assembler pipeline -----")
+    if cores > multiprocessing.cpu_count():
+        logging.warning(f'Too many cores specified {cores}! {multiprocessing.cpu_count()} cores will be used')
+        cores = multiprocessing.cpu_count()
+
+    _, _, corrector, palette = load_whitelist(adapters)  # extract and encode adapter sequence information
+    logging.info("indexing barcodes...")
+    barcode_index = build_barcode_index(fastq, corrector, palette, cores, split, index_output)
+
+    nlr_contig_reads = extract_mapping_data(samfile, blast, blast_cache)
+    contigs, profile_counts = build_barcode_profiles(nlr_contig_reads, barcode_index)
+    contig_neighbours = generate_cosine_matrix(contigs, profile_counts, neighbours, cores,
+                                               (lsh_bands, lsh_rows) if approximate else None)
+    contig_grouping = group_contigs(contig_neighbours, cutoff, window)
+    write_grouped_contig_fasta(assembly, contig_grouping)
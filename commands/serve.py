@@ -0,0 +1,34 @@
+import logging
+
+import click
+
+from commands.group import load_barcode_index
+from commands.index import load_whitelist
+from utils.server import keep_resident, serve as serve_commands
+
+
+@click.command()
+@click.option('-s', '--socket', 'socket_path', type=str, required=False, default='nlr_assembler.sock',
+              help="Unix domain socket to listen on")
+@click.option('-w', '--adapters', type=str, multiple=True, help="Adapter sequence list to keep loaded (repeatable)")
+@click.option('-x', '--index', type=str, multiple=True,
+              help="Index file (csv or binary) generated with index to keep loaded (repeatable)")
+@click.pass_context
+def serve(ctx, socket_path, adapters, index):
+    """
+    Loads whitelists and barcode indexes once and runs the commands sent to it with --server until it is interrupted
+    :param socket_path: path of the Unix domain socket
+    :param adapters: adapter sequence lists, encoded for barcode correction and kept in memory
+    :param index: index files kept in memory
+    """
+    logging.info("----- running NLR-Assembler serve -----")
+    for adapter_file in adapters:
+        keep_resident('whitelist', adapter_file, load_whitelist(adapter_file))
+    for index_file in index:
+        keep_resident('index', index_file, load_barcode_index(index_file))
+
+    # import every command (and its dependencies) once, the runs are forked from this process and share the modules
+    root = ctx.find_root()
+    for command_name in root.command.list_commands(root):
+        root.command.get_command(root, command_name)
+    serve_commands(socket_path, root.command)
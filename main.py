@@ -1,24 +1,54 @@
 #!/usr/local/bin/python3
 import click
+import importlib
 import logging
 import sys
-from commands.group import group
-from commands.index import index
-from commands.nlr_coverage import nlr_coverage
-from commands.contig_coverage import contig_coverage
+from utils.profiling import enable_profiling, write_report
 
 logging.basicConfig(stream=sys.stdout, format='%(asctime)s - %(message)s', datefmt='%d-%b-%y %H:%M:%S',
                     level=logging.INFO)
 
-@click.group(help=" NLR-Assembler is a command line tool for improving RenSeq Assemblies using linked-read sequencing by 10x Genomics.")
-def cli():
-    pass
+# command name: module and name of the click command and the help listed by main.py, each module (and pandas,
+# scikit-learn... imported by it) is only imported when its command is run, this module is also imported by every
+# spawned pool worker
+COMMANDS = {
+    'index': ('commands.index', 'index', "Generates a colour index of all reads in a fastq file by barcode"),
+    'group': ('commands.group', 'group', "Groups NLR contigs by the barcodes of the reads mapped to them"),
+    'nlr-coverage': ('commands.nlr_coverage', 'nlr_coverage',
+                     "Compares the coverage of reference NLRs by the draft, final and other assemblies"),
+    'contig-coverage': ('commands.contig_coverage', 'contig_coverage',
+                        "Calculates the region of the genome covered by each group of contigs"),
+    'pipeline': ('commands.pipeline', 'pipeline', "Runs index and group in one process tree"),
+    'serve': ('commands.serve', 'serve', "Keeps whitelists and indexes loaded and runs commands sent with --server"),
+}
 
 
-cli.add_command(index)
-cli.add_command(group)
-cli.add_command(nlr_coverage)
-cli.add_command(contig_coverage)
+class LazyGroup(click.Group):
+    """Click group importing the module of a command from COMMANDS the first time the command is looked up"""
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(COMMANDS))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands and cmd_name in COMMANDS:
+            module, name, _ = COMMANDS[cmd_name]
+            self.add_command(getattr(importlib.import_module(module), name), cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def format_commands(self, ctx, formatter):
+        # lists the help of COMMANDS instead of importing every command
+        with formatter.section("Commands"):
+            formatter.write_dl([(name, COMMANDS[name][2]) for name in self.list_commands(ctx)])
+
+
+@click.group(cls=LazyGroup, help=" NLR-Assembler is a command line tool for improving RenSeq Assemblies using linked-read sequencing by 10x Genomics.")
+@click.option('--profile', type=str, required=False, default=None,
+              help="Write the wall time, CPU time, peak memory and item counts of each stage to a JSON report")
+@click.pass_context
+def cli(ctx, profile):
+    if profile is not None:
+        enable_profiling(profile)
+        ctx.call_on_close(lambda: write_report(profile, sys.argv))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,209 @@
+"""
+Minimal reader for BAM files that extracts the names of the reads aligned to a set of reference sequences. When the
+BAM file is coordinate sorted and indexed (.bai), only the BGZF blocks holding alignments to the requested references
+are decompressed, otherwise the whole file is scanned once.
+"""
+import os
+import struct
+
+from utils.bgzf import compression, read_block, read_blocks
+
+BAM_MAGIC = b'BAM\x01'
+BAI_MAGIC = b'BAI\x01'
+BAI_PSEUDO_BIN = 37450  # bin holding index metadata rather than alignments
+
+
+def is_bam(path):
+    """
+    :param path: path to an alignment file
+    :return: True if the file is a BAM file
+    """
+    if compression(path) != 'bgzf':
+        return False
+
+    with open(path, 'rb') as file:
+        return read_block(file, 0)[1].startswith(BAM_MAGIC)
+
+
+def find_bam_index(path):
+    """
+    :param path: path to a BAM file
+    :return: path to the .bai index of the BAM file or None if there is no index
+    """
+    for index_path in (f'{path}.bai', f'{os.path.splitext(path)[0]}.bai'):
+        if os.path.exists(index_path):
+            return index_path
+    return None
+
+
+def load_bam_index(path):
+    """
+    Loads the alignment chunks of each reference from a .bai index
+
+    :param path: path to a .bai index
+    :return: list of [(start virtual offset, end virtual offset)] for each reference, sorted and merged
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    if not data.startswith(BAI_MAGIC):
+        raise ValueError(f'{path} is not a valid BAI index')
+
+    position = len(BAI_MAGIC)
+    n_references, = struct.unpack_from('<i', data, position)
+    position += 4
+
+    reference_chunks = []
+    for _ in range(n_references):
+        n_bins, = struct.unpack_from('<i', data, position)
+        position += 4
+        chunks = []
+        for _ in range(n_bins):
+            bin_id, n_chunks = struct.unpack_from('<Ii', data, position)
+            position += 8
+            if bin_id != BAI_PSEUDO_BIN:
+                chunks.extend(struct.unpack_from(f'<{2 * n_chunks}Q', data, position)[i:i + 2] for i in
+                              range(0, 2 * n_chunks, 2))
+            position += 16 * n_chunks
+
+        n_intervals, = struct.unpack_from('<i', data, position)
+        position += 4 + 8 * n_intervals  # the linear index is not needed to fetch whole references
+
+        # merge overlapping and adjacent chunks so that each block is only decompressed once
+        merged = []
+        for start, end in sorted(chunks):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        reference_chunks.append(merged)
+
+    return reference_chunks
+
+
+def _parse_read_names(data, position, end, wanted, read_names):
+    """
+    Appends the read name of each alignment record in data[position:end] aligned to a wanted reference
+
+    :param data: decompressed BAM data
+    :param position: offset of the first record
+    :param end: offset after the last complete record to parse
+    :param wanted: set of wanted reference IDs
+    :param read_names: dictionary of reference ID: list of read names, updated in place
+    :return: offset of the first unparsed record
+    """
+    while position + 4 <= end:
+        block_size, reference_id = struct.unpack_from('<ii', data, position)
+        if position + 4 + block_size > end:
+            break
+
+        if reference_id in wanted:
+            name_length = data[position + 12]
+            read_names[reference_id].append(data[position + 36:position + 35 + name_length].decode())
+
+        position += 4 + block_size
+
+    return position
+
+
+class BamReader:
+    """
+    Reads the names of reads aligned to reference sequences in a BAM file
+
+    Attributes
+    ----------
+    path: path to the BAM file
+    references: list of reference sequence names in the BAM header
+    index: chunks of each reference loaded from the .bai index, None if the BAM file is not indexed
+
+    Methods
+    -------
+    read_names(references)
+        returns a dictionary of reference name: list of names of all reads aligned to the reference
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._header_end = 0
+        self.references = self._read_header()
+
+        index_path = find_bam_index(path)
+        self.index = load_bam_index(index_path) if index_path else None
+
+    def _read_header(self):
+        """Reads the reference names from the BAM header"""
+        with open(self.path, 'rb') as file:
+            data = bytearray()
+            blocks = read_blocks(file, 0)
+
+            def require(length):
+                while len(data) < length:
+                    block = next(blocks, None)
+                    if block is None:
+                        raise ValueError(f'{self.path} has a truncated BAM header')
+                    data.extend(block[1])
+
+            require(12)
+            if not data.startswith(BAM_MAGIC):
+                raise ValueError(f'{self.path} is not a valid BAM file')
+
+            text_length, = struct.unpack_from('<i', data, 4)
+            position = 8 + text_length
+            require(position + 4)
+            n_references, = struct.unpack_from('<i', data, position)
+            position += 4
+
+            references = []
+            for _ in range(n_references):
+                require(position + 4)
+                name_length, = struct.unpack_from('<i', data, position)
+                require(position + 8 + name_length)
+                references.append(data[position + 4:position + 3 + name_length].decode())
+                position += 8 + name_length
+
+        self._header_end = position
+        return references
+
+    def read_names(self, references):
+        """
+        :param references: list of reference sequence names
+        :return: dictionary of reference name: list of names of all reads aligned to the reference, in file order
+        """
+        reference_ids = {name: reference_id for reference_id, name in enumerate(self.references)}
+        wanted = {reference_ids[name] for name in references}
+        read_names = {reference_id: [] for reference_id in wanted}
+
+        with open(self.path, 'rb') as file:
+            if self.index is None:
+                self._scan(file, wanted, read_names)
+            else:
+                for reference_id in sorted(wanted):
+                    for start, end in self.index[reference_id]:
+                        self._fetch(file, start, end, {reference_id}, read_names)
+
+        return {name: read_names[reference_ids[name]] for name in references}
+
+    @staticmethod
+    def _fetch(file, start, end, wanted, read_names):
+        """Parse the records between two virtual offsets"""
+        block_start, block_end = start >> 16, end >> 16
+        data = bytearray()
+        for _, block in read_blocks(file, block_start, block_end):
+            data.extend(block)
+
+        data_end = len(data) + (end & 0xffff)
+        if end & 0xffff:
+            data.extend(read_block(file, block_end)[1])
+
+        _parse_read_names(data, start & 0xffff, data_end, wanted, read_names)
+
+    def _scan(self, file, wanted, read_names):
+        """Parse every record in the BAM file"""
+        data = bytearray()
+        position = self._header_end
+        for _, block in read_blocks(file, 0):
+            data.extend(block)
+            position = _parse_read_names(data, position, len(data), wanted, read_names)
+            if position > len(block):  # drop records already parsed
+                del data[:position]
+                position = 0
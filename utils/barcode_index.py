@@ -0,0 +1,145 @@
+"""
+Compact binary barcode index. Each read ID is stored as a 64-bit hash in a sorted table next to the integer ID of its
+barcode, plus a palette of the colour assigned to each barcode. The file is memory-mapped so reads can be resolved by
+binary search without loading the whole index.
+
+File layout (little-endian):
+    magic            8 bytes   b'NLRBIDX1'
+    n_reads          uint64
+    n_barcodes       uint64
+    read_hashes      uint64[n_reads]     sorted
+    barcode_ids      int32[n_reads]      position of the barcode in the whitelist, -1 if the read has no barcode
+    palette          uint32[n_barcodes]  colour of each barcode packed as 0xRRGGBB
+"""
+import csv
+import hashlib
+
+import numpy as np
+
+MAGIC = b'NLRBIDX1'
+HEADER_SIZE = len(MAGIC) + 16
+NO_BARCODE = -1
+
+
+def hash_read_id(read_id):
+    """
+    :param read_id: sequence ID of a read
+    :return: 64-bit hash of the read ID
+    """
+    return int.from_bytes(hashlib.blake2b(read_id.encode(), digest_size=8).digest(), 'little')
+
+
+def pack_colour(rgb):
+    """
+    :param rgb: colour as a 'r,g,b' string
+    :return: colour packed into an integer as 0xRRGGBB
+    """
+    red, green, blue = map(int, rgb.split(','))
+    return (red << 16) | (green << 8) | blue
+
+
+def unpack_colour(colour):
+    """
+    :param colour: colour packed into an integer as 0xRRGGBB
+    :return: colour as a 'r,g,b' string
+    """
+    colour = int(colour)
+    return f'{colour >> 16},{(colour >> 8) & 255},{colour & 255}'
+
+
+def is_binary_index(path):
+    """
+    :param path: path to an index file
+    :return: True if the file is a binary barcode index
+    """
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+class BarcodeIndex:
+    """
+    A sorted table of read ID hashes and barcode IDs used to look up the colour of the barcode of each read
+
+    Attributes
+    ----------
+    read_hashes: sorted array of 64-bit read ID hashes
+    barcode_ids: array of the barcode ID of each read, NO_BARCODE (-1) if the read has no barcode
+    palette: array of the colour of each barcode packed as 0xRRGGBB
+
+    Methods
+    -------
+    load(path)
+        loads an index file (binary or CSV), binary indexes are memory-mapped
+    write(path)
+        writes the index in the binary format
+    colours(read_ids)
+        returns the packed colour of each read, reads without a barcode are black (0)
+    """
+
+    def __init__(self, read_hashes, barcode_ids, palette):
+        self.read_hashes = read_hashes
+        self.barcode_ids = barcode_ids
+        self.palette = palette
+
+    @classmethod
+    def from_unsorted(cls, read_hashes, barcode_ids, palette):
+        order = np.argsort(read_hashes, kind='stable')
+        return cls(read_hashes[order], barcode_ids[order], palette)
+
+    @classmethod
+    def load(cls, path):
+        if is_binary_index(path):
+            return cls.load_binary(path)
+        return cls.load_csv(path)
+
+    @classmethod
+    def load_binary(cls, path):
+        header = np.fromfile(path, dtype='<u8', count=3)
+        n_reads, n_barcodes = int(header[1]), int(header[2])
+        read_hashes = np.memmap(path, dtype='<u8', mode='r', offset=HEADER_SIZE, shape=(n_reads,))
+        barcode_ids = np.memmap(path, dtype='<i4', mode='r', offset=HEADER_SIZE + 8 * n_reads, shape=(n_reads,))
+        palette = np.memmap(path, dtype='<u4', mode='r', offset=HEADER_SIZE + 12 * n_reads, shape=(n_barcodes,))
+        return cls(read_hashes, barcode_ids, palette)
+
+    @classmethod
+    def load_csv(cls, path):
+        """Loads a barcode_index.csv file, each distinct colour in the file is treated as a barcode"""
+        read_hashes = []
+        barcode_ids = []
+        colour_ids = {}
+        with open(path) as file:
+            for read_id, rgb in csv.reader(file):
+                read_hashes.append(hash_read_id(read_id))
+                barcode_ids.append(colour_ids.setdefault(rgb, len(colour_ids)))
+
+        palette = np.array([pack_colour(rgb) for rgb in colour_ids], dtype=np.uint32)
+        return cls.from_unsorted(np.array(read_hashes, dtype=np.uint64), np.array(barcode_ids, dtype=np.int32),
+                                 palette)
+
+    def write(self, path):
+        with open(path, 'wb') as file:
+            file.write(MAGIC)
+            np.array([len(self.read_hashes), len(self.palette)], dtype='<u8').tofile(file)
+            np.asarray(self.read_hashes, dtype='<u8').tofile(file)
+            np.asarray(self.barcode_ids, dtype='<i4').tofile(file)
+            np.asarray(self.palette, dtype='<u4').tofile(file)
+
+    def colours(self, read_ids):
+        """
+        :param read_ids: list of read IDs
+        :return: array of the packed colour of each read
+        """
+        query = np.fromiter((hash_read_id(read_id) for read_id in read_ids), dtype=np.uint64, count=len(read_ids))
+        if len(query) and not len(self.read_hashes):
+            raise KeyError(read_ids[0])
+
+        positions = np.minimum(np.searchsorted(self.read_hashes, query), max(len(self.read_hashes) - 1, 0))
+        missing = np.flatnonzero(np.asarray(self.read_hashes[positions]) != query)
+        if len(missing):
+            raise KeyError(read_ids[missing[0]])
+
+        barcode_ids = np.asarray(self.barcode_ids[positions])
+        colours = np.zeros(len(query), dtype=np.uint32)
+        has_barcode = barcode_ids != NO_BARCODE
+        colours[has_barcode] = self.palette[barcode_ids[has_barcode]]
+        return colours
@@ -0,0 +1,165 @@
+"""
+Barcode correction for 10x Genomics linked-reads. The whitelist is encoded once per run as a sorted array of 2-bit
+encoded barcodes (a 16-mer fits in 32 bits) next to the position of each barcode in the whitelist. Barcodes extracted
+from reads are corrected in batches with binary searches of the sorted array, and the two arrays can be shared between
+processes without copying (see utils.shared).
+"""
+import itertools
+
+import numpy as np
+
+BARCODE_LENGTH = 16
+MAX_AMBIGUOUS_BASES = 2  # barcodes with more N's than this are too ambiguous to correct
+BASE_CODES = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+NO_MATCH = -1
+SUBSTITUTION_BATCH = 100000  # barcodes searched for substitutions at a time, 48 neighbours each
+
+AMBIGUOUS_CODE = 4
+INVALID_CODE = 5
+_BYTE_CODES = np.full(256, INVALID_CODE, dtype=np.uint8)
+for _base, _code in {**BASE_CODES, 'N': AMBIGUOUS_CODE}.items():
+    _BYTE_CODES[ord(_base)] = _code
+
+_SHIFTS = 2 * np.arange(BARCODE_LENGTH - 1, -1, -1, dtype=np.uint32)  # bit shift of each base, first base highest
+# xor with 1-3 at every shift gives each barcode a Hamming distance of 1 from a barcode
+_SUBSTITUTIONS = np.array([substitution << shift for shift in range(0, 2 * BARCODE_LENGTH, 2)
+                           for substitution in range(1, 4)], dtype=np.uint32)
+
+
+def encode_barcode(sequence):
+    """
+    Encodes a barcode as an integer using 2 bits per base (a 16-mer fits in 32 bits)
+
+    :param sequence: barcode sequence containing only A, C, G and T
+    :return: the 2-bit encoded barcode or None if the sequence contains any other character
+    """
+    code = 0
+    for base in sequence:
+        base_code = BASE_CODES.get(base)
+        if base_code is None:
+            return None
+        code = (code << 2) | base_code
+
+    return code
+
+
+def encode_barcodes(sequences):
+    """
+    Encodes barcodes of 16 bases as 2-bit integers, N's are encoded as A
+
+    :param sequences: list of barcode sequences
+    :return: positions of the sequences of 16 characters, their uint32 codes, number of N's and whether they contain
+    any character other than A, C, G, T and N
+    """
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    rows = np.flatnonzero(lengths == BARCODE_LENGTH)
+    text = ''.join(sequences[row] for row in rows).encode('ascii', errors='replace')
+    bases = _BYTE_CODES[np.frombuffer(text, dtype=np.uint8)].reshape(-1, BARCODE_LENGTH)
+
+    codes = (np.where(bases < AMBIGUOUS_CODE, bases, 0).astype(np.uint32) << _SHIFTS).sum(axis=1, dtype=np.uint32)
+    return rows, codes, (bases == AMBIGUOUS_CODE).sum(axis=1), (bases == INVALID_CODE).any(axis=1)
+
+
+class BarcodeCorrector:
+    """
+    A sorted array of the 2-bit encoding of every barcode in a whitelist, used to correct barcodes extracted from reads
+
+    Attributes
+    ----------
+    codes: sorted uint32 array of the distinct 2-bit encoded barcodes in the whitelist
+    barcode_ids: int32 array of the position in the whitelist of each code (the first position of duplicates)
+    barcodes: list of all barcodes in the whitelist, None if the corrector was built from the arrays alone
+
+    Methods
+    -------
+    from_whitelist(barcodes)
+        encodes a whitelist
+    correct_ids(raw_barcodes)
+        returns the whitelist position of the corrected barcode of each barcode extracted from a read
+    correct(raw_barcode)
+        returns the whitelist barcode for a barcode extracted from a read, correcting N's and single substitutions
+    correct_id(raw_barcode)
+        returns the position in the whitelist of the corrected barcode
+    """
+
+    def __init__(self, codes, barcode_ids, barcodes=None):
+        self.codes = codes
+        self.barcode_ids = barcode_ids
+        self.barcodes = barcodes
+
+    @classmethod
+    def from_whitelist(cls, barcodes):
+        rows, codes, ambiguous, invalid = encode_barcodes(barcodes)
+        valid = (ambiguous == 0) & ~invalid
+        codes, first = np.unique(codes[valid], return_index=True)
+        return cls(codes, rows[valid][first].astype(np.int32), barcodes)
+
+    def lookup(self, codes):
+        """
+        :param codes: array of 2-bit encoded barcodes
+        :return: array of the whitelist position of each code, NO_MATCH (-1) if the code is not in the whitelist
+        """
+        if not len(self.codes):
+            return np.full(codes.shape, NO_MATCH, dtype=np.int32)
+        positions = np.minimum(np.searchsorted(self.codes, codes), len(self.codes) - 1)
+        return np.where(self.codes[positions] == codes, self.barcode_ids[positions], NO_MATCH).astype(np.int32)
+
+    def correct_ids(self, raw_barcodes):
+        """
+        Corrects barcodes extracted from reads if they contain a sequencing error. Ambiguous bases (N) are replaced by
+        the first barcode in the whitelist that matches, a single substitution is only corrected if exactly one
+        barcode in the whitelist is a Hamming distance of 1 from the raw barcode.
+
+        :param raw_barcodes: list of 16 character strings (barcodes) extracted from raw fastq reads
+        :return: int32 array of the whitelist position of each corrected barcode, NO_MATCH (-1) if a barcode cannot be
+        corrected
+        """
+        corrected = np.full(len(raw_barcodes), NO_MATCH, dtype=np.int32)
+        rows, codes, ambiguous, invalid = encode_barcodes(raw_barcodes)
+
+        exact = (ambiguous == 0) & ~invalid
+        matches = self.lookup(codes[exact])
+        corrected[rows[exact]] = matches
+        self._fix_substitutions(corrected, rows[exact][matches == NO_MATCH], codes[exact][matches == NO_MATCH])
+
+        for n_ambiguous in range(1, MAX_AMBIGUOUS_BASES + 1):
+            selected = (ambiguous == n_ambiguous) & ~invalid
+            if selected.any():
+                corrected[rows[selected]] = self._fill_ambiguous(raw_barcodes, rows[selected], codes[selected],
+                                                                 n_ambiguous)
+        return corrected
+
+    def _fill_ambiguous(self, raw_barcodes, rows, codes, n_ambiguous):
+        """Lowest whitelist position of all barcodes matching each barcode with n_ambiguous N's"""
+        positions = np.array([[position for position, base in enumerate(raw_barcodes[row]) if base == 'N']
+                              for row in rows], dtype=np.uint32)
+        fills = np.array(list(itertools.product(range(4), repeat=n_ambiguous)), dtype=np.uint32)
+        candidates = codes[:, None] | (fills[None, :, :] << _SHIFTS[positions][:, None, :]).sum(axis=2,
+                                                                                               dtype=np.uint32)
+        matches = self.lookup(candidates)
+        best = np.where(matches == NO_MATCH, np.iinfo(np.int32).max, matches).min(axis=1)
+        return np.where(best == np.iinfo(np.int32).max, NO_MATCH, best)
+
+    def _fix_substitutions(self, corrected, rows, codes):
+        """Whitelist position of the only barcode a Hamming distance of 1 from each code, if there is exactly one"""
+        for start in range(0, len(codes), SUBSTITUTION_BATCH):
+            matches = self.lookup(codes[start:start + SUBSTITUTION_BATCH, None] ^ _SUBSTITUTIONS[None, :])
+            found = matches != NO_MATCH
+            unique = found.sum(axis=1) == 1
+            corrected[rows[start:start + SUBSTITUTION_BATCH][unique]] = matches[unique].max(axis=1)
+
+    def correct(self, raw_barcode):
+        """
+        :param raw_barcode: 16 character string (barcode) extracted from a raw fastq read
+        :return: If the barcode cannot be corrected None otherwise the corrected barcode is returned
+        """
+        barcode_id = self.correct_id(raw_barcode)
+        return None if barcode_id is None else self.barcodes[barcode_id]
+
+    def correct_id(self, raw_barcode):
+        """
+        :param raw_barcode: 16 character string (barcode) extracted from a raw fastq read
+        :return: If the barcode cannot be corrected None otherwise the whitelist position of the corrected barcode
+        """
+        barcode_id = int(self.correct_ids([raw_barcode])[0])
+        return None if barcode_id == NO_MATCH else barcode_id
@@ -0,0 +1,106 @@
+"""
+Reading of gzip and BGZF (blocked gzip, as written by bgzip and samtools) files. A BGZF file is a series of independent
+gzip blocks of at most 64 KB, so any block can be found and decompressed without reading the blocks before it.
+"""
+import struct
+import zlib
+
+GZIP_MAGIC = b'\x1f\x8b'
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+BGZF_HEADER_SIZE = 18
+BGZF_MAX_BLOCK_SIZE = 65536
+
+
+def compression(path):
+    """
+    :param path: path to a file
+    :return: 'bgzf', 'gzip' or None if the file is not compressed
+    """
+    with open(path, 'rb') as file:
+        header = file.read(BGZF_HEADER_SIZE)
+
+    if _is_bgzf_header(header):
+        return 'bgzf'
+    elif header.startswith(GZIP_MAGIC):
+        return 'gzip'
+    return None
+
+
+def _is_bgzf_header(header):
+    """True if header is the start of a BGZF block (gzip header with a single BC extra subfield)"""
+    return len(header) >= BGZF_HEADER_SIZE and header.startswith(BGZF_MAGIC) and header[10:16] == b'\x06\x00BC\x02\x00'
+
+
+def read_block(file, offset=None):
+    """
+    Reads and decompresses a single BGZF block
+
+    :param file: BGZF file opened in binary mode
+    :param offset: compressed offset of the block, the current file position is used if None
+    :return: (compressed size of the block, decompressed data), compressed size is 0 at the end of the file
+    """
+    if offset is not None:
+        file.seek(offset)
+
+    header = file.read(BGZF_HEADER_SIZE)
+    if not header:
+        return 0, b''
+    if not _is_bgzf_header(header):
+        raise ValueError(f'{file.name} is not a valid BGZF file')
+
+    block_size = struct.unpack('<H', header[16:18])[0] + 1
+    compressed_data = file.read(block_size - BGZF_HEADER_SIZE)
+    return block_size, zlib.decompress(compressed_data[:-8], -15)
+
+
+def next_block_offset(file, position, file_size):
+    """
+    Finds the first BGZF block starting at or after a position in the file. A candidate block is only accepted if the
+    block after it also starts with a valid header (or the candidate is the last block of the file).
+
+    :param file: BGZF file opened in binary mode
+    :param position: compressed offset to search from
+    :param file_size: size of the file in bytes
+    :return: compressed offset of the block, file_size if there are no more blocks
+    """
+    while position < file_size:
+        file.seek(position)
+        window = file.read(2 * BGZF_MAX_BLOCK_SIZE)
+        candidate = window.find(BGZF_MAGIC)
+        if candidate == -1:
+            position += max(len(window) - len(BGZF_MAGIC), 1)
+            continue
+
+        header = window[candidate:candidate + BGZF_HEADER_SIZE]
+        if len(header) < BGZF_HEADER_SIZE:
+            file.seek(position + candidate)
+            header = file.read(BGZF_HEADER_SIZE)
+
+        if _is_bgzf_header(header):
+            following = position + candidate + struct.unpack('<H', header[16:18])[0] + 1
+            file.seek(following)
+            if following == file_size or _is_bgzf_header(file.read(BGZF_HEADER_SIZE)):
+                return position + candidate
+
+        position += candidate + 1
+
+    return file_size
+
+
+def read_blocks(file, start, end=None):
+    """
+    Decompresses consecutive BGZF blocks
+
+    :param file: BGZF file opened in binary mode
+    :param start: compressed offset of the first block
+    :param end: compressed offset to stop at, blocks are read to the end of the file if None
+    :return: generator of (compressed offset, decompressed data) for each block
+    """
+    offset = start
+    file.seek(offset)
+    while end is None or offset < end:
+        block_size, data = read_block(file)
+        if block_size == 0:
+            break
+        yield offset, data
+        offset += block_size
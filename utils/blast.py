@@ -0,0 +1,250 @@
+"""
+Typed loading of BLAST tabular output (outfmt 6, optionally with extra columns such as qlen). Columns keep their
+position as label, query and subject IDs are categorical and numeric columns use compact dtypes. Tables can be streamed
+in chunks with filters applied as each chunk is read, and an optional binary columnar cache next to the table lets
+repeat reads memory-map the columns instead of parsing the text again.
+"""
+import json
+import logging
+import operator
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from utils.cache import decode_strings, encode_strings
+
+# qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore, any further column (e.g. qlen)
+# is read as an integer
+BLAST_DTYPES = {0: 'category', 1: 'category', 2: np.float32, 3: np.int32, 4: np.int32, 5: np.int32, 6: np.int32,
+                7: np.int32, 8: np.int32, 9: np.int32, 10: np.float64, 11: np.float32}
+EXTRA_DTYPE = np.int64
+CHUNK_SIZE = 1000000
+CACHE_VERSION = 1
+
+OPERATORS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt,
+             '>=': operator.ge}
+
+
+def count_columns(path):
+    """
+    :param path: BLAST tabular file
+    :return: number of columns in the first line, 0 if the file is empty
+    """
+    with open(path) as file:
+        line = file.readline()
+    return len(line.rstrip('\n').split('\t')) if line.strip() else 0
+
+
+def column_dtypes(n_columns):
+    """
+    :param n_columns: number of columns in the table
+    :return: dictionary of column: dtype
+    """
+    return {column: BLAST_DTYPES.get(column, EXTRA_DTYPE) for column in range(n_columns)}
+
+
+def apply_filters(table, filters):
+    """
+    :param table: DataFrame of BLAST hits
+    :param filters: list of (column, operator, value) tuples, e.g. [(2, '>=', 80)], all of which must be true
+    :return: boolean array, True for rows that pass every filter
+    """
+    mask = np.ones(len(table), dtype=bool)
+    for column, op, value in filters or []:
+        mask &= np.asarray(OPERATORS[op](table[column], value), dtype=bool)
+    return mask
+
+
+def concat_tables(tables, columns):
+    """Concatenates chunks of a table, merging the categories of categorical columns"""
+    if not tables:
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in columns.items()})
+    if len(tables) == 1:
+        return tables[0].reset_index(drop=True)
+
+    data = {}
+    for column, dtype in columns.items():
+        if dtype == 'category':
+            data[column] = union_categoricals([table[column] for table in tables])
+        else:
+            data[column] = np.concatenate([table[column].to_numpy() for table in tables])
+    return pd.DataFrame(data)
+
+
+def iter_blast_chunks(path, columns=None, filters=None, chunksize=CHUNK_SIZE):
+    """
+    Streams a BLAST table in chunks, applying the filters to each chunk as it is read
+
+    :param path: BLAST tabular file
+    :param columns: list of the columns to keep, all columns if None
+    :param filters: list of (column, operator, value) tuples, the filtered columns do not need to be kept
+    :param chunksize: number of rows parsed at a time
+    :return: generator of filtered DataFrames
+    """
+    n_columns = count_columns(path)
+    if n_columns == 0:
+        return
+
+    columns = list(range(n_columns)) if columns is None else list(columns)
+    read_columns = sorted(set(columns) | {column for column, _, _ in filters or []})
+    dtypes = column_dtypes(n_columns)
+    # categorical columns are parsed as strings and converted after filtering, which is faster than parsing them as
+    # categories directly
+    read_dtypes = {column: object if dtypes[column] == 'category' else dtypes[column] for column in read_columns}
+    for chunk in pd.read_csv(path, sep='\t', header=None, usecols=read_columns, dtype=read_dtypes,
+                             chunksize=chunksize):
+        chunk = chunk[apply_filters(chunk, filters)] if filters else chunk
+        yield pd.DataFrame({column: chunk[column].astype('category') if dtypes[column] == 'category' else
+                            chunk[column].to_numpy() for column in columns})
+
+
+def load_blast(path, columns=None, filters=None, chunksize=CHUNK_SIZE, cache=False):
+    """
+    Loads a BLAST table with compact dtypes, applying filters while the table is read
+
+    :param path: BLAST tabular file
+    :param columns: list of the columns to keep, all columns if None
+    :param filters: list of (column, operator, value) tuples, e.g. [(2, '>=', 80), (3, '>=', 80)]
+    :param chunksize: number of rows parsed at a time
+    :param cache: if True, read the table from (or first write it to) a binary columnar cache next to the table
+    :return: DataFrame of the hits passing the filters, labelled by column position
+    """
+    if cache:
+        columnar = ColumnarCache(path)
+        if columnar.is_valid() or columnar.build(chunksize):
+            return columnar.load(columns, filters)
+
+    n_columns = count_columns(path)
+    dtypes = column_dtypes(n_columns)
+    columns = list(range(n_columns)) if columns is None else list(columns)
+    return concat_tables(list(iter_blast_chunks(path, columns, filters, chunksize)),
+                         {column: dtypes[column] for column in columns})
+
+
+def numeric_names(names):
+    """
+    Converts IDs to integers if they are all integers, the type pandas infers when a column is read without dtypes
+
+    :param names: array of IDs as strings
+    :return: array of int64 IDs, or the IDs as an object array of strings
+    """
+    names = np.asarray(names, dtype=object)
+    try:
+        return np.array([int(name) for name in names], dtype=np.int64)
+    except (ValueError, OverflowError):
+        return names
+
+
+class ColumnarCache:
+    """
+    Binary columnar copy of a BLAST table stored in the directory {path}.columns, one .npy file per column. Categorical
+    columns are stored as int32 codes and a list of categories. The cache is only used while the size and modification
+    time of the table are unchanged.
+
+    Attributes
+    ----------
+    path: BLAST tabular file
+    directory: directory of the cache
+
+    Methods
+    -------
+    is_valid()
+        returns True if the cache exists and matches the table
+    build(chunksize)
+        parses the table and writes the cache, returns False if the cache can not be written
+    load(columns, filters)
+        returns a DataFrame of the cached columns and rows passing the filters
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.directory = f'{path}.columns'
+
+    def _source(self):
+        status = os.stat(self.path)
+        return {'size': status.st_size, 'mtime_ns': status.st_mtime_ns}
+
+    def _metadata(self):
+        try:
+            with open(os.path.join(self.directory, 'metadata.json')) as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def is_valid(self):
+        metadata = self._metadata()
+        return metadata is not None and metadata['version'] == CACHE_VERSION and metadata['source'] == self._source()
+
+    def build(self, chunksize=CHUNK_SIZE):
+        """
+        :param chunksize: number of rows parsed at a time
+        :return: True if the cache was written
+        """
+        source = self._source()
+        n_columns = count_columns(self.path)
+        dtypes = column_dtypes(n_columns)
+        table = concat_tables(list(iter_blast_chunks(self.path, chunksize=chunksize)), dtypes)
+
+        parent = os.path.dirname(os.path.abspath(self.directory))
+        try:
+            temp_directory = tempfile.mkdtemp(dir=parent, prefix='.blast_columns_')
+        except OSError:
+            logging.warning(f"could not write a columnar cache for {self.path}")
+            return False
+
+        try:
+            metadata = {'version': CACHE_VERSION, 'source': source, 'rows': len(table), 'columns': {}}
+            for column in range(n_columns):
+                values = table[column]
+                if dtypes[column] == 'category':
+                    categories = [str(category) for category in values.cat.categories]
+                    np.save(os.path.join(temp_directory, f'{column}.npy'), values.cat.codes.to_numpy(np.int32))
+                    np.save(os.path.join(temp_directory, f'{column}.categories.npy'), encode_strings(categories))
+                    metadata['columns'][str(column)] = {'categories': len(categories)}
+                else:
+                    np.save(os.path.join(temp_directory, f'{column}.npy'), values.to_numpy())
+                    metadata['columns'][str(column)] = {}
+
+            with open(os.path.join(temp_directory, 'metadata.json'), 'w') as file:
+                json.dump(metadata, file)
+
+            if os.path.exists(self.directory):
+                shutil.rmtree(self.directory)
+            os.rename(temp_directory, self.directory)
+        except OSError:
+            shutil.rmtree(temp_directory, ignore_errors=True)
+            logging.warning(f"could not write a columnar cache for {self.path}")
+            return False
+
+        return True
+
+    def _column(self, column, metadata, rows=None):
+        values = np.load(os.path.join(self.directory, f'{column}.npy'), mmap_mode='r')
+        values = np.asarray(values if rows is None else values[rows])
+        n_categories = metadata['columns'][str(column)].get('categories')
+        if n_categories is None:
+            return values
+
+        categories = decode_strings(np.load(os.path.join(self.directory, f'{column}.categories.npy')), n_categories)
+        return pd.Categorical.from_codes(values, categories=categories)
+
+    def load(self, columns=None, filters=None):
+        """
+        :param columns: list of the columns to keep, all columns if None
+        :param filters: list of (column, operator, value) tuples, only the filtered columns are read in full
+        :return: DataFrame of the hits passing the filters
+        """
+        metadata = self._metadata()
+        columns = [int(column) for column in metadata['columns']] if columns is None else list(columns)
+
+        rows = None
+        if filters:
+            filter_columns = sorted({column for column, _, _ in filters})
+            filter_table = pd.DataFrame({column: self._column(column, metadata) for column in filter_columns})
+            rows = np.flatnonzero(apply_filters(filter_table, filters))
+
+        return pd.DataFrame({column: self._column(column, metadata, rows) for column in columns})
@@ -0,0 +1,155 @@
+"""
+Content-addressed on-disk cache of intermediate results. Each result is stored as a .npz file named after a hash of the
+stage, the contents of the input files and the parameters used to generate it, so a result is reused whenever the same
+inputs are processed again and is never reused after an input changes. The least recently used results are removed
+once the cache grows beyond a size limit.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+HASH_BUFFER_SIZE = 1 << 20
+DIGEST_FILE = 'digests.json'
+
+
+def _write_atomic(path, write):
+    """Writes a file through a temporary file in the same directory, so other processes never read a partial file"""
+    file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as file:
+            write(file)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def encode_strings(strings):
+    """
+    :param strings: list of strings without newlines
+    :return: uint8 array of the newline-joined UTF-8 encoded strings
+    """
+    return np.frombuffer('\n'.join(strings).encode(), dtype=np.uint8)
+
+
+def decode_strings(array, count):
+    """
+    :param array: uint8 array generated by encode_strings()
+    :param count: number of strings encoded
+    :return: list of strings
+    """
+    return array.tobytes().decode().split('\n') if count else []
+
+
+class StageCache:
+    """
+    Cache of the arrays generated by each stage of a command
+
+    Attributes
+    ----------
+    directory: directory holding the cached results
+    max_size: size limit of the cache in bytes
+
+    Methods
+    -------
+    file_digest(path)
+        returns a hash of the contents of a file
+    key(stage, *parts)
+        returns the key of a result from the stage name and the digests and parameters it depends on
+    load(key)
+        returns a dictionary of the arrays stored under a key or None if there is no result
+    store(key, arrays)
+        stores a dictionary of arrays under a key and evicts the least recently used results
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _digests(self):
+        try:
+            with open(os.path.join(self.directory, DIGEST_FILE)) as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def file_digest(self, path):
+        """
+        Hashes the contents of a file. Digests are remembered by the path, size and modification time of the file so
+        an unchanged file is only read once.
+
+        :param path: path to a file
+        :return: hexadecimal BLAKE2b digest of the file
+        """
+        status = os.stat(path)
+        file_id = f'{os.path.abspath(path)}:{status.st_size}:{status.st_mtime_ns}'
+        digests = self._digests()
+        if file_id in digests:
+            return digests[file_id]
+
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as file:
+            for buffer in iter(lambda: file.read(HASH_BUFFER_SIZE), b''):
+                digest.update(buffer)
+
+        digests = self._digests()
+        digests[file_id] = digest.hexdigest()
+        _write_atomic(os.path.join(self.directory, DIGEST_FILE), lambda file: file.write(json.dumps(digests).encode()))
+        return digests[file_id]
+
+    @staticmethod
+    def key(stage, *parts):
+        """
+        :param stage: name of the stage
+        :param parts: file digests and parameters (JSON serialisable) the result depends on
+        :return: key of the result
+        """
+        return f"{stage}-{hashlib.blake2b(json.dumps(parts).encode(), digest_size=16).hexdigest()}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def load(self, key):
+        """
+        :param key: key generated by key()
+        :return: dictionary of array name: array or None if the result is not cached
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as arrays:
+                result = {name: arrays[name] for name in arrays.files}
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+
+        os.utime(path)  # mark as recently used
+        return result
+
+    def store(self, key, arrays):
+        """
+        :param key: key generated by key()
+        :param arrays: dictionary of array name: array
+        """
+        _write_atomic(self._path(key), lambda file: np.savez(file, **arrays))
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used results until the cache is within its size limit"""
+        results = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                status = entry.stat()
+                results.append((status.st_mtime_ns, status.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in results)
+        for _, size, path in sorted(results):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
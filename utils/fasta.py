@@ -0,0 +1,192 @@
+"""
+Random access to the sequences of a FASTA file through a .fai index, the format written by samtools faidx. The index
+records the length of each sequence and the offset and line layout of its first base, so sequences and lengths are read
+from a memory-mapped file without loading the rest of the file, and wrapped (multi-line) FASTA files are supported.
+"""
+import mmap
+import os
+from collections import namedtuple
+
+FaiRecord = namedtuple('FaiRecord', ['length', 'offset', 'line_bases', 'line_width'])
+FaiRecord.__doc__ = """
+Layout of a sequence in a FASTA file
+
+length: number of bases in the sequence
+offset: byte offset of the first base
+line_bases: number of bases on each line
+line_width: number of bytes on each line, including the line ending
+"""
+
+
+def build_fai(fasta):
+    """
+    Scans a FASTA file to index the layout of each sequence. Every line of a sequence except the last must be the same
+    length, as required by samtools faidx.
+
+    :param fasta: FASTA file
+    :return: dictionary of sequence name (header up to the first whitespace): FaiRecord, in file order
+    """
+    index = {}
+    name = None
+    length = offset = line_bases = line_width = 0
+    short_line = False  # a line shorter than line_bases was seen, any further line must be the end of the sequence
+
+    def add_record():
+        if name is not None:
+            index[name] = FaiRecord(length, offset, line_bases, line_width)
+
+    position = 0
+    with open(fasta, 'rb') as file:
+        for line_number, line in enumerate(file, 1):
+            if line.startswith(b'>'):
+                add_record()
+                name = line[1:].split()[0].decode() if line[1:].strip() else ''
+                if name in index:
+                    raise ValueError(f'{fasta} contains the sequence {name} more than once')
+                length = line_bases = line_width = 0
+                offset = position + len(line)
+                short_line = False
+
+            elif name is not None:
+                bases = len(line.rstrip(b'\r\n'))
+                ending = len(line) - bases
+                if bases:
+                    if short_line or (line_bases and (bases > line_bases or
+                                                      (ending and ending != line_width - line_bases))):
+                        raise ValueError(f'{fasta} has lines of different lengths in sequence {name} '
+                                         f'(line {line_number}), it can not be indexed')
+                    if not line_bases:
+                        line_bases, line_width = bases, max(len(line), bases + 1)  # as samtools for a final line
+                    short_line = bases < line_bases or not line.endswith(b'\n')
+                    length += bases
+                elif length:
+                    short_line = True  # blank lines are only allowed at the end of a sequence
+
+            position += len(line)
+
+    add_record()
+    return index
+
+
+def write_fai(index, path):
+    """
+    :param index: dictionary of sequence name: FaiRecord
+    :param path: path of the .fai file
+    """
+    with open(path, 'w') as file:
+        for name, record in index.items():
+            file.write(f'{name}\t{record.length}\t{record.offset}\t{record.line_bases}\t{record.line_width}\n')
+
+
+def load_fai(path):
+    """
+    :param path: path to a .fai file
+    :return: dictionary of sequence name: FaiRecord
+    """
+    index = {}
+    with open(path) as file:
+        for line in file:
+            name, *fields = line.rstrip('\n').split('\t')
+            index[name] = FaiRecord(*map(int, fields[:4]))
+    return index
+
+
+class FastaIndex:
+    """
+    Reads sequences from a FASTA file by random access. The .fai index next to the file is used if it is up to date,
+    otherwise the file is indexed and the index is saved for later runs (if the directory is writable).
+
+    Attributes
+    ----------
+    fasta: path to the FASTA file
+    index: dictionary of sequence name: FaiRecord
+
+    Methods
+    -------
+    length(name)
+        returns the number of bases in a sequence
+    fetch(name)
+        returns a sequence as a string
+    write_sequence(file, name)
+        writes a sequence to a file without line breaks
+    """
+
+    def __init__(self, fasta):
+        self.fasta = fasta
+        self.index = self._load_index()
+        self._file = open(fasta, 'rb')
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.index else b''
+
+    def _load_index(self):
+        fai = f'{self.fasta}.fai'
+        if os.path.exists(fai) and os.path.getmtime(fai) >= os.path.getmtime(self.fasta):
+            return load_fai(fai)
+
+        index = build_fai(self.fasta)
+        try:
+            write_fai(index, fai)
+        except OSError:
+            pass
+        return index
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def _record(self, name):
+        try:
+            return self.index[name]
+        except KeyError:
+            raise KeyError(f'{name} not found in {self.fasta}') from None
+
+    def length(self, name):
+        """
+        :param name: sequence name
+        :return: number of bases in the sequence
+        """
+        return self._record(name).length
+
+    def fetch_bytes(self, name):
+        """
+        :param name: sequence name
+        :return: the sequence as bytes without line breaks
+        """
+        record = self._record(name)
+        if record.length == 0:
+            return b''
+        full_lines, remainder = divmod(record.length, record.line_bases)
+        end = record.offset + full_lines * record.line_width + remainder
+        data = self._data[record.offset:end]
+        if record.line_width != record.line_bases:
+            data = data.replace(b'\n', b'').replace(b'\r', b'')
+        return data
+
+    def fetch(self, name):
+        """
+        :param name: sequence name
+        :return: the sequence as a string
+        """
+        return self.fetch_bytes(name).decode()
+
+    def write_sequence(self, file, name):
+        """
+        :param file: file opened in binary mode
+        :param name: sequence name
+        """
+        file.write(self.fetch_bytes(name))
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,313 @@
+"""
+Reading of fastq files in chunks that can be processed in parallel. Plain fastq files are memory-mapped and split into
+record-aligned byte ranges, BGZF compressed files (bgzip) are split into ranges of compressed blocks that each worker
+decompresses itself, and gzip compressed files are decompressed as a single stream and split into batches of records.
+"""
+import gzip
+import mmap
+import os
+
+from utils.bgzf import compression, next_block_offset, read_block, read_blocks
+
+RECORDS_SAMPLED = 1000  # number of records used to estimate the size of a record
+BGZF_DISCARD_SIZE = 1 << 24  # decompressed data kept in memory before records already read are discarded
+
+
+class FastqChunk:
+    """
+    A part of a fastq file processed by one worker
+
+    Attributes
+    ----------
+    number: position of the chunk in the fastq file
+    fastq: path to the fastq file
+    start: offset of the first byte of the chunk (compressed offset of the first block for BGZF files)
+    end: offset of the first byte after the chunk (compressed offset of the first block after the chunk for BGZF files)
+    compression: None, 'bgzf' or 'gzip'
+    records: list of (sequence id, sequence) tuples for gzip files, which can not be read from an offset
+
+    Methods
+    -------
+    __iter__()
+        returns a generator of (sequence id, sequence) tuples for every record in the chunk
+    """
+
+    def __init__(self, number, fastq, start=0, end=0, compression=None, records=None):
+        self.number = number
+        self.fastq = fastq
+        self.start = start
+        self.end = end
+        self.compression = compression
+        self.records = records
+
+    @property
+    def name(self):
+        if self.records is not None:
+            return f'{self.fastq}:batch_{self.number}'
+        return f'{self.fastq}:{self.start}-{self.end}'
+
+    def __iter__(self):
+        if self.records is not None:
+            return iter(self.records)
+        elif self.compression == 'bgzf':
+            return read_bgzf_range(self.fastq, self.start, self.end)
+        return read_fastq_range(self.fastq, self.start, self.end)
+
+
+def iter_fastq_chunks(fastq, batch_size):
+    """
+    Splits a fastq file (plain, BGZF or gzip compressed) into chunks of approximately batch_size records
+
+    :param fastq: fastq file
+    :param batch_size: approximate number of sequences per chunk
+    :return: generator of FastqChunk, gzip files are decompressed as the generator is consumed
+    """
+    file_compression = compression(fastq)
+    if file_compression == 'bgzf':
+        yield from partition_bgzf_fastq(fastq, batch_size)
+    elif file_compression == 'gzip':
+        yield from batch_gzip_fastq(fastq, batch_size)
+    else:
+        yield from partition_fastq(fastq, batch_size)
+
+
+def _parse_header(header):
+    """Sequence ID of a fastq header line"""
+    return header.split()[0][1:].decode()
+
+
+# partitions a fastq file into record-aligned byte ranges of a given batch size
+def partition_fastq(fastq, batch_size):
+    """
+    Memory-maps a fastq file and splits it into byte ranges that each start on a record header, so that every worker
+    can read its own part of the file directly without intermediate files being written.
+
+    :param fastq: fastq file
+    :param batch_size: approximate number of sequences per byte range (used as a hint to size each range)
+    :return: a list of FastqChunk, use to generate pool for multiprocessing
+    """
+
+    def record_start(data, position):
+        """Find the offset of the first record header at or after position"""
+        if position == 0:
+            return 0
+
+        search_position = position - 1
+        while True:
+            header = data.find(b'\n@', search_position)
+            if header == -1:
+                return len(data)
+
+            # A quality line can also begin with '@', only accept the line if the line after next is a separator (+)
+            sequence_end = data.find(b'\n', header + 1)
+            separator_end = data.find(b'\n', sequence_end + 1) if sequence_end != -1 else -1
+            if separator_end == -1 or data[separator_end + 1:separator_end + 2] == b'+':
+                return header + 1
+
+            search_position = header + 1
+
+    with open(fastq, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return []
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # Estimate the size of a record from the first 1000 records to convert the batch size to bytes
+            sample_end = 0
+            for _ in range(4 * RECORDS_SAMPLED):
+                sample_end = data.find(b'\n', sample_end) + 1
+                if sample_end == 0:
+                    return [FastqChunk(0, fastq, 0, len(data))]  # fewer than 1000 records, use a single range
+            chunk_size = max(int(sample_end / RECORDS_SAMPLED * batch_size), 1)
+
+            chunks = []
+            start = 0
+            while start < len(data):
+                end = record_start(data, start + chunk_size)
+                chunks.append(FastqChunk(len(chunks), fastq, start, end))
+                start = end
+
+    return chunks
+
+
+def read_fastq_range(fastq, start, end):
+    """
+    Reads the records of a fastq file that start between two byte offsets
+
+    :param fastq: fastq file
+    :param start: offset of the first record header in the range
+    :param end: offset where the range finishes (the header of the next range)
+    :return: generator of (sequence id, sequence) tuples for every record in the range
+    """
+    with open(fastq, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        data.seek(start)
+        while data.tell() < end:
+            header = data.readline()
+            sequence = data.readline()
+            data.readline()  # separator
+            data.readline()  # quality
+            if not header.startswith(b'@'):
+                continue
+            yield _parse_header(header), sequence.rstrip().decode()
+
+
+def partition_bgzf_fastq(fastq, batch_size):
+    """
+    Splits a BGZF compressed fastq file into ranges of whole blocks. Only the block headers at the boundaries are read,
+    each worker decompresses the blocks of its own range.
+
+    :param fastq: BGZF compressed fastq file
+    :param batch_size: approximate number of sequences per range (used as a hint to size each range)
+    :return: a list of FastqChunk, use to generate pool for multiprocessing
+    """
+    with open(fastq, 'rb') as file:
+        file_size = os.fstat(file.fileno()).st_size
+
+        # Estimate the compressed size of a record from the first block to convert the batch size to bytes
+        block_size, data = read_block(file, 0)
+        block_records = data.count(b'\n') / 4
+        if block_records == 0:
+            return [FastqChunk(0, fastq, 0, file_size, compression='bgzf')]
+        chunk_size = max(int(block_size / block_records * batch_size), 1)
+
+        chunks = []
+        start = 0
+        while start < file_size:
+            end = next_block_offset(file, start + chunk_size, file_size)
+            chunks.append(FastqChunk(len(chunks), fastq, start, end, compression='bgzf'))
+            start = end
+
+    return chunks
+
+
+class _BgzfStream:
+    """
+    Decompressed data of the BGZF blocks from a compressed offset to the end of the file, addressed by offsets from the
+    first block. Blocks are only decompressed as data is requested and data that has been read can be discarded to keep
+    memory use low. Data decompressed from blocks before the end offset is owned by the stream.
+    """
+
+    def __init__(self, file, start, end):
+        self.blocks = read_blocks(file, start)
+        self.end = end
+        self.buffer = bytearray()
+        self.base = 0  # offset of buffer[0]
+        self.owned_length = 0
+        self.owned_complete = False
+
+    @property
+    def length(self):
+        return self.base + len(self.buffer)
+
+    def extend(self):
+        """Decompress the next block, False if there are no blocks left"""
+        for offset, data in self.blocks:
+            self.buffer.extend(data)
+            if offset < self.end:
+                self.owned_length = self.length
+            else:
+                self.owned_complete = True
+            return True
+
+        self.owned_complete = True
+        return False
+
+    def owns(self, position):
+        """True if the byte at position was decompressed from a block before the end offset"""
+        while not self.owned_complete and position >= self.owned_length:
+            self.extend()
+        return position < self.owned_length
+
+    def find(self, sub, position):
+        """Offset of the next occurrence of sub at or after position, decompressing blocks as needed, -1 if not found"""
+        while True:
+            found = self.buffer.find(sub, max(position - self.base, 0))
+            if found != -1:
+                return found + self.base
+            if not self.extend():
+                return -1
+
+    def line_end(self, position):
+        """Offset after the end of the line starting at position"""
+        newline = self.find(b'\n', position)
+        return self.length if newline == -1 else newline + 1
+
+    def get(self, start, end):
+        while self.length < end and self.extend():
+            pass
+        return bytes(self.buffer[start - self.base:end - self.base])
+
+    def discard(self, position):
+        del self.buffer[:position - self.base]
+        self.base = position
+
+
+def read_bgzf_range(fastq, start, end):
+    """
+    Reads the records of a BGZF compressed fastq file owned by a range of blocks. A record belongs to the range if the
+    newline before its header is in one of the blocks of the range (or the record is the first in the file), the
+    blocks after the range are only decompressed to finish the last record.
+
+    :param fastq: BGZF compressed fastq file
+    :param start: compressed offset of the first block in the range
+    :param end: compressed offset of the first block after the range
+    :return: generator of (sequence id, sequence) tuples for every record in the range
+    """
+    with open(fastq, 'rb') as file:
+        stream = _BgzfStream(file, start, end)
+
+        # Find the first record header, a quality line can also begin with '@' so only accept a line if the line after
+        # next is a separator (+)
+        position = 0
+        if start > 0:
+            newline = stream.find(b'\n@', 0)
+            while newline != -1 and stream.owns(newline):
+                separator = stream.line_end(stream.line_end(newline + 1))
+                if stream.get(separator, separator + 1) in (b'+', b''):
+                    break
+                newline = stream.find(b'\n@', newline + 1)
+            else:
+                return
+            position = newline + 1
+
+        while (position == 0 or stream.owns(position - 1)) and stream.get(position, position + 1) == b'@':
+            sequence_start = stream.line_end(position)
+            separator_start = stream.line_end(sequence_start)
+            quality_start = stream.line_end(separator_start)
+            record_end = stream.line_end(quality_start)
+            yield _parse_header(stream.get(position, sequence_start)), \
+                stream.get(sequence_start, separator_start).rstrip().decode()
+
+            position = record_end
+            if position - stream.base > BGZF_DISCARD_SIZE:
+                stream.discard(position)
+
+
+def batch_gzip_fastq(fastq, batch_size):
+    """
+    Decompresses a gzip compressed fastq file as a single stream and splits it into batches of records. Unlike BGZF
+    files, a gzip stream can only be decompressed from the start of the file so decompression runs in the main process.
+
+    :param fastq: gzip compressed fastq file
+    :param batch_size: number of sequences per batch
+    :return: generator of FastqChunk holding the records of each batch
+    """
+    with gzip.open(fastq, 'rb') as file:
+        records = []
+        number = 0
+        while True:
+            header = file.readline()
+            sequence = file.readline()
+            file.readline()  # separator
+            file.readline()  # quality
+            if not header:
+                break
+            if header.startswith(b'@'):
+                records.append((_parse_header(header), sequence.rstrip().decode()))
+
+            if len(records) == batch_size:
+                yield FastqChunk(number, fastq, compression='gzip', records=records)
+                records = []
+                number += 1
+
+        if records:
+            yield FastqChunk(number, fastq, compression='gzip', records=records)
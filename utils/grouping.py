@@ -0,0 +1,172 @@
+"""
+Grouping of contigs by the similarity of their barcode profiles. Each contig is linked to its nearest neighbours that
+pass a similarity threshold and the groups are the connected components of these links, found with a disjoint-set
+(union-find) structure in near-linear time.
+"""
+import numpy as np
+
+
+class DisjointSet:
+    """
+    Disjoint-set forest over the integers 0 to size - 1 with union by size and path halving
+
+    Methods
+    -------
+    find(item)
+        returns the representative of the set holding item
+    union(a, b)
+        merges the sets holding a and b
+    """
+
+    def __init__(self, size):
+        self.parent = list(range(size))
+        self.size = [1] * size
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+
+def neighbour_groups(neighbour_table, cutoff=0.5, window=0.1):
+    """
+    Selects the group of neighbours of each contig. If the similarity of the second nearest neighbour (the nearest
+    neighbour other than the contig itself) is below the cutoff the group is only the nearest neighbour, otherwise the
+    group is every neighbour with a similarity within the window of the second nearest neighbour.
+
+    :param neighbour_table: NeighbourTable of the most similar contigs to each contig
+    :param cutoff: minimum similarity of the second nearest neighbour to group a contig
+    :param window: similarity below the second nearest neighbour for other neighbours to be included in the group
+    :return: N x k boolean array, True where a neighbour is in the group of the contig
+    """
+    similarities = neighbour_table.similarities
+    members = np.zeros(similarities.shape, dtype=bool)
+    if similarities.size == 0:
+        return members
+
+    members[:, 0] = True
+    if similarities.shape[1] > 1:
+        threshold = similarities[:, 1]
+        grouped = threshold >= cutoff
+        members[grouped] = similarities[grouped] > (threshold[grouped] - window)[:, None]
+
+    return members
+
+
+def _link_rows(neighbour_table, members, rows, labels):
+    """
+    Labels the connected components of the links of the given rows with the lowest contig in each component, the labels
+    of contigs that are not linked by these rows are kept
+    """
+    indices = neighbour_table.indices[rows]
+    members = members[rows]
+
+    forest = DisjointSet(len(labels))
+    link_rows, columns = np.nonzero(members[:, 1:])
+    for a, b in zip(indices[link_rows, 0].tolist(), indices[link_rows, columns + 1].tolist()):
+        forest.union(a, b)
+
+    linked = np.unique(indices[members])
+    roots = np.array([forest.find(contig) for contig in linked.tolist()], dtype=np.int64)
+    _, lowest, component = np.unique(roots, return_index=True, return_inverse=True)
+    labels[linked] = linked[lowest][component]  # linked is sorted, so the first contig of each root is the lowest
+    return labels
+
+
+def component_labels(neighbour_table, cutoff=0.5, window=0.1):
+    """
+    Finds the connected components of the links between each contig's nearest neighbour and the other members of its
+    neighbour group (see neighbour_groups)
+
+    :param neighbour_table: NeighbourTable of the most similar contigs to each contig
+    :param cutoff: minimum similarity of the second nearest neighbour to group a contig
+    :param window: similarity below the second nearest neighbour for other neighbours to be included in the group
+    :return: array of the component of each contig, labelled by its lowest row, -1 for contigs that are not a member of
+    any neighbour group
+    """
+    n_contigs = len(neighbour_table.contigs)
+    members = neighbour_groups(neighbour_table, cutoff, window)
+    return _link_rows(neighbour_table, members, np.arange(n_contigs), np.full(n_contigs, -1, dtype=np.int64))
+
+
+def update_component_labels(labels, previous_table, neighbour_table, rows, cutoff=0.5, window=0.1):
+    """
+    Updates the connected components after the neighbours of some contigs changed. Only the components linked to these
+    contigs before or after the change are recalculated, every other component keeps its label.
+
+    :param labels: component_labels() of previous_table
+    :param previous_table: NeighbourTable the labels were found from
+    :param neighbour_table: updated NeighbourTable, any new contigs are appended after the contigs of previous_table
+    :param rows: array of the rows of neighbour_table whose neighbours may differ from previous_table
+    :param cutoff: minimum similarity of the second nearest neighbour to group a contig
+    :param window: similarity below the second nearest neighbour for other neighbours to be included in the group
+    :return: array of the component of each contig (see component_labels)
+    """
+    n_previous, n_contigs = len(labels), len(neighbour_table.contigs)
+    members = neighbour_groups(neighbour_table, cutoff, window)
+    previous_rows = rows[rows < n_previous]
+    previous_links = previous_table.indices[previous_rows][neighbour_groups(previous_table, cutoff, window)[
+        previous_rows]]
+    links = neighbour_table.indices[rows][members[rows]]
+
+    touched = labels[np.concatenate([previous_links, links[links < n_previous]])]
+    labels = np.concatenate([labels, np.full(n_contigs - n_previous, -1, dtype=np.int64)])
+    outdated = np.isin(labels, touched[touched >= 0])
+
+    # every link of an unchanged row is within the component of its nearest neighbour
+    relink = outdated[neighbour_table.indices[:, 0]] if n_contigs else np.zeros(0, dtype=bool)
+    relink[rows] = True
+    labels[outdated] = -1
+    return _link_rows(neighbour_table, members, np.flatnonzero(relink), labels)
+
+
+def labelled_groups(neighbour_table, labels):
+    """
+    :param neighbour_table: NeighbourTable of the most similar contigs to each contig
+    :param labels: component of each contig generated by component_labels()
+    :return: list of groups, each a sorted list of contigs. Groups are ordered by descending size and then by the first
+    contig to link to the group
+    """
+    if not len(labels):
+        return []
+
+    # order the components by the first row whose nearest neighbour is in the component
+    components, first_row = np.unique(labels[neighbour_table.indices[:, 0]], return_index=True)
+    component_order = components[np.argsort(first_row, kind='stable')]
+
+    grouped = np.flatnonzero(labels >= 0)
+    grouped = grouped[np.argsort(labels[grouped], kind='stable')]
+    boundaries = np.flatnonzero(np.diff(labels[grouped])) + 1
+    component_contigs = dict(zip(labels[grouped][np.r_[0, boundaries]].tolist(), np.split(grouped, boundaries)))
+
+    contigs = neighbour_table.contigs
+    groups = [sorted(contigs[contig] for contig in component_contigs[component].tolist())
+              for component in component_order.tolist()]
+    groups.sort(key=len, reverse=True)
+    return groups
+
+
+def connected_groups(neighbour_table, cutoff=0.5, window=0.1):
+    """
+    Groups contigs into the connected components of the links between each contig's nearest neighbour and the other
+    members of its neighbour group (see neighbour_groups). Only contigs that are a member of at least one neighbour group
+    are returned.
+
+    :param neighbour_table: NeighbourTable of the most similar contigs to each contig
+    :param cutoff: minimum similarity of the second nearest neighbour to group a contig
+    :param window: similarity below the second nearest neighbour for other neighbours to be included in the group
+    :return: list of groups, each a sorted list of contigs. Groups are ordered by descending size and then by the first
+    contig to link to the group
+    """
+    return labelled_groups(neighbour_table, component_labels(neighbour_table, cutoff, window))
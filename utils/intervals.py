@@ -0,0 +1,88 @@
+"""
+Vectorised coverage of sequences by intervals (e.g. BLAST hits). Each interval is converted to a half-open range of
+global coordinates, in which every sequence occupies its own block, so the intervals of all sequences can be merged or
+counted with a single sort instead of a Python loop over every base.
+"""
+import numpy as np
+
+
+def global_intervals(lengths, subjects, starts, ends):
+    """
+    Converts 1-based inclusive intervals on each sequence to half-open 0-based global coordinates. Intervals are clipped
+    to the ends of their sequence.
+
+    :param lengths: array of the length of each sequence
+    :param subjects: array of the sequence (index into lengths) of each interval
+    :param starts: array of the first base of each interval (1-based)
+    :param ends: array of the last base of each interval (1-based, inclusive)
+    :return: offsets: global coordinate of the first base of each sequence, global starts, global ends
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    subjects = np.asarray(subjects, dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    sequence_lengths = lengths[subjects]
+    interval_starts = np.clip(np.asarray(starts, dtype=np.int64) - 1, 0, sequence_lengths)
+    interval_ends = np.clip(np.asarray(ends, dtype=np.int64), interval_starts, sequence_lengths)
+    return offsets, offsets[subjects] + interval_starts, offsets[subjects] + interval_ends
+
+
+def covered_bases(lengths, subjects, starts, ends):
+    """
+    Number of bases of each sequence covered by at least one interval, calculated from the union of the intervals
+
+    :param lengths: array of the length of each sequence
+    :param subjects: array of the sequence (index into lengths) of each interval
+    :param starts: array of the first base of each interval (1-based)
+    :param ends: array of the last base of each interval (1-based, inclusive)
+    :return: array of the number of covered bases of each sequence
+    """
+    offsets, global_starts, global_ends = global_intervals(lengths, subjects, starts, ends)
+    if len(global_starts) == 0:
+        return np.zeros(len(lengths), dtype=np.int64)
+
+    order = np.argsort(global_starts, kind='stable')
+    global_starts, global_ends = global_starts[order], global_ends[order]
+
+    # an interval starts a new run of overlapping intervals if it starts after every earlier interval has ended,
+    # intervals that only touch are kept in separate runs so a run never spans two sequences
+    run_ends = np.maximum.accumulate(global_ends)
+    new_run = np.ones(len(global_starts), dtype=bool)
+    new_run[1:] = global_starts[1:] >= run_ends[:-1]
+    run_firsts = np.flatnonzero(new_run)
+    run_lengths = np.maximum.reduceat(global_ends, run_firsts) - global_starts[run_firsts]
+
+    run_sequences = np.searchsorted(offsets, global_starts[run_firsts], side='right') - 1
+    return np.bincount(run_sequences, weights=run_lengths, minlength=len(lengths)).astype(np.int64)
+
+
+def depth_runs(lengths, subjects, starts, ends):
+    """
+    Per-base depth of the intervals as runs of constant non-zero depth, calculated from the sorted interval boundaries
+    (a difference array over the boundaries only) so memory use depends on the number of intervals, not the length of
+    the sequences.
+
+    :param lengths: array of the length of each sequence
+    :param subjects: array of the sequence (index into lengths) of each interval
+    :param starts: array of the first base of each interval (1-based)
+    :param ends: array of the last base of each interval (1-based, inclusive)
+    :return: sequences, run starts (0-based), run ends (exclusive) and depths of each run, run coordinates are relative
+    to the start of the sequence
+    """
+    offsets, global_starts, global_ends = global_intervals(lengths, subjects, starts, ends)
+    boundaries = np.concatenate([global_starts, global_ends])
+    changes = np.concatenate([np.ones(len(global_starts), dtype=np.int32),
+                              np.full(len(global_ends), -1, dtype=np.int32)])
+
+    positions, inverse = np.unique(boundaries, return_inverse=True)
+    depths = np.cumsum(np.bincount(inverse, weights=changes, minlength=len(positions))).astype(np.uint32)
+
+    # each run lasts from one boundary to the next, keep the runs that are covered
+    covered = np.flatnonzero(depths[:-1] > 0)
+    run_starts, run_ends = positions[covered], positions[covered + 1]
+    run_depths = depths[covered]
+
+    # runs never cross a sequence boundary while covered, because every interval lies within a single sequence
+    run_sequences = np.searchsorted(offsets, run_starts, side='right') - 1
+    return run_sequences, run_starts - offsets[run_sequences], run_ends - offsets[run_sequences], run_depths
@@ -0,0 +1,73 @@
+"""
+MinHash sketches of the barcode sets of contigs and locality-sensitive hashing (LSH) of the sketches into bands, used
+to find the pairs of contigs likely to share barcodes without comparing every pair. Two sets with a Jaccard similarity
+J are candidates with probability 1 - (1 - J^rows)^bands.
+"""
+import numpy as np
+
+PRIME = (1 << 31) - 1  # Mersenne prime larger than any column, (a * column + b) fits in 64 bits
+HASH_BATCH = 16  # hash functions evaluated at a time
+ENTRY_BATCH = 1 << 18  # approximate number of set members hashed at a time
+BAND_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def minhash_signatures(profiles, n_hashes, seed=22):
+    """
+    :param profiles: N x M sparse matrix, the set of each row is the columns of its non-zero entries
+    :param n_hashes: number of hash functions
+    :param seed: seed of the random hash functions
+    :return: N x n_hashes uint64 array of the minimum hash of the set of each row, PRIME for empty rows
+    """
+    profiles = profiles.tocsr()
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(1, PRIME, size=n_hashes, dtype=np.uint64)
+    offsets = rng.integers(0, PRIME, size=n_hashes, dtype=np.uint64)
+
+    signatures = np.full((profiles.shape[0], n_hashes), PRIME, dtype=np.uint64)
+    filled = np.flatnonzero(np.diff(profiles.indptr))
+    if not len(filled):
+        return signatures
+
+    # rows are hashed in blocks of about ENTRY_BATCH set members, grouped by the position of their first member
+    starts = profiles.indptr[filled]
+    block_edges = np.flatnonzero(np.diff(starts // ENTRY_BATCH)) + 1
+    for block in np.split(np.arange(len(filled)), block_edges):
+        block_rows = filled[block]
+        first, last = profiles.indptr[block_rows[0]], profiles.indptr[block_rows[-1] + 1]
+        columns = profiles.indices[first:last].astype(np.uint64)
+        for start in range(0, n_hashes, HASH_BATCH):
+            end = min(start + HASH_BATCH, n_hashes)
+            hashes = (columns[:, None] * multipliers[None, start:end] + offsets[None, start:end]) % PRIME
+            signatures[block_rows, start:end] = np.minimum.reduceat(hashes, starts[block] - first, axis=0)
+
+    return signatures
+
+
+def lsh_candidate_pairs(signatures, bands, rows):
+    """
+    Finds the pairs of rows with identical signatures in at least one band
+
+    :param signatures: N x (bands * rows) array of MinHash signatures, rows with empty sets (PRIME) are never paired
+    :param bands: number of bands
+    :param rows: number of hashes in each band
+    :return: arrays of the first and second row of each distinct pair, first < second
+    """
+    filled = np.flatnonzero(signatures[:, 0] != PRIME) if len(signatures) else np.zeros(0, dtype=np.int64)
+    pair_codes = []
+    for band in range(bands):
+        keys = np.zeros(len(filled), dtype=np.uint64)
+        for value in signatures[filled, band * rows:(band + 1) * rows].T:
+            keys = keys * BAND_MULTIPLIER + value  # wraps around, a collision only adds a candidate
+
+        # rows in the same bucket are adjacent once sorted, pair each row with every later row of its bucket
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        for distance in range(1, len(order)):
+            same = sorted_keys[distance:] == sorted_keys[:-distance]
+            if not same.any():
+                break
+            first, second = filled[order[:-distance][same]], filled[order[distance:][same]]
+            pair_codes.append(np.minimum(first, second) * len(signatures) + np.maximum(first, second))
+
+    pair_codes = np.unique(np.concatenate(pair_codes)) if pair_codes else np.zeros(0, dtype=np.int64)
+    return pair_codes // max(len(signatures), 1), pair_codes % max(len(signatures), 1)
@@ -0,0 +1,182 @@
+"""
+Instrumentation of the stages of each command. A stage records its wall time, CPU time, peak resident memory and
+counts of the items it processed (reads, contigs, hits...). Profiling is off unless enabled by the global --profile
+option, in which case the records of the main process are kept in memory and pool workers, which inherit the
+environment, append their records to a JSON lines file that is merged into the report when the command finishes.
+"""
+import functools
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+PROFILE_ENV = 'NLR_ASSEMBLER_PROFILE'  # path of the JSON lines file workers append their records to
+
+_state = {'pid': None, 'records': [], 'stack': [], 'started': None}
+
+
+def _rss_mb(field):
+    """Resident memory of this process from /proc (VmRSS or VmHWM), None if /proc is not available"""
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith(field):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _peak_rss_mb():
+    """Peak resident memory since the last reset, or since the process started where it can not be reset"""
+    peak = _rss_mb('VmHWM')
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak /= 2 ** 20 if sys.platform == 'darwin' else 1024  # bytes on macOS, kilobytes on Linux
+    return peak
+
+
+def _reset_peak_rss():
+    """Resets the peak resident memory of this process (Linux only)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except OSError:
+        pass
+
+
+def profiling_enabled():
+    return _state['pid'] == os.getpid() or PROFILE_ENV in os.environ
+
+
+def enable_profiling(report):
+    """
+    Starts recording the stages of this process and of any worker process started afterwards
+
+    :param report: path of the JSON report written by write_report()
+    """
+    _state.update(pid=os.getpid(), records=[], stack=[], started=time.time())
+    os.environ[PROFILE_ENV] = f'{os.path.abspath(report)}.workers.jsonl'
+    if os.path.exists(os.environ[PROFILE_ENV]):
+        os.remove(os.environ[PROFILE_ENV])
+
+
+def _save_record(record):
+    if _state['pid'] == os.getpid():
+        _state['records'].append(record)
+    else:  # worker process, a single short write so records of concurrent workers are not interleaved
+        with open(os.environ[PROFILE_ENV], 'a') as file:
+            file.write(json.dumps(record) + '\n')
+
+
+@contextmanager
+def stage(name):
+    """
+    Records a stage of a command, nested stages are recorded separately
+
+    :param name: name of the stage
+    :return: context manager yielding the dictionary of item counts of the stage
+    """
+    if not profiling_enabled():
+        yield {}
+        return
+
+    # the peak memory of enclosing stages is carried over before it is reset for this stage
+    peak = _peak_rss_mb()
+    for frame in _state['stack']:
+        frame['peak'] = max(frame['peak'], peak)
+    _reset_peak_rss()
+
+    frame = {'peak': 0, 'items': {}}
+    _state['stack'].append(frame)
+    started, wall, cpu = time.time(), time.perf_counter(), time.process_time()
+    try:
+        yield frame['items']
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        _state['stack'].pop()
+        peak = max(frame['peak'], _peak_rss_mb())
+        for parent in _state['stack']:
+            parent['peak'] = max(parent['peak'], peak)
+        _save_record({'stage': name, 'pid': os.getpid(), 'started': started, 'wall_seconds': wall,
+                      'cpu_seconds': cpu, 'peak_rss_mb': peak, 'items': frame['items']})
+
+
+def count_items(**counts):
+    """Adds item counts (e.g. reads=1000) to the innermost stage being recorded"""
+    if _state['stack']:
+        items = _state['stack'][-1]['items']
+        for key, count in counts.items():
+            items[key] = items.get(key, 0) + int(count)
+
+
+def profiled(counts=None):
+    """
+    Decorator recording every call of a function as a stage named after the function
+
+    :param counts: optional function of the return value giving a dictionary of item counts
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiling_enabled():
+                return function(*args, **kwargs)
+            with stage(function.__name__):
+                result = function(*args, **kwargs)
+                if counts is not None:
+                    count_items(**counts(result))
+                return result
+        return wrapper
+    return decorator
+
+
+def summarise(records):
+    """
+    :param records: list of stage records
+    :return: dictionary of stage: number of calls, total wall and CPU time, largest peak memory and total item counts
+    """
+    summary = {}
+    for record in records:
+        total = summary.setdefault(record['stage'], {'calls': 0, 'wall_seconds': 0, 'cpu_seconds': 0,
+                                                     'peak_rss_mb': 0, 'items': {}})
+        total['calls'] += 1
+        total['wall_seconds'] += record['wall_seconds']
+        total['cpu_seconds'] += record['cpu_seconds']
+        total['peak_rss_mb'] = max(total['peak_rss_mb'], record['peak_rss_mb'])
+        for key, count in record['items'].items():
+            total['items'][key] = total['items'].get(key, 0) + count
+    return summary
+
+
+def write_report(report, command=None):
+    """
+    Writes the records of the main process and its workers to a JSON report
+
+    :param report: path of the report
+    :param command: command line of the run
+    """
+    worker_file = os.environ.pop(PROFILE_ENV, None)
+    worker_records = []
+    if worker_file is not None and os.path.exists(worker_file):
+        with open(worker_file) as file:
+            worker_records = [json.loads(line) for line in file if line.strip()]
+        os.remove(worker_file)
+
+    started = _state['started']
+    records = sorted(_state['records'] + worker_records, key=lambda record: record['started'])
+    for record in records:
+        record['worker'] = record['pid'] != _state['pid']
+        record['started'] = record['started'] - started  # seconds since the command started
+
+    main_records = [record for record in records if not record['worker']]
+    peak = max([_peak_rss_mb()] + [record['peak_rss_mb'] for record in main_records])
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    with open(report, 'w') as file:
+        json.dump({'command': command, 'wall_seconds': time.time() - started,
+                   'cpu_seconds': self_usage.ru_utime + self_usage.ru_stime,
+                   'worker_cpu_seconds': children.ru_utime + children.ru_stime, 'peak_rss_mb': peak,
+                   'stages': summarise(records), 'records': records}, file, indent=2)
+    _state['pid'] = None
@@ -0,0 +1,167 @@
+"""
+A local server that keeps large inputs (barcode whitelists and indexes) resident between runs. Commands given --server
+send their command line and working directory over a Unix domain socket, and the server runs each command line in a
+forked copy of itself, so the resident inputs and the modules already imported are shared with every run. The output of
+the run is streamed back over the socket followed by a NUL byte and the exit status.
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import traceback
+
+import click
+
+STATUS_MARKER = b'\0'
+BUFFER_SIZE = 1 << 16
+
+_resident = {}  # (kind, file key): object loaded by the server
+
+
+def file_key(path):
+    """Identifies a file by its absolute path, size and modification time, so a changed file is never matched"""
+    status = os.stat(path)
+    return os.path.abspath(path), status.st_size, status.st_mtime_ns
+
+
+def keep_resident(kind, path, value):
+    """
+    Keeps an object loaded from a file for the runs of the server
+
+    :param kind: kind of object, e.g. whitelist or index
+    :param path: path of the file the object was loaded from
+    :param value: the loaded object
+    """
+    _resident[(kind, file_key(path))] = value
+
+
+def resident(kind, path):
+    """
+    :param kind: kind of object
+    :param path: path of the file the object is loaded from
+    :return: the object kept by the server for the unchanged file, None if there is none
+    """
+    if not _resident:
+        return None
+    try:
+        return _resident.get((kind, file_key(path)))
+    except OSError:
+        return None
+
+
+def strip_server_option(argv):
+    """:return: the command line without --server and its value"""
+    stripped = []
+    skip = False
+    for argument in argv:
+        if skip:
+            skip = False
+        elif argument == '--server':
+            skip = True
+        elif not argument.startswith('--server='):
+            stripped.append(argument)
+    return stripped
+
+
+def run_on_server(socket_path, argv=None):
+    """
+    Runs the command line of this process on a server and writes its output to stdout
+
+    :param socket_path: Unix domain socket the server listens on
+    :param argv: command line without the program, sys.argv[1:] by default
+    :return: exit status of the run
+    """
+    argv = strip_server_option(sys.argv[1:] if argv is None else argv)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(socket_path)
+        except OSError as error:
+            raise click.ClickException(f"can not connect to the server at {socket_path}: {error}")
+        connection.sendall(json.dumps({'argv': argv, 'cwd': os.getcwd()}).encode() + b'\n')
+
+        output = sys.stdout.buffer
+        received = b''
+        while True:
+            data = connection.recv(BUFFER_SIZE)
+            if not data:
+                break
+            received += data
+            # hold back everything from a possible status marker until the connection is closed
+            marker = received.find(STATUS_MARKER)
+            output.write(received if marker < 0 else received[:marker])
+            received = b'' if marker < 0 else received[marker:]
+            output.flush()
+
+    if not received.startswith(STATUS_MARKER):
+        logging.error("the server closed the connection before the command finished")
+        return 1
+    return int(received[len(STATUS_MARKER):] or 1)
+
+
+class _RunHandler(socketserver.StreamRequestHandler):
+    """Runs one command line in the forked child handling the connection"""
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        status = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # the output of the run, including any worker processes it starts, goes straight to the client
+        for stream in (1, 2):
+            os.dup2(self.connection.fileno(), stream)
+        os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+        try:
+            os.chdir(request['cwd'])
+            if request['argv'][:1] == ['serve']:
+                raise click.UsageError("a server can not start another server")
+            self.server.command.main(args=request['argv'], prog_name='main.py', standalone_mode=False)
+            status = 0
+        except click.ClickException as error:
+            error.show()
+            status = error.exit_code
+        except click.exceptions.Exit as error:
+            status = error.exit_code
+        except click.Abort:
+            status = 1
+        except SystemExit as error:
+            status = error.code if isinstance(error.code, int) else int(error.code is not None)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            self.connection.sendall(STATUS_MARKER + str(status).encode())
+
+
+class _ForkingUnixServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def serve(socket_path, command):
+    """
+    Listens on a Unix domain socket and runs the command line of each connection in a forked child
+
+    :param socket_path: path of the socket, replaced if it exists
+    :param command: click command (group) the command lines are run with
+    """
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    umask = os.umask(0o177)  # only the user running the server can connect
+    try:
+        server = _ForkingUnixServer(socket_path, _RunHandler)
+    finally:
+        os.umask(umask)
+    server.command = command
+    signal.signal(signal.SIGTERM, signal.default_int_handler)  # stop cleanly when terminated
+
+    logging.info(f"listening on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("stopping the server")
+    finally:
+        server.server_close()
+        os.remove(socket_path)
@@ -0,0 +1,61 @@
+"""
+Numpy arrays published in a single block of shared memory, so pool workers can attach to large read-only arrays without
+each receiving a pickled copy. The block is described by a small picklable descriptor passed to each worker.
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+ALIGNMENT = 64
+
+
+class SharedArrays:
+    """
+    A block of shared memory holding a dictionary of arrays, owned (and removed on close) by the process creating it
+
+    Attributes
+    ----------
+    descriptor: picklable (block name, [(key, dtype, shape, offset)]) used to attach to the arrays
+
+    Methods
+    -------
+    close()
+        releases and removes the block of shared memory
+    """
+
+    def __init__(self, arrays):
+        layout = []
+        offset = 0
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            layout.append((key, array.dtype.str, array.shape, offset))
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+        self._memory = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for (key, dtype, shape, start), array in zip(layout, arrays.values()):
+            np.ndarray(shape, dtype=dtype, buffer=self._memory.buf, offset=start)[...] = array
+        self.descriptor = (self._memory.name, layout)
+
+    def close(self):
+        self._memory.close()
+        self._memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def attach_arrays(descriptor):
+    """
+    :param descriptor: descriptor of a SharedArrays block
+    :return: the SharedMemory block, which must be kept open while the arrays are used, and the dictionary of arrays
+    """
+    name, layout = descriptor
+    memory = shared_memory.SharedMemory(name=name)
+    arrays = {key: np.ndarray(shape, dtype=dtype, buffer=memory.buf, offset=offset)
+              for key, dtype, shape, offset in layout}
+    for array in arrays.values():
+        array.flags.writeable = False
+    return memory, arrays
@@ -0,0 +1,209 @@
+"""
+Top-k cosine similarity of sparse profiles. Rows are compared in blocks of sparse matrix products so that only the k
+most similar neighbours of each row are kept, memory use grows linearly with the number of rows and blocks can be
+spread over a process pool.
+"""
+from collections import namedtuple
+from multiprocessing import get_context
+
+import numpy as np
+from scipy import sparse
+
+from utils.minhash import lsh_candidate_pairs, minhash_signatures
+from utils.profiling import count_items, profiled
+
+BLOCK_ENTRIES = 10000000  # approximate number of similarities computed per block
+PAIR_BATCH = 100000  # candidate pairs compared at a time by approximate_top_k_neighbours
+
+NeighbourTable = namedtuple('NeighbourTable', ['contigs', 'indices', 'similarities'])
+NeighbourTable.__doc__ = """
+The k most similar contigs to each contig (including itself)
+
+contigs: list of contigs
+indices: N x k array of the row of each neighbour, ordered by descending similarity (ties by ascending row)
+similarities: N x k array of the cosine similarity of each neighbour
+"""
+
+_worker_state = {}
+
+
+def l2_normalized(profiles):
+    """
+    :param profiles: N x M sparse matrix
+    :return: CSR copy of profiles with each non-zero row scaled to unit length
+    """
+    # scikit-learn is imported on first use, the pool workers import this module for _block_top_k and only need scipy
+    from sklearn.preprocessing import normalize
+    return normalize(profiles, copy=True).tocsr()
+
+
+def tfidf_transformer():
+    """:return: a new scikit-learn TfidfTransformer, imported on first use as in l2_normalized()"""
+    from sklearn.feature_extraction.text import TfidfTransformer
+    return TfidfTransformer()
+
+
+def _init_worker(normalized, transposed, k):
+    _worker_state['normalized'] = normalized
+    _worker_state['transposed'] = transposed
+    _worker_state['k'] = k
+
+
+@profiled()
+def _block_top_k(block):
+    """Top-k neighbours of the rows in a block using the matrices stored by _init_worker"""
+    start, end = block
+    count_items(contigs=end - start)
+    products = _worker_state['normalized'][start:end] @ _worker_state['transposed']
+    return block_top_k(products, _worker_state['k'])
+
+
+def block_top_k(products, k):
+    """
+    Selects the k largest values in each row of a sparse matrix of similarities. Ties are broken by ascending column and
+    rows with fewer than k non-zero values are padded with zeros from the lowest columns not already selected, the same
+    order pandas' nlargest selects values from a dense column.
+
+    :param products: B x N sparse matrix of similarities
+    :param k: number of neighbours to keep
+    :return: B x k arrays of neighbour columns and similarities
+    """
+    products = products.tocsr()
+    products.eliminate_zeros()
+    n_rows = products.shape[0]
+    rows = np.repeat(np.arange(n_rows), np.diff(products.indptr))
+    order = np.lexsort((products.indices, -products.data, rows))
+    rank = np.arange(len(order)) - products.indptr[rows[order]]
+    keep = order[rank < k]
+
+    indices = np.full((n_rows, k), -1, dtype=np.int64)
+    similarities = np.zeros((n_rows, k), dtype=np.float64)
+    kept_rows = rows[keep]
+    kept_rank = np.arange(len(keep)) - np.searchsorted(kept_rows, kept_rows)
+    indices[kept_rows, kept_rank] = products.indices[keep]
+    similarities[kept_rows, kept_rank] = products.data[keep]
+
+    # pad rows with fewer than k non-zero similarities
+    for row in np.flatnonzero(indices[:, -1] == -1):
+        selected = set(indices[row][indices[row] != -1])
+        padding = [column for column in range(k + len(selected)) if column not in selected]
+        n_selected = len(selected)
+        indices[row, n_selected:] = padding[:k - n_selected]
+
+    return indices, similarities
+
+
+def _top_k_rows(queries, transposed, k, cores=1):
+    """Top-k neighbours of each row of queries among the columns of transposed, both normalized"""
+    n_rows, n_columns = queries.shape[0], transposed.shape[1]
+    block_size = max(1, min(n_rows, BLOCK_ENTRIES // max(n_columns, 1)))
+    blocks = [(start, min(start + block_size, n_rows)) for start in range(0, n_rows, block_size)]
+
+    if cores > 1 and len(blocks) > 1:
+        with get_context("spawn").Pool(processes=cores, initializer=_init_worker,
+                                       initargs=(queries, transposed, k)) as pool:
+            results = pool.map(_block_top_k, blocks)
+    else:
+        _init_worker(queries, transposed, k)
+        results = [_block_top_k(block) for block in blocks]
+        _worker_state.clear()
+
+    indices = np.concatenate([result[0] for result in results]) if results else np.zeros((0, k), dtype=np.int64)
+    similarities = np.concatenate([result[1] for result in results]) if results else np.zeros((0, k))
+    return indices, similarities
+
+
+def top_k_neighbours(contigs, profiles, k, cores=1):
+    """
+    Calculates the k most similar profiles to each profile by cosine similarity. The similarities are identical to the
+    values of sklearn's cosine_similarity.
+
+    :param contigs: list of contigs, one for each row of profiles
+    :param profiles: N x M sparse matrix of (weighted) profiles
+    :param k: number of neighbours to keep for each contig
+    :param cores: number of processes used to calculate blocks of similarities
+    :return: a NeighbourTable
+    """
+    k = min(k, profiles.shape[0])
+    normalized = l2_normalized(profiles)
+    indices, similarities = _top_k_rows(normalized, normalized.T.tocsr(), k, cores)
+    return NeighbourTable(list(contigs), indices, similarities)
+
+
+def update_top_k_neighbours(neighbour_table, contigs, profiles, changed_rows, k, cores=1):
+    """
+    Updates the k most similar profiles to each profile after some profiles changed. Only the rows of contigs whose
+    profile changed, that share a column with a changed profile or that had a changed profile among their neighbours are
+    recalculated, the neighbours of every other contig are kept.
+
+    :param neighbour_table: NeighbourTable of the profiles before they changed
+    :param contigs: list of contigs, the contigs of neighbour_table followed by any new contigs
+    :param profiles: N x M sparse matrix of the (weighted) profiles of contigs
+    :param changed_rows: array of the rows whose profile changed, rows of new contigs are always recalculated
+    :param k: number of neighbours to keep for each contig
+    :param cores: number of processes used to calculate blocks of similarities
+    :return: the updated NeighbourTable and an array of the rows that were recalculated
+    """
+    n_rows, n_previous = profiles.shape[0], len(neighbour_table.contigs)
+    k = min(k, n_rows)
+    changed = np.zeros(n_rows, dtype=bool)
+    changed[changed_rows] = True
+    changed[n_previous:] = True
+    if neighbour_table.indices.shape[1] != k or changed.all():
+        return top_k_neighbours(contigs, profiles, k, cores), np.arange(n_rows)
+
+    normalized = l2_normalized(profiles)
+    entry_rows = np.repeat(np.arange(n_rows), np.diff(normalized.indptr))
+    changed_columns = np.zeros(normalized.shape[1], dtype=bool)
+    changed_columns[normalized.indices[changed[entry_rows]]] = True
+
+    affected = changed.copy()
+    affected[entry_rows[changed_columns[normalized.indices]]] = True  # similarity to a changed profile is not zero
+    affected[:n_previous] |= (changed[neighbour_table.indices] & (neighbour_table.similarities > 0)).any(axis=1)
+    rows = np.flatnonzero(affected)
+
+    indices = np.zeros((n_rows, k), dtype=np.int64)
+    similarities = np.zeros((n_rows, k), dtype=np.float64)
+    indices[:n_previous] = neighbour_table.indices
+    similarities[:n_previous] = neighbour_table.similarities
+    indices[rows], similarities[rows] = _top_k_rows(normalized[rows], normalized.T.tocsr(), k, cores)
+    return NeighbourTable(list(contigs), indices, similarities), rows
+
+
+@profiled(lambda neighbour_table: {'contigs': len(neighbour_table.contigs)})
+def approximate_top_k_neighbours(contigs, profiles, k, bands=64, rows=2, seed=22):
+    """
+    Approximates the k most similar profiles to each profile. The barcode set of each profile is sketched with MinHash
+    and only the pairs of profiles sharing the sketch of at least one LSH band are compared, by exact cosine similarity.
+    Neighbours that are not candidates are missed, so pairs with a low Jaccard similarity of their barcode sets may be
+    missing from the table (see utils.minhash).
+
+    :param contigs: list of contigs, one for each row of profiles
+    :param profiles: N x M sparse matrix of (weighted) profiles
+    :param k: number of neighbours to keep for each contig
+    :param bands: number of LSH bands
+    :param rows: number of MinHash values in each band
+    :param seed: seed of the MinHash functions
+    :return: a NeighbourTable
+    """
+    n_rows = profiles.shape[0]
+    k = min(k, n_rows)
+    normalized = l2_normalized(profiles)
+
+    first, second = lsh_candidate_pairs(minhash_signatures(normalized, bands * rows, seed), bands, rows)
+    count_items(candidate_pairs=len(first))
+    similarities = np.concatenate([np.asarray(normalized[first[start:start + PAIR_BATCH]].multiply(
+        normalized[second[start:start + PAIR_BATCH]]).sum(axis=1)).ravel()
+        for start in range(0, len(first), PAIR_BATCH)] + [np.zeros(0)])
+
+    # symmetric matrix of the similarities of the candidate pairs and of each profile to itself
+    self_similarities = np.asarray(normalized.multiply(normalized).sum(axis=1)).ravel()
+    products = sparse.csr_matrix((np.concatenate([similarities, similarities, self_similarities]),
+                                  (np.concatenate([first, second, np.arange(n_rows)]),
+                                   np.concatenate([second, first, np.arange(n_rows)]))), shape=(n_rows, n_rows))
+
+    block_size = max(1, min(n_rows, BLOCK_ENTRIES // max(n_rows, 1)))
+    results = [block_top_k(products[start:start + block_size], k) for start in range(0, n_rows, block_size)]
+    indices = np.concatenate([result[0] for result in results]) if results else np.zeros((0, k), dtype=np.int64)
+    similarities = np.concatenate([result[1] for result in results]) if results else np.zeros((0, k))
+    return NeighbourTable(list(contigs), indices, similarities)